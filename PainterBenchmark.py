@@ -0,0 +1,321 @@
+import argparse
+import json
+import math
+import platform
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+import module.FrameIO as FrameIO
+import module.PainterMenu as PM
+import PainterModule as painter_module
+
+from module.BucketFill import BucketFill
+from module.CanvasCompositor import CanvasCompositor
+from module.ColorMenu import ColorMenu
+from module.FramePool import FramePool
+from module.IconCache import IconCache
+from module.InferenceWorker import prepare_input
+
+# Per-stage and whole-loop timings of the painter frame pipeline on synthetic frames and
+# canned landmarks. Results are written as JSON and can be compared against a baseline:
+#   python PainterBenchmark.py --output bench.json --save-baseline benchmarks/baseline.json
+#   python PainterBenchmark.py --baseline benchmarks/baseline.json
+
+RESOLUTIONS = [(640, 480), (800, 600), (1280, 720), (1920, 1080)]
+TOOL_COUNTS = [4, 8]
+LAYER_COUNT = 4
+# (capture, canvas, display) sizes of the resolution-decoupled loop
+MIXED_RESOLUTIONS = [((1280, 720), (3840, 2160), (1920, 1080)), ((640, 480), (1920, 1440), (1280, 960))]
+DEFAULT_TOLERANCE = 0.25  # allowed slowdown of a stage's median before it counts as a regression
+ALLOCATION_BUDGET = 16 * 1024  # bytes a steady-state frame may allocate (median), a frame is > 900 KB
+
+
+def synthetic_hand(cx, cy, index_up=True, middle_up=False):
+    # 21 (x, y) landmarks around (cx, cy), thumb down, index/middle up as asked, rest curled
+    hand = [[cx, cy + 100] for _ in range(21)]
+    for joint in range(1, 5):
+        hand[joint] = [cx - 40 + joint * 5, cy + 60]
+
+    for finger, base in enumerate([5, 9, 13, 17]):
+        up = (finger == 0 and index_up) or (finger == 1 and middle_up)
+        for joint in range(4):
+            hand[base + joint] = [cx + finger * 20, cy + 40 - (joint * 20 if up else -joint * 5)]
+    return hand
+
+
+def synthetic_landmark_log(frame_size, frames, hold_every=60):
+    # index finger painting a circle, with a short hold gesture every hold_every frames
+    width, height = frame_size
+    radius = min(width, height) // 4
+    records = []
+    for frame in range(frames):
+        angle = 2 * math.pi * frame / frames
+        cx, cy = int(width / 2 + radius * math.cos(angle)), int(height / 2 + radius * math.sin(angle))
+        hold = frame % hold_every >= hold_every - 5
+        records.append({'hands': [synthetic_hand(cx, cy, middle_up=hold)], 'handedness': [['Right', 1.0]]})
+    return {'frame_size': [width, height], 'records': records}
+
+
+def synthetic_frame(frame_size, seed=0):
+    width, height = frame_size
+    return np.random.default_rng(seed).integers(0, 256, (height, width, 3), dtype=np.uint8)
+
+
+def menu_items(count):
+    return [painter_module.MENU_ITEMS[idx % len(painter_module.MENU_ITEMS)] for idx in range(count)]
+
+
+def measure(fn, iterations, warmup=5):
+    for _ in range(warmup):
+        fn()
+
+    samples = np.empty(iterations, np.float64)
+    for idx in range(iterations):
+        start = time.perf_counter()
+        fn()
+        samples[idx] = time.perf_counter() - start
+
+    samples *= 1000.0
+    return {
+        'median_ms': float(np.median(samples)),
+        'p95_ms': float(np.percentile(samples, 95)),
+        'mean_ms': float(samples.mean()),
+        'iterations': iterations
+    }
+
+
+def stage_benchmarks(frame_size, iterations):
+    width, height = frame_size
+    frame = synthetic_frame(frame_size)
+    img = frame.copy()
+    results = {}
+
+    results['flip'] = measure(lambda: cv2.flip(frame, 1), iterations)
+
+    # startup cost of the menu, decoding the icons or taking them from a primed IconCache
+    build_iterations = max(iterations // 10, 5)
+    results['menu_build'] = measure(lambda: PM.Menu(cv2, painter_module.MENU_ITEMS, width=width, height=height),
+                                    build_iterations)
+    icons = IconCache(None)
+    results['menu_build_cached'] = measure(
+        lambda: PM.Menu(cv2, painter_module.MENU_ITEMS, width=width, height=height, icons=icons), build_iterations)
+
+    menu = PM.Menu(cv2, painter_module.MENU_ITEMS, width=width, height=height)
+    results['menu_draw'] = measure(lambda: menu.draw(cv2, img), iterations)
+
+    # holding the fingers over the already selected item, every frame of a hold gesture
+    hover = tuple((a + b) // 2 for a, b in zip(*menu.current_item.hit_box))
+
+    def menu_hover():
+        menu.select_menu_item_if_possible(cv2, hover)
+        menu.draw(cv2, img)
+    results['menu_hover'] = measure(menu_hover, iterations)
+
+    def overlay_all():
+        for item in menu.menuItems:
+            PM.Menu.transparent_overlay(img, item.sprite, pos=item.hit_box[0])
+    results['transparent_overlay'] = measure(overlay_all, iterations)
+
+    color_menu = ColorMenu(frame_size, painter_module.COLOR_ITEMS, start_point=(width, 0))
+    results['color_menu_draw'] = measure(lambda: color_menu.draw(cv2, img), iterations)
+
+    try:
+        import module.HandTrackingModule as htm
+        detector = htm.HandDetector(min_detection_confidence=0.7)
+    except ImportError:
+        detector = None
+    if detector is not None:
+        results['find_hand'] = measure(lambda: detector.find_hand_array(img, draw=False), iterations)
+        detector.close()
+
+    log = synthetic_landmark_log(frame_size, iterations + 5)
+    replay = FrameIO.ReplayDetector(log)
+
+    def gestures():
+        replay.find_hand_array(img, draw=False)
+        return replay.fingers_states()
+    results['gestures'] = measure(gestures, iterations)
+
+    compositor = CanvasCompositor(frame_size)
+    points = [hand[0][8] for hand in (record['hands'] for record in log['records'])]
+    stroke = {'idx': 1}
+
+    def draw_stroke():
+        idx = stroke['idx'] % len(points)
+        compositor.line(tuple(points[idx - 1]), tuple(points[idx]), (255, 0, 255), 10)
+        stroke['idx'] += 1
+    results['canvas_stroke'] = measure(draw_stroke, iterations)
+
+    def compose():
+        draw_stroke()
+        compositor.compose(img)
+    results['compositing'] = measure(compose, iterations)
+
+    # the same stroke on the top one of four layers, only its rect is re-flattened
+    layered = CanvasCompositor(frame_size)
+    for _ in range(LAYER_COUNT - 1):
+        layered.add_layer()
+
+    def compose_layered():
+        idx = stroke['idx'] % len(points)
+        layered.line(tuple(points[idx - 1]), tuple(points[idx]), (255, 0, 255), 10)
+        stroke['idx'] += 1
+        layered.compose(img)
+    results[f'compositing_{LAYER_COUNT}_layers'] = measure(compose_layered, iterations)
+
+    canvas = compositor.canvas
+
+    def compose_full_frame():
+        img_gray = cv2.cvtColor(canvas, cv2.COLOR_BGR2GRAY)
+        _, img_inverse = cv2.threshold(img_gray, 127, 255, cv2.THRESH_BINARY_INV)
+        img_inverse = cv2.cvtColor(img_inverse, cv2.COLOR_GRAY2BGR)
+        cv2.bitwise_or(cv2.bitwise_and(img, img_inverse), canvas)
+    results['compositing_full_frame'] = measure(compose_full_frame, iterations)
+
+    # worst case fill: the whole canvas outside the painted circle
+    bucket = BucketFill()
+    results['bucket_fill'] = measure(lambda: bucket.fill(canvas, (0, 0)), iterations)
+    bucket.close()
+
+    return results
+
+
+def loop_benchmark(frame_size, tool_count, iterations, canvas_size=None, display_size=None):
+    frame = synthetic_frame(frame_size)
+    img = frame.copy()
+    log = synthetic_landmark_log(frame_size, iterations + 5)
+    detector = FrameIO.ReplayDetector(log)
+    painter = painter_module.Painter(frame_size, canvas_size=canvas_size or frame_size, display_size=display_size,
+                                     menu_items=menu_items(tool_count))
+
+    def one_frame():
+        np.copyto(img, frame)
+        painter.process(img, detector)
+    timing = measure(one_frame, iterations)
+    painter.close()
+    return timing
+
+
+def allocation_benchmark(frame_size, iterations, warmup=20):
+    # bytes allocated while running one frame of the loop (the inference input included),
+    # measured as tracemalloc's peak above the usage at the start of the frame
+    frame = synthetic_frame(frame_size)
+    img = frame.copy()
+    log = synthetic_landmark_log(frame_size, warmup + iterations + 5)
+    detector = FrameIO.ReplayDetector(log)
+    painter = painter_module.Painter(frame_size, canvas_size=frame_size)
+    buffers = FramePool()
+    full_frame = (0, 0, frame_size[0], frame_size[1])
+
+    def one_frame():
+        np.copyto(img, frame)
+        prepare_input(img, full_frame, buffers=buffers)
+        painter.process(img, detector)
+
+    for _ in range(warmup):
+        one_frame()
+
+    samples = np.empty(iterations, np.int64)
+    tracemalloc.start()
+    try:
+        for idx in range(iterations):
+            start = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            one_frame()
+            samples[idx] = tracemalloc.get_traced_memory()[1] - start
+    finally:
+        tracemalloc.stop()
+        painter.close()
+
+    return {
+        'median_bytes': int(np.median(samples)),
+        'max_bytes': int(samples.max()),  # includes undo snapshots taken when a stroke ends
+        'iterations': iterations
+    }
+
+
+def run_benchmarks(iterations, resolutions=RESOLUTIONS, tool_counts=TOOL_COUNTS):
+    results = {}
+    allocations = {}
+    for frame_size in resolutions:
+        label = f'{frame_size[0]}x{frame_size[1]}'
+        for stage, timing in stage_benchmarks(frame_size, iterations).items():
+            results[f'{stage}@{label}'] = timing
+        for tool_count in tool_counts:
+            results[f'loop@{label}/tools={tool_count}'] = loop_benchmark(frame_size, tool_count, iterations)
+        allocations[f'loop@{label}'] = allocation_benchmark(frame_size, iterations)
+
+    for capture_size, canvas_size, display_size in MIXED_RESOLUTIONS:
+        label = '/'.join(f'{width}x{height}' for width, height in (capture_size, canvas_size, display_size))
+        results[f'loop@{label}'] = loop_benchmark(capture_size, TOOL_COUNTS[0], iterations, canvas_size, display_size)
+
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'opencv': cv2.__version__,
+            'machine': platform.machine(),
+            'platform': platform.platform(),
+            'iterations': iterations
+        },
+        'results': results,
+        'allocations': allocations
+    }
+
+
+def compare(report, baseline, tolerance=DEFAULT_TOLERANCE):
+    # list of (name, baseline_ms, current_ms) for stages slower than baseline by more than tolerance
+    regressions = []
+    for name, timing in report['results'].items():
+        reference = baseline['results'].get(name)
+        if reference is None:
+            continue
+        if timing['median_ms'] > reference['median_ms'] * (1.0 + tolerance):
+            regressions.append((name, reference['median_ms'], timing['median_ms']))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Virtual Painter pipeline benchmark')
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='compare against this JSON file, exit 1 on regressions')
+    parser.add_argument('--save-baseline', help='also write the results as a new baseline')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    report = run_benchmarks(args.iterations)
+
+    for name, timing in report['results'].items():
+        print(f'{name:45s} median {timing["median_ms"]:8.3f} ms   p95 {timing["p95_ms"]:8.3f} ms')
+    for name, allocated in report['allocations'].items():
+        print(f'allocated {name:35s} median {allocated["median_bytes"]:8d} B    max {allocated["max_bytes"]:8d} B')
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w') as report_file:
+                json.dump(report, report_file, indent=2)
+
+    over_budget = [name for name, allocated in report['allocations'].items()
+                   if allocated['median_bytes'] > ALLOCATION_BUDGET]
+    for name in over_budget:
+        print(f'ALLOCATION {name}: {report["allocations"][name]["median_bytes"]} B per frame, '
+              f'budget {ALLOCATION_BUDGET} B')
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(report, json.load(baseline_file), args.tolerance)
+        for name, before, after in regressions:
+            print(f'REGRESSION {name}: {before:.3f} ms -> {after:.3f} ms')
+        if regressions:
+            return 1
+
+    return 1 if over_budget else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,12 +1,34 @@
-import cv2
 import time
+
+# taken before the heavy imports below, startup times are measured from here
+START_TIME = time.perf_counter()
+
+import argparse
+import cv2
 import numpy as np
+import os
 
+import module.FrameIO as FrameIO
 import module.HandTrackingModule as htm
 import module.PainterMenu as PM
 import math
 
+from module.BucketFill import BucketFill
+from module.CanvasAutosave import CanvasAutosave, read_checkpoint
+from module.CanvasCompositor import CanvasCompositor
+from module.CanvasHistory import CanvasHistory
+from module.FramePool import FramePool
+from module.IconCache import IconCache
+from module.InferenceScheduler import InferenceScheduler
+from module.Metrics import NULL_METRICS, JsonLinesExporter, Metrics, PrometheusEndpoint
+from module.PaintingServer import PaintingClient, PaintingServer, parse_address
+from module.SessionRecorder import POLICIES as RECORD_POLICIES, SessionRecorder
+from module.Startup import BackgroundDetector, StartupTimer
+from module.StrokeStore import StrokeStore
+from module.TileStore import TileStore
 from module.ColorMenu import ColorMenu
+from module.PalettePicker import PalettePicker
+from module.ScaleTransform import ScaleTransform
 
 # Frame Size
 SCREEN_WIDTH = 800
@@ -21,6 +43,65 @@ THUMB_TIP = 4
 INDEX_TIP = 8
 MIDDLE_TIP = 12
 RING_TIP = 16
+TRACKED_TIPS = [THUMB_TIP, INDEX_TIP, MIDDLE_TIP, RING_TIP]
+
+# Resolutions of the pipeline stages as (width, height). The capture size is only requested
+# from the camera, the size it delivers is what counts; canvas and display follow it when
+# None. The inference resolution is MAX_INFERENCE_SIZE below.
+CAPTURE_SIZE = (SCREEN_WIDTH, SCREEN_HEIGHT)
+CANVAS_SIZE = None
+DISPLAY_SIZE = None
+
+# MediaPipe worker processes, 0 runs inference synchronously in the frame loop
+INFERENCE_WORKERS = 0
+
+# Server mode (--serve), SERVER_WORKERS MediaPipe processes are shared by all sessions, which
+# may send frames of up to SERVER_MAX_FRAME_SIZE and queue at most SERVER_QUEUE_SIZE of them.
+# Smaller frames than SERVER_MIN_FRAME_SIZE leave no room to lay out the menus.
+SERVER_WORKERS = 2
+SERVER_MAX_FRAME_SIZE = (1920, 1080)
+SERVER_MIN_FRAME_SIZE = (240, 180)
+SERVER_QUEUE_SIZE = 2
+SERVER_REPORT_INTERVAL = 5.0
+
+# Longer side in pixels of the image fed to MediaPipe (None keeps the camera size) and
+# whether to crop inference to the tracked hand, both trade accuracy for CPU time
+MAX_INFERENCE_SIZE = None
+TRACK_HAND_ROI = False
+
+# Skip inference on frames where the hand did not move, at most MAX_INFERENCE_RATE per second
+ADAPTIVE_INFERENCE = False
+MAX_INFERENCE_RATE = None
+
+# Infinite canvas, painted tiles of CANVAS_TILE_SIZE pixels are memory-mapped from
+# CANVAS_FILE (a temporary file when None), the view is panned in Hand mode
+INFINITE_CANVAS = True
+CANVAS_TILE_SIZE = 256
+CANVAS_FILE = None
+
+# Autosave, the tiles changed since the last checkpoint are appended to AUTOSAVE_FILE every
+# AUTOSAVE_INTERVAL seconds from a background thread; an existing file is restored on start
+AUTOSAVE_FILE = None
+AUTOSAVE_INTERVAL = 2.0
+
+# Undo history, tiles touched by a stroke are kept until the history exceeds this many bytes
+HISTORY_TILE_SIZE = 64
+HISTORY_MAX_BYTES = 64 * 1024 * 1024
+
+# Layers, "n" adds one, "l" cycles the active one, "v" hides it and "[" / "]" change its opacity
+LAYER_OPACITY_STEP = 0.1
+
+# Session recording (--record), frames wait in RECORD_QUEUE_SIZE slots for the encoder thread
+RECORD_FPS = 30
+RECORD_QUEUE_SIZE = 8
+RECORD_POLICY = 'drop'
+
+# Decoded and resized menu icons are kept in this file and rebuilt when an asset changes, None
+# decodes them on every start
+ICON_CACHE_FILE = 'assets/icons.cache.npz'
+
+# cv2.LINE_AA draws anti-aliased brush and eraser strokes
+BRUSH_LINE_TYPE = cv2.LINE_8
 
 # Controls the thickness of Eraser
 ERASER_THICKNESS = 40
@@ -45,7 +126,9 @@ MENU_ITEMS = [
     ('Brush', 'assets/brush.png', PM.MenuMode.paint),
     ('Thickness', 'assets/thickness.png', PM.MenuMode.thickness),
     ('Eraser', 'assets/eraser.png', PM.MenuMode.eraser),
-    ('Hand', 'assets/hand.png', PM.MenuMode.hand)
+    ('Hand', 'assets/hand.png', PM.MenuMode.hand),
+    ('Bucket', 'assets/bucket.png', PM.MenuMode.fill),
+    ('Palette', 'assets/palette.png', PM.MenuMode.color)
 ]
 
 COLOR_ITEMS = [
@@ -56,59 +139,233 @@ COLOR_ITEMS = [
 ]
 
 
-def main():
-    cap = cv2.VideoCapture(0)
-    cap.set(3, SCREEN_WIDTH)
-    cap.set(4, SCREEN_HEIGHT)
-
-    menu = PM.Menu(cv2, MENU_ITEMS, width=SCREEN_WIDTH, height=SCREEN_HEIGHT)
-
-    p_time = 0
+class Painter:
+    # Menus, canvas and brush state of one painting session. process() runs the gesture
+    # logic for one (already flipped) capture frame and returns the display frame with the
+    # canvas composited. Capture, canvas and display sizes are independent (canvas and
+    # display default to the capture size): landmarks are scaled into display pixels once
+    # per frame, where menus and gestures work, and into canvas pixels for drawing.
+
+    def __init__(self, frame_size, canvas_size=None, menu_items=MENU_ITEMS, color_items=COLOR_ITEMS,
+                 metrics=NULL_METRICS, infinite=INFINITE_CANVAS, canvas_file=CANVAS_FILE, display_size=None,
+                 autosave_file=AUTOSAVE_FILE, icon_cache=ICON_CACHE_FILE, sync_fill=False):
+        display_size = tuple(frame_size if display_size is None else display_size)
+        canvas_size = tuple(display_size if canvas_size is None else canvas_size)
+        display_width, display_height = display_size
+        canvas_width, canvas_height = canvas_size
+        self.display_size = display_size
+
+        self.capture_to_display = ScaleTransform(frame_size, display_size)
+        self.display_to_canvas = ScaleTransform(display_size, canvas_size)
+        self.display_landmarks = None  # int32 (hands, 21, 3), positions scaled into display pixels
+        self.num_hands = 0  # hands found in the last processed frame
+
+        icons = None if icon_cache is None else IconCache(icon_cache)
+        self.menu = PM.Menu(cv2, menu_items, width=display_width, height=display_height, on_select=self.tool_changed,
+                            icons=icons)
+        if icons is not None:
+            icons.save()
+        self.color_menu = ColorMenu((display_width, display_height), color_items, start_point=(display_width, 0))
+        self.palette = None  # PalettePicker, built the first time the palette is opened
+        self.picked_color = None
+        self.canvas_file = canvas_file
+        # layer tiles hold color and coverage
+        self.tiles = TileStore(CANVAS_TILE_SIZE, canvas_file, channels=4) if infinite else None
+        self.buffers = FramePool()  # per-frame scratch images, reused so the loop does not allocate
+        self.compositor = CanvasCompositor((canvas_width, canvas_height), tiles=self.tiles, buffers=self.buffers,
+                                           display_size=display_size, line_type=BRUSH_LINE_TYPE)
+        # strokes are recorded in board coordinates, they stay valid across pans
+        self.strokes = StrokeStore((canvas_width, canvas_height))
+        self.compositor.attach_history(CanvasHistory(self.compositor.active_layer.backings[0],
+                                                     HISTORY_TILE_SIZE, HISTORY_MAX_BYTES))
+        self.committed_strokes = 0
+        self.undo_gesture = False
+        self.bucket = BucketFill()
+        self.fill_gesture = False
+        # a fill lands on the frame that starts it instead of whenever its thread is done, so
+        # replays paint the same canvas every time
+        self.sync_fill = sync_fill
+
+        self.current_brush_thickness = DEFAULT_BRUSH_THICKNESS
+        self.xp, self.yp = -1, -1
+
+        self.metrics = metrics
+
+        self.autosave = None
+        if autosave_file is not None:
+            # refuses a file that is not an autosave before anything is restored from it
+            self.autosave = CanvasAutosave(autosave_file, CANVAS_TILE_SIZE, AUTOSAVE_INTERVAL)
+            self.restore(autosave_file)
+            self.compositor.autosave = self.autosave
+
+    def tool_changed(self, item):
+        self.metrics.count('tool_changes')
+
+    def add_layer(self):
+        # paints on a new empty layer on top of the others from now on
+        tiles = None
+        if self.tiles is not None:
+            path = None if self.canvas_file is None else f'{self.canvas_file}.layer{len(self.compositor.layers)}'
+            tiles = TileStore(CANVAS_TILE_SIZE, path, channels=4)
+        self.select_layer(self.compositor.add_layer(tiles))
+
+    def select_layer(self, index):
+        # strokes and fills in flight belong to the previous layer
+        self.apply_fill(wait=True)
+        self.end_stroke()
+        self.compositor.active = index % len(self.compositor.layers)
+
+    def toggle_layer(self):
+        layer = self.compositor.active_layer
+        self.compositor.set_layer(self.compositor.active, visible=not layer.visible)
+
+    def change_layer_opacity(self, delta):
+        layer = self.compositor.active_layer
+        self.compositor.set_layer(self.compositor.active, opacity=layer.opacity + delta)
+
+    def apply_fill(self, wait=False):
+        # a running fill was computed on the current canvas, it has to land before anything else is drawn
+        result = self.bucket.poll(wait)
+        if result is None:
+            return
+        mask, rect, color, (seed, bounds) = result
+        self.compositor.fill_mask(mask, rect, color)
+        self.strokes.fill(seed, color, bounds, self.compositor.active)
+        self.end_stroke()
+
+    def end_stroke(self):
+        # history entries remember the stroke store range they cover, so undo can hide it too
+        self.strokes.end_stroke()
+        if self.compositor.history.commit((self.committed_strokes, self.strokes.stroke_count)):
+            self.committed_strokes = self.strokes.stroke_count
+        self.xp, self.yp = -1, -1
+
+    def undo(self):
+        self.apply_fill(wait=True)
+        self.end_stroke()
+        meta = self.compositor.undo()
+        if meta is not None:
+            self.strokes.undo_to(meta[0])
+            self.committed_strokes = meta[0]
+
+    def redo(self):
+        self.apply_fill(wait=True)
+        self.end_stroke()
+        meta = self.compositor.redo()
+        if meta is not None:
+            self.strokes.redo_to(meta[1])
+            self.committed_strokes = self.strokes.stroke_count
+
+    def to_display(self, img, positions):
+        # scales the capture frame and the detected landmarks into the display resolution
+        transform = self.capture_to_display
+        if transform.identity:
+            return img, positions
+
+        width, height = transform.dst_size
+        display = self.buffers.get('display', (height, width, 3))
+        interpolation = cv2.INTER_AREA if transform.scale < 1 else cv2.INTER_LINEAR
+        cv2.resize(img, (width, height), dst=display, interpolation=interpolation)
+
+        if self.display_landmarks is None or len(self.display_landmarks) < len(positions):
+            self.display_landmarks = np.zeros((len(positions),) + positions.shape[1:], np.int32)
+        landmarks = self.display_landmarks[:len(positions)]
+        landmarks[:, :, 0] = positions[:, :, 0]
+        transform.points(positions[:, :, 1:], landmarks[:, :, 1:])
+        return display, landmarks
+
+    def to_canvas(self, x, y):
+        return self.display_to_canvas.point(x, y)
+
+    def to_board(self, x, y):
+        ox, oy = self.compositor.origin
+        return x + ox, y + oy
+
+    def restore(self, path):
+        # puts the last checkpoint of an autosave file on the board, strokes and undo history start
+        # empty; raises ValueError for a file that is not an autosave
+        _, tiles, meta = read_checkpoint(path)
+        if meta is None:
+            return False
+
+        compositor = self.compositor
+        while len(compositor.layers) < len(meta['layers']):
+            self.add_layer()
+        for (index, tx, ty), tile in tiles.items():
+            compositor.put_tile(index, tx, ty, tile)
+        for layer, state in zip(compositor.layers, meta['layers']):
+            layer.name, layer.visible, layer.opacity = state['name'], state['visible'], state['opacity']
+        compositor.active = meta['active']
+        if self.tiles is not None:
+            compositor.origin = tuple(meta['origin'])
+        compositor.mark_all_dirty()
+        return True
+
+    def open_palette(self):
+        if self.palette is None:
+            self.palette = PalettePicker(self.display_size)
+        return self.palette
+
+    def close(self):
+        self.apply_fill(wait=True)
+        if self.autosave is not None:
+            self.autosave.close(self.compositor)
+        self.bucket.close()
+        for layer in self.compositor.layers:
+            if layer.tiles is not None:
+                layer.tiles.close()
+
+    def process(self, img, hand_detector):
+        drawing_color = self.color_menu.selected_color
 
-    hand_detector = htm.HandDetector(min_detection_confidence=0.7)
-
-    current_brush_thickness = DEFAULT_BRUSH_THICKNESS
-
-    xp, yp = -1, -1
-
-    img_canvas = np.zeros((SCREEN_HEIGHT, SCREEN_WIDTH, 3), np.uint8)
+        erase_color = (0, 0, 0)
 
-    # Color Menu
-    frame_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-    frame_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    color_menu = ColorMenu((frame_width, frame_height), COLOR_ITEMS, start_point=(frame_width, 0))
+        metrics = self.metrics
 
-    while True:
-        success, img = cap.read()
-        img = cv2.flip(img, 1)
+        self.apply_fill()
 
-        drawing_color = color_menu.selected_color
+        # 0. Find Hand Landmarks, on the capture frame before any UI is drawn on it
+        with metrics.stage('find_hand'):
+            _, positions = hand_detector.find_hand_array(img, draw=False)
 
-        erase_color = (0, 0, 0)
+        with metrics.stage('scale'):
+            img, positions = self.to_display(img, positions)
+        self.num_hands = len(positions)
 
         # draw menu
-        menu.draw(cv2, img)
-        selected_menu_item = menu.current_item
+        with metrics.stage('menu'):
+            self.menu.draw(cv2, img)
+        selected_menu_item = self.menu.current_item
 
         # draw color menu
-        color_menu.draw(cv2, img)
+        with metrics.stage('color_menu'):
+            self.color_menu.draw(cv2, img)
+
+        pick_position = None  # the fingertip picking from the palette
 
-        # 0. Find Hand Landmarks
-        img, positions = hand_detector.find_hand(img)
+        for hand in positions:
+            hand_detector.draw_hand(img, hand)
         # print("imgshape", img.shape)
-        # print("canvasshape", img_canvas.shape)
+        # print("canvasshape", self.compositor.canvas.shape)
 
         if len(positions) > 0:
             primary_hand = positions[PRIMARY_HAND_ID]
 
-            thumb_x, thumb_y = primary_hand[THUMB_TIP][1:]
-            index_finger_x, index_finger_y = primary_hand[INDEX_TIP][1:]
-            middle_finger_x, middle_finger_y = primary_hand[MIDDLE_TIP][1:]
-            ring_finger_x, ring_finger_y = primary_hand[RING_TIP][1:]
+            (thumb_x, thumb_y), (index_finger_x, index_finger_y), \
+                (middle_finger_x, middle_finger_y), (ring_finger_x, ring_finger_y) = \
+                primary_hand[TRACKED_TIPS, 1:].tolist()
 
             # 1. drawing mode : index finger is up  ####
-            up_fingers = hand_detector.fingers_state()
+            fingers = hand_detector.fingers_states()
+            up_fingers = fingers[PRIMARY_HAND_ID].tolist()
+
+            # undo gesture : only the little finger is up, fires once per raise
+            undo_gesture = up_fingers[4] and not (up_fingers[1] or up_fingers[2] or up_fingers[3])
+            if undo_gesture and not self.undo_gesture:
+                self.undo()
+            self.undo_gesture = undo_gesture
 
+            fill_gesture = pick_gesture = stroke_gesture = False
             if len(up_fingers) == 5 and ~up_fingers[4]:
 
                 if selected_menu_item.mode == PM.MenuMode.thickness:
@@ -128,7 +385,7 @@ def main():
 
                         secondary_hand = positions[SECONDARY_HAND_ID]
 
-                        up_fingers_secondary = hand_detector.fingers_state(hand_id=SECONDARY_HAND_ID)
+                        up_fingers_secondary = fingers[SECONDARY_HAND_ID].tolist()
                         # primary_hand, secondary_hand = secondary_hand, primary_hand
                         # secondary_hand, primary_hand = primary_hand, secondary_hand
                         # up_fingers, up_fingers_secondary = up_fingers_secondary, up_fingers
@@ -136,40 +393,43 @@ def main():
                         if up_fingers_secondary[1] and up_fingers_secondary[2] and ~up_fingers_secondary[3]:
                             thickness = np.interp(length, [MIN_OPTIMAL_THICKNESS, MAX_OPTIMAL_THICKNESS],
                                                   [MIN_BRUSH_THICKNESS, MAX_BRUSH_THICKNESS])
-                            current_brush_thickness = int(thickness)
+                            self.current_brush_thickness = int(thickness)
 
-                            secondary_middle_finger_x, secondary_middle_finger_y = secondary_hand[MIDDLE_TIP][1:]
+                            secondary_middle_finger_x, secondary_middle_finger_y = secondary_hand[MIDDLE_TIP, 1:].tolist()
                             cv2.circle(img, (secondary_middle_finger_x, secondary_middle_finger_y),
-                                       current_brush_thickness,
+                                       self.current_brush_thickness,
                                        COLOR_BLUE, cv2.FILLED)
 
                 if selected_menu_item.mode == PM.MenuMode.eraser and up_fingers[1] and up_fingers[2] and up_fingers[3]:
                     # erase mode
-                    # menu.select_by_mode(PM.MenuMode.eraser, cv2)
+                    # self.menu.select_by_mode(PM.MenuMode.eraser, cv2)
                     cx, cy = middle_finger_x, middle_finger_y
                     cv2.circle(img, (cx, cy), ERASER_THICKNESS, c4, cv2.FILLED)
+                    stroke_gesture = True
 
-                    if xp == -1 and yp == -1:
-                        xp, yp = cx, cy
+                    if self.xp == -1 and self.yp == -1:
+                        self.xp, self.yp = cx, cy
 
                     cv2.circle(img, (cx, cy), ERASER_THICKNESS, erase_color, cv2.FILLED)
-                    cv2.circle(img_canvas, (cx, cy), ERASER_THICKNESS, erase_color, cv2.FILLED)
+                    self.apply_fill(wait=True)
+                    center, radius = self.to_canvas(cx, cy), self.display_to_canvas.length(ERASER_THICKNESS)
+                    self.compositor.erase(center, radius)
+                    self.strokes.circle(self.to_board(*center), radius, erase_color, self.compositor.active)
 
                 elif up_fingers[1] and up_fingers[2]:
                     # hold mode
-                    # menu.select_by_mode(PM.MenuMode.hand, cv2)
+                    # self.menu.select_by_mode(PM.MenuMode.hand, cv2)
                     cx, cy = index_finger_x + (middle_finger_x - index_finger_x) // 2, index_finger_y
-                    xp, yp = -1, -1
+                    self.end_stroke()
                     # cv2.circle(img, (cx, cy), 20, c2, cv2.FILLED)
 
                     mid_position = (middle_finger_x, middle_finger_y)
 
                     # Check if color can be selected
-                    color_menu.select_color_item_if_possible((middle_finger_x, middle_finger_y))
+                    self.color_menu.select_color_item_if_possible((middle_finger_x, middle_finger_y))
 
                     # Check if Menu Item can be selected
-                    selected_menu_item = menu.select_menu_item_if_possible(cv2, mid_position)
-                    menu.select_by_mode(selected_menu_item.mode, cv2)
+                    selected_menu_item = self.menu.select_menu_item_if_possible(cv2, mid_position)
                     # cv2.putText(img, f'X: {int(cx)}', (SCREEN_WIDTH - 350, 100), cv2.FONT_HERSHEY_COMPLEX_SMALL, 1, c4,
                     #             2)
                     # cv2.putText(img, f'Y: {int(cy)}', (SCREEN_WIDTH - 250, 100), cv2.FONT_HERSHEY_COMPLEX_SMALL, 1, c4,
@@ -178,43 +438,373 @@ def main():
                 elif selected_menu_item.mode == PM.MenuMode.paint and up_fingers[1]:
                     # draw mode
                     cx, cy = index_finger_x, index_finger_y
-                    cv2.circle(img, (cx, cy), current_brush_thickness, drawing_color, cv2.FILLED)
+                    stroke_gesture = True
+                    cv2.circle(img, (cx, cy), self.current_brush_thickness, drawing_color, cv2.FILLED)
 
-                    if xp == -1 and yp == -1:
-                        xp, yp = cx, cy
+                    if self.xp == -1 and self.yp == -1:
+                        self.xp, self.yp = cx, cy
 
                     # if len(positions) == 2:
-                    #     is_x_positive = cx - xp > 0
-                    #     is_y_positive = cy - yp > 0
+                    #     is_x_positive = cx - self.xp > 0
+                    #     is_y_positive = cy - self.yp > 0
                     # if is_x_positive:
-                    #     cy = yp
+                    #     cy = self.yp
                     # if is_y_positive:
-                    #     cx = xp
+                    #     cx = self.xp
+
+                    cv2.line(img, (self.xp, self.yp), (cx, cy), drawing_color, self.current_brush_thickness)
+                    self.apply_fill(wait=True)
+                    pt1, pt2 = self.to_canvas(self.xp, self.yp), self.to_canvas(cx, cy)
+                    thickness = self.display_to_canvas.length(self.current_brush_thickness)
+                    self.compositor.line(pt1, pt2, drawing_color, thickness)
+                    self.strokes.line(self.to_board(*pt1), self.to_board(*pt2), drawing_color, thickness,
+                                      self.compositor.active)
+                    self.xp, self.yp = cx, cy
+
+                elif selected_menu_item.mode == PM.MenuMode.hand and up_fingers[1]:
+                    # pan mode : drag the board with the index finger
+                    cx, cy = index_finger_x, index_finger_y
+                    stroke_gesture = True
+                    cv2.circle(img, (cx, cy), 10, c4, cv2.FILLED)
 
-                    cv2.line(img, (xp, yp), (cx, cy), drawing_color, current_brush_thickness)
-                    cv2.line(img_canvas, (xp, yp), (cx, cy), drawing_color, current_brush_thickness)
-                    xp, yp = cx, cy
+                    if self.xp == -1 and self.yp == -1:
+                        self.xp, self.yp = cx, cy
 
-        img_gray = cv2.cvtColor(img_canvas, cv2.COLOR_BGR2GRAY)
-        _, img_inverse = cv2.threshold(img_gray, 127, 255, cv2.THRESH_BINARY_INV)
-        imgInverse = cv2.cvtColor(img_inverse, cv2.COLOR_GRAY2BGR)
-        img = cv2.bitwise_and(img, imgInverse)
-        img = cv2.bitwise_or(img, img_canvas)
+                    self.apply_fill(wait=True)
+                    (x0, y0), (x1, y1) = self.to_canvas(self.xp, self.yp), self.to_canvas(cx, cy)
+                    self.compositor.pan(x1 - x0, y1 - y0)
+                    self.xp, self.yp = cx, cy
 
-        c_time = time.time()
-        fps = 1 / (c_time - p_time)
-        p_time = c_time
+                elif selected_menu_item.mode == PM.MenuMode.fill and up_fingers[1]:
+                    # fill mode : fills the region under the index finger once per raise
+                    cx, cy = index_finger_x, index_finger_y
+                    cv2.circle(img, (cx, cy), 10, drawing_color, cv2.FILLED)
+
+                    fill_gesture = self.fill_gesture
+                    if not fill_gesture:
+                        # the region is found on the active layer alone
+                        canvas = self.compositor.active_layer.pixels
+                        bounds = self.to_board(0, 0) + self.to_board(canvas.shape[1], canvas.shape[0])
+                        seed = self.to_canvas(cx, cy)
+                        # a fill the bucket could not start yet is tried again on the next frame
+                        fill_gesture = self.bucket.start(canvas, seed, drawing_color, (self.to_board(*seed), bounds))
+                        if self.sync_fill:
+                            self.apply_fill(wait=True)
+
+                elif selected_menu_item.mode == PM.MenuMode.color and up_fingers[1]:
+                    # palette mode : the index finger picks from the wheel or sets the value on the slider
+                    cx, cy = index_finger_x, index_finger_y
+                    color = self.open_palette().pick((cx, cy))
+                    if color is not None:
+                        self.picked_color = color
+                    pick_position = (cx, cy)
+                    pick_gesture = True
+
+            self.fill_gesture = fill_gesture
+
+            # a pick becomes a swatch once the index finger goes down
+            if not pick_gesture and self.picked_color is not None:
+                self.color_menu.add_color(self.picked_color)
+                self.picked_color = None
+
+            if not stroke_gesture and self.xp != -1:
+                # the paint, erase or pan gesture ended, so did the stroke: it is one undo step
+                self.end_stroke()
+        elif self.xp != -1:
+            self.end_stroke()  # the hand is gone, a stroke never continues where it was lost
+
+        if self.autosave is not None:
+            with metrics.stage('autosave'):
+                self.autosave.maybe_checkpoint(self.compositor)
+
+        with metrics.stage('compose'):
+            img = self.compositor.compose(img)
+
+        # the palette goes over the paint, what it shows is what pick() reads
+        if selected_menu_item.mode == PM.MenuMode.color:
+            with metrics.stage('palette'):
+                self.open_palette().draw(img)
+            if pick_position is not None and self.picked_color is not None:
+                cv2.circle(img, pick_position, 15, self.picked_color, cv2.FILLED)
+                cv2.circle(img, pick_position, 15, c4, 2)
+        return img
+
+
+def create_hand_detector(metrics=NULL_METRICS, max_inference_size=MAX_INFERENCE_SIZE):
+    hand_detector = htm.HandDetector(min_detection_confidence=0.7, workers=INFERENCE_WORKERS,
+                                     max_inference_size=max_inference_size, track_roi=TRACK_HAND_ROI)
+    hand_detector.metrics = metrics
+    if ADAPTIVE_INFERENCE:
+        hand_detector = InferenceScheduler(hand_detector, max_rate=MAX_INFERENCE_RATE)
+    return hand_detector
+
+
+def run(source, hand_detector, sink, painter=None, metrics=NULL_METRICS, exporters=(), recorder=None,
+        record_canvas=False, startup=None):
+    # drives the painter from any frame source into any sink until either one stops, a
+    # SessionRecorder gets the shown frames (or the canvas alone), a StartupTimer is told
+    # about every shown frame until a hand was found
+    if metrics is NULL_METRICS:
+        metrics = Metrics()  # off until 'h' turns it on, which must not change the shared null instance
+    if painter is None:
+        painter = Painter(source.frame_size, metrics=metrics)
 
-        # cv2.putText(img, f'FPS: {int(fps)}', (SCREEN_WIDTH - 100, 20), cv2.FONT_HERSHEY_COMPLEX_SMALL, 1, c4, 2)
-        # cv2.putText(img, f'Mode: {selected_menu_item.title}', (SCREEN_WIDTH - 250, 50), cv2.FONT_HERSHEY_COMPLEX_SMALL, 1, c4, 2)
+    while True:
+        metrics.begin_frame()
+
+        with metrics.stage('capture'):
+            success, img = source.read()
+        if not success:
+            break
 
-        cv2.imshow("Virtual Painter", img)
+        with metrics.stage('process'):
+            img = painter.process(img, hand_detector)
+
+        if recorder is not None:
+            with metrics.stage('record'):
+                recorder.record(painter.compositor.canvas if record_canvas else img)
+
+        if metrics.enabled:
+            metrics.gauge('landmark_age_ms', hand_detector.landmark_age * 1000.0)
+            metrics.gauge('frame_age_ms', getattr(source, 'frame_age', 0.0) * 1000.0)
+            metrics.set_counter('dropped_frames', getattr(source, 'dropped_frames', 0))
+            if recorder is not None:
+                metrics.set_counter('recorder_dropped_frames', recorder.dropped_frames)
+            layers = painter.compositor.layers
+            metrics.draw_hud(img, [f'Mode: {painter.menu.current_item.title}',
+                                   f'Layer: {painter.compositor.active + 1}/{len(layers)}'])
+
+            for exporter in exporters:
+                exporter.maybe_export()
+
+        with metrics.stage('display'):
+            if not sink.show(img):
+                break
+
+        if startup is not None and not startup.done:
+            report = startup.frame_shown(painter.num_hands)
+            if report is not None:
+                print(f'startup: {report}')
+                metrics.gauge('first_frame_ms', startup.first_frame_ms)
+                if startup.first_landmark_ms is not None:
+                    metrics.gauge('first_hand_ms', startup.first_landmark_ms)
+
+        key = getattr(sink, 'key', -1)
+        if key == ord('h'):
+            metrics.show_hud = not metrics.show_hud
+            metrics.enabled = metrics.enabled or metrics.show_hud
+        else:
+            handle_key(painter, key)
+
+    return painter
+
+
+def handle_key(painter, key):
+    # canvas shortcuts, shared by the local loop and the server's sessions
+    if key == ord('z'):
+        painter.undo()
+    elif key == ord('y'):
+        painter.redo()
+    elif key == ord('n'):
+        painter.add_layer()
+    elif key == ord('l'):
+        painter.select_layer(painter.compositor.active + 1)
+    elif key == ord('v'):
+        painter.toggle_layer()
+    elif key == ord('['):
+        painter.change_layer_opacity(-LAYER_OPACITY_STEP)
+    elif key == ord(']'):
+        painter.change_layer_opacity(LAYER_OPACITY_STEP)
+
+
+def run_client(source, client, sink):
+    # a painting station of a --serve process: frames go to the server, its composited frames are shown
+    while True:
+        success, img = source.read()
+        if not success:
+            break
 
-        if cv2.waitKey(1) == ord('q'):
+        shown = client.process(img)
+        if shown is not None and not sink.show(shown):
             break
 
-    cap.release()
-    cv2.destroyAllWindows()
+        key = getattr(sink, 'key', -1)
+        if key != -1:
+            client.send_key(key)
+
+
+def create_source(args):
+    flip = not args.no_flip
+    if args.video:
+        return FrameIO.VideoFileSource(args.video, flip=flip)
+    if args.images:
+        return FrameIO.ImageSequenceSource(args.images, flip=flip)
+    # frames come back already flipped, always the newest one
+    return FrameIO.CameraSource(args.camera, size=args.capture_size)
+
+
+def connect(args):
+    source = create_source(args)
+    sink = FrameIO.create_sink(args.sink, "Virtual Painter")
+    client = None
+    try:
+        client = PaintingClient(parse_address(args.connect), source.frame_size, authkey=read_key(args.key_file))
+        run_client(source, client, sink)
+    finally:
+        if client is not None:
+            client.close()
+        source.release()
+        sink.release()
+
+
+def read_key(path):
+    # the secret authkey of --serve / --connect, None uses the built-in one of local addresses
+    if path is None:
+        return None
+    with open(path, 'rb') as file:
+        return file.read().strip()
+
+
+def serve(args):
+    # paints for every --connect client until interrupted, one Painter per session
+    def create_painter(frame_size):
+        return Painter(frame_size, canvas_size=args.canvas_size, display_size=args.display_size)
+
+    server = PaintingServer(parse_address(args.serve), create_painter, num_workers=args.serve_workers,
+                            max_frame_size=args.serve_max_size, min_frame_size=SERVER_MIN_FRAME_SIZE,
+                            hands_args=(True, 2, 0.7, 0.5),
+                            max_inference_size=args.inference_size, track_roi=TRACK_HAND_ROI,
+                            queue_size=SERVER_QUEUE_SIZE, key_handler=handle_key, report_file=args.serve_report,
+                            report_interval=SERVER_REPORT_INTERVAL, authkey=read_key(args.key_file))
+    try:
+        server.serve()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+
+def parse_size(text):
+    width, _, height = text.lower().partition('x')
+    try:
+        return int(width), int(height)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'expected WIDTHxHEIGHT, got {text!r}')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Virtual Painter')
+    parser.add_argument('--camera', type=int, default=0, help='camera index for live capture')
+    parser.add_argument('--video', help='replay a video file instead of the camera')
+    parser.add_argument('--images', help='replay an image sequence, glob pattern such as "frames/*.png"')
+    parser.add_argument('--landmarks', help='replay a recorded landmark log, MediaPipe is not used')
+    parser.add_argument('--record-landmarks', help='write the detected landmarks of this run to a log')
+    parser.add_argument('--no-flip', action='store_true', help='replayed frames are already mirrored')
+    parser.add_argument('--capture-size', type=parse_size, default=CAPTURE_SIZE, help='camera resolution to ask for')
+    parser.add_argument('--inference-size', type=int, default=MAX_INFERENCE_SIZE,
+                        help='longer side of the image fed to MediaPipe')
+    parser.add_argument('--canvas-size', type=parse_size, default=CANVAS_SIZE,
+                        help='resolution the strokes are painted at (default: the display size)')
+    parser.add_argument('--display-size', type=parse_size, default=DISPLAY_SIZE,
+                        help='resolution of the shown frames (default: the capture size)')
+    parser.add_argument('--sink', default='window',
+                        help='"window", "null" or an output path (directory for PNG frames or a video file)')
+    parser.add_argument('--save-canvas', help='write the final canvas to this image file')
+    parser.add_argument('--save-strokes', help='write the recorded strokes to this .npz file')
+    parser.add_argument('--autosave', default=AUTOSAVE_FILE,
+                        help='checkpoint the canvas to this file in the background, restored from it on start')
+    parser.add_argument('--canvas-file', default=CANVAS_FILE,
+                        help='memory-map the tiles of the infinite canvas from this file (default: a temporary file)')
+    parser.add_argument('--record', help='record the session to this video file on a background thread')
+    parser.add_argument('--record-canvas', action='store_true', help='record the canvas alone, not the shown frames')
+    parser.add_argument('--record-scale', type=float, default=1.0, help='downscale recorded frames by this factor')
+    parser.add_argument('--record-every', type=int, default=1, help='record only every n-th frame')
+    parser.add_argument('--record-policy', choices=RECORD_POLICIES, default=RECORD_POLICY,
+                        help='when the encoder falls behind: drop frames or block the loop')
+    parser.add_argument('--serve', metavar='ADDRESS',
+                        help='paint for --connect clients on HOST:PORT or a unix socket path instead of running locally')
+    parser.add_argument('--serve-workers', type=int, default=SERVER_WORKERS,
+                        help='MediaPipe processes shared by all sessions of --serve')
+    parser.add_argument('--serve-max-size', type=parse_size, default=SERVER_MAX_FRAME_SIZE,
+                        help='largest frame size a --serve client may send')
+    parser.add_argument('--serve-report', help='append per-session latency and throughput of --serve to this file')
+    parser.add_argument('--connect', metavar='ADDRESS', help='send the frames to a --serve process to be painted')
+    parser.add_argument('--key-file', help='secret key of --serve and --connect, needed to serve on a non-loopback HOST:PORT')
+    parser.add_argument('--hud', action='store_true', help='show the latency HUD, "h" toggles it at runtime')
+    parser.add_argument('--metrics-jsonl', help='append a metrics snapshot to this file every few seconds')
+    parser.add_argument('--metrics-port', type=int, help='serve Prometheus text metrics on localhost:PORT/metrics')
+    parser.add_argument('--metrics-sample-rate', type=float, default=1.0, help='fraction of frames to time')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    flip = not args.no_flip
+
+    if args.serve:
+        serve(args)
+        return
+    if args.connect:
+        connect(args)
+        return
+
+    metrics = Metrics(enabled=bool(args.hud or args.metrics_jsonl or args.metrics_port),
+                      sample_rate=args.metrics_sample_rate)
+    metrics.show_hud = args.hud
+    exporters = []
+    if args.metrics_jsonl:
+        exporters.append(JsonLinesExporter(metrics, args.metrics_jsonl))
+    if args.metrics_port:
+        exporters.append(PrometheusEndpoint(metrics, args.metrics_port))
+
+    if args.landmarks:
+        log = FrameIO.load_landmark_log(args.landmarks)
+        background = None
+        if args.video:
+            background = FrameIO.VideoFileSource(args.video, flip=flip)
+        elif args.images:
+            background = FrameIO.ImageSequenceSource(args.images, flip=flip)
+        source = FrameIO.LandmarkLogSource(log, background=background)
+        hand_detector = FrameIO.ReplayDetector(log)
+        loader = None
+    else:
+        # mediapipe loads and warms up while the camera opens and the painter is built
+        hand_detector = loader = BackgroundDetector(lambda: create_hand_detector(metrics, args.inference_size))
+        source = create_source(args)
+        hand_detector.warm_up(source.frame_size)
+
+    if args.record_landmarks:
+        hand_detector = FrameIO.LandmarkRecorder(hand_detector, args.record_landmarks)
+
+    sink = FrameIO.create_sink(args.sink, "Virtual Painter")
+    recorder = None
+    if args.record:
+        recorder = SessionRecorder(args.record, fps=RECORD_FPS, queue_size=RECORD_QUEUE_SIZE, policy=args.record_policy,
+                                   scale=args.record_scale, every=args.record_every)
+
+    try:
+        replay = not isinstance(source, FrameIO.CameraSource)
+        painter = Painter(source.frame_size, canvas_size=args.canvas_size, display_size=args.display_size,
+                          metrics=metrics, canvas_file=args.canvas_file, autosave_file=args.autosave,
+                          sync_fill=replay)
+        if loader is not None and replay:
+            loader.wait()  # replayed frames all go through inference, the camera does not wait for it
+        run(source, hand_detector, sink, painter=painter, metrics=metrics, exporters=exporters, recorder=recorder,
+            record_canvas=args.record_canvas, startup=StartupTimer(START_TIME))
+        painter.apply_fill(wait=True)  # a fill started on the last frame
+        if args.save_canvas:
+            cv2.imwrite(args.save_canvas, painter.compositor.canvas)
+        if args.save_strokes:
+            painter.strokes.save(args.save_strokes)
+        painter.close()
+    finally:
+        source.release()
+        hand_detector.close()
+        sink.release()
+        if recorder is not None:
+            recorder.close()
+        for exporter in exporters:
+            exporter.close()
 
 
 if __name__ == '__main__':
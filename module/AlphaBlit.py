@@ -0,0 +1,172 @@
+import cv2
+import numpy as np
+
+
+class Sprite:
+    # RGBA image prepared for repeated alpha blending: the premultiplied color and
+    # the inverse alpha are computed once, so a blit is one multiply-add over the ROI
+
+    def __init__(self, img):
+        self.img = img
+        self.height, self.width = img.shape[:2]
+
+        if img.ndim == 3 and img.shape[2] == 4:
+            alpha = img[:, :, 3:4].astype(np.float32) / 255.0
+        else:
+            alpha = np.ones((self.height, self.width, 1), np.float32)
+
+        # + 0.5 so the float -> uint8 truncation rounds to nearest
+        self.color = img[:, :, :3].astype(np.float32) * alpha + 0.5
+        self.inverse_alpha = 1.0 - alpha
+        self.alpha = alpha
+
+    @property
+    def size(self):
+        return self.width, self.height
+
+
+def clip_rect(pos, size, bounds):
+    # returns (dst_rect, src_offset) of the visible part, or None when off screen
+    x, y = pos
+    w, h = size
+    cols, rows = bounds
+
+    x0, y0 = max(x, 0), max(y, 0)
+    x1, y1 = min(x + w, cols), min(y + h, rows)
+
+    if x0 >= x1 or y0 >= y1:
+        return None
+
+    return (x0, y0, x1, y1), (x0 - x, y0 - y)
+
+
+def blit(dst, sprite, pos=(0, 0)):
+    # blends sprite onto dst in place, pos is the (x, y) of the sprite's top left corner
+    rows, cols = dst.shape[:2]
+    clipped = clip_rect(pos, sprite.size, (cols, rows))
+    if clipped is None:
+        return dst
+
+    (x0, y0, x1, y1), (sx, sy) = clipped
+    h, w = y1 - y0, x1 - x0
+
+    roi = dst[y0:y1, x0:x1]
+    roi[:] = roi * sprite.inverse_alpha[sy:sy + h, sx:sx + w] + sprite.color[sy:sy + h, sx:sx + w]
+    return dst
+
+
+class OverlayLayer:
+    # Pre-rendered UI for a fixed region of the frame, stored as premultiplied BGR plus
+    # alpha. Fully opaque pixels are applied with one masked copy, only the few
+    # anti-aliased edge pixels need blending.
+
+    def __init__(self, top_left, size):
+        self.top_left = top_left
+        self.width, self.height = size
+
+        self.color = np.zeros((self.height, self.width, 3), np.uint8)
+        self.alpha = np.zeros((self.height, self.width), np.uint8)
+
+        self.opaque = None
+        self.edge_index = None
+        self.edge_color = None
+        self.edge_inverse_alpha = None
+
+        # flat (pixel, channel) indices of the edge pixels in a frame of edge_shape, with
+        # scratch buffers, so blending the edges of a fully visible layer allocates nothing
+        self.edge_shape = None
+        self.edge_flat_index = None
+        self.edge_work = None
+        self.edge_pixels = None
+
+    @property
+    def size(self):
+        return self.width, self.height
+
+    def clear(self):
+        self.color[:] = 0
+        self.alpha[:] = 0
+
+    def paste(self, sprite, pos=(0, 0)):
+        # premultiplied "over" of a Sprite into the layer, pos is in frame coordinates
+        local_pos = (pos[0] - self.top_left[0], pos[1] - self.top_left[1])
+        clipped = clip_rect(local_pos, sprite.size, self.size)
+        if clipped is None:
+            return
+
+        (x0, y0, x1, y1), (sx, sy) = clipped
+        h, w = y1 - y0, x1 - x0
+        inverse_alpha = sprite.inverse_alpha[sy:sy + h, sx:sx + w]
+
+        color = self.color[y0:y1, x0:x1]
+        color[:] = color * inverse_alpha + sprite.color[sy:sy + h, sx:sx + w]
+
+        alpha = self.alpha[y0:y1, x0:x1]
+        alpha[:] = alpha * inverse_alpha[:, :, 0] + sprite.alpha[sy:sy + h, sx:sx + w, 0] * 255.0 + 0.5
+
+    def compile(self):
+        # split the rendered layer into the opaque copy mask and the edge pixels
+        self.opaque = (self.alpha == 255).astype(np.uint8)
+
+        edge = (self.alpha > 0) & (self.alpha < 255)
+        self.edge_index = np.nonzero(edge)
+        alpha = self.alpha[edge].astype(np.float32)[:, None] / 255.0
+        self.edge_color = self.color[edge].astype(np.float32) + 0.5
+        self.edge_inverse_alpha = 1.0 - alpha
+        self.edge_inverse_alpha3 = np.repeat(self.edge_inverse_alpha, 3, axis=1)  # broadcasting would buffer
+        self.edge_shape = None
+
+    def apply(self, img):
+        if self.opaque is None:
+            self.compile()
+
+        rows, cols = img.shape[:2]
+        clipped = clip_rect(self.top_left, self.size, (cols, rows))
+        if clipped is None:
+            return img
+
+        (x0, y0, x1, y1), (sx, sy) = clipped
+        h, w = y1 - y0, x1 - x0
+        cv2.copyTo(self.color[sy:sy + h, sx:sx + w], self.opaque[sy:sy + h, sx:sx + w], img[y0:y1, x0:x1])
+
+        if len(self.edge_index[0]) == 0:
+            return img
+
+        fully_visible = (x0, y0, x1, y1) == (self.top_left[0], self.top_left[1],
+                                             self.top_left[0] + self.width, self.top_left[1] + self.height)
+        if fully_visible and img.flags.c_contiguous:
+            self.blend_edges(img)
+        else:
+            ys = self.edge_index[0] + self.top_left[1]
+            xs = self.edge_index[1] + self.top_left[0]
+            color, inverse_alpha = self.edge_color, self.edge_inverse_alpha
+
+            if not fully_visible:
+                inside = (ys >= y0) & (ys < y1) & (xs >= x0) & (xs < x1)
+                ys, xs, color, inverse_alpha = ys[inside], xs[inside], color[inside], inverse_alpha[inside]
+
+            img[ys, xs] = img[ys, xs] * inverse_alpha + color
+
+        return img
+
+    def blend_edges(self, img):
+        if self.edge_shape != img.shape:
+            ys = self.edge_index[0] + self.top_left[1]
+            xs = self.edge_index[1] + self.top_left[0]
+            pixel = (ys * img.shape[1] + xs) * 3
+            self.edge_flat_index = (pixel[:, None] + np.arange(3)).ravel()
+            self.edge_work = np.empty(self.edge_color.shape, np.float32)
+            self.edge_pixels = np.empty(self.edge_color.shape, np.uint8)
+            self.edge_shape = img.shape
+
+        flat = img.reshape(-1)
+        # mode='clip' lets take() write straight into out, the indices are in range anyway
+        np.take(flat, self.edge_flat_index, out=self.edge_pixels.reshape(-1), mode='clip')
+        np.copyto(self.edge_work, self.edge_pixels)
+        np.multiply(self.edge_work, self.edge_inverse_alpha3, out=self.edge_work)
+        np.add(self.edge_work, self.edge_color, out=self.edge_work)
+        np.copyto(self.edge_pixels, self.edge_work, casting='unsafe')
+        np.put(flat, self.edge_flat_index, self.edge_pixels)
+
+    def invalidate(self):
+        self.opaque = None
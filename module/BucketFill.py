@@ -0,0 +1,73 @@
+import concurrent.futures
+
+import cv2
+import numpy as np
+
+
+class BucketFill:
+    # Flood fill of the 4-connected region of exactly the seed's colour. The region is
+    # found with cv2.floodFill in mask-only mode on a worker thread (OpenCV releases the
+    # GIL), into a mask allocated once per canvas size; poll() hands back the finished
+    # (mask, rect, colour) so the caller applies it between frames; the canvas must not be
+    # drawn on until then (poll(wait=True) before drawing). One fill runs at a time.
+
+    def __init__(self):
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='BucketFill')
+        self.mask = None
+        self.last_rect = None
+        self.pending = None
+
+    @property
+    def busy(self):
+        return self.pending is not None
+
+    def _mask_for(self, canvas):
+        height, width = canvas.shape[:2]
+        if self.mask is None or self.mask.shape != (height + 2, width + 2):
+            self.mask = np.zeros((height + 2, width + 2), np.uint8)
+        elif self.last_rect is not None:
+            # only the previous fill's bounding box can be non-zero
+            x0, y0, x1, y1 = self.last_rect
+            self.mask[y0 + 1:y1 + 1, x0 + 1:x1 + 1] = 0
+        return self.mask
+
+    def _region(self, canvas, seed):
+        mask = self._mask_for(canvas)
+        flags = 4 | cv2.FLOODFILL_MASK_ONLY | (255 << 8)
+        area, _, _, (x, y, w, h) = cv2.floodFill(canvas, mask, seed, 0, 0, 0, flags)
+        self.last_rect = (x, y, x + w, y + h)
+        return area, self.last_rect
+
+    def fill(self, canvas, seed):
+        # synchronous variant, returns the filled (mask view, rect) or None when nothing was filled
+        area, rect = self._region(canvas, seed)
+        return self.result(rect) if area else None
+
+    def start(self, canvas, seed, color, token=None):
+        # returns False while a previous fill is still running or the seed is off the canvas,
+        # token is handed back by poll()
+        height, width = canvas.shape[:2]
+        if self.busy or not (0 <= seed[0] < width and 0 <= seed[1] < height):
+            return False
+        self.pending = (self.executor.submit(self._region, canvas, seed), color, token)
+        return True
+
+    def poll(self, wait=False):
+        # (mask view, rect, color, token) of a finished fill, None while running or when idle
+        if self.pending is None or not (wait or self.pending[0].done()):
+            return None
+        future, color, token = self.pending
+        self.pending = None
+
+        area, rect = future.result()
+        if not area:
+            return None
+        mask, rect = self.result(rect)
+        return mask, rect, color, token
+
+    def result(self, rect):
+        x0, y0, x1, y1 = rect
+        return self.mask[y0 + 1:y1 + 1, x0 + 1:x1 + 1], rect
+
+    def close(self):
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,292 @@
+import json
+import os
+import queue
+import struct
+import threading
+import time
+
+import numpy as np
+
+MAGIC = b'VPAUTOSV'
+VERSION = 1
+CHANNELS = 4  # color and coverage
+FILE_HEADER = struct.Struct('<8sIII')  # magic, version, tile size, channels
+RECORD_HEADER = struct.Struct('<iiiI')  # layer, tx, ty, payload bytes
+COMMIT = -1  # layer of the record closing a checkpoint, its payload is the JSON meta
+
+
+def _scan(data):
+    # (tile_size, {(layer, tx, ty): (offset, size)}, meta, end) of the last complete
+    # checkpoint; size 0 is a tile cleared since an earlier checkpoint, records after the
+    # last commit (a write torn by a crash) are ignored
+    if len(data) < FILE_HEADER.size:
+        raise ValueError('not an autosave file')
+    magic, version, tile_size, channels = FILE_HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION or channels != CHANNELS:
+        raise ValueError('not an autosave file')
+
+    tile_bytes = tile_size * tile_size * channels
+    records, pending, meta = {}, {}, None
+    offset = end = FILE_HEADER.size
+    while offset + RECORD_HEADER.size <= len(data):
+        layer, tx, ty, size = RECORD_HEADER.unpack_from(data, offset)
+        offset += RECORD_HEADER.size
+        if offset + size > len(data) or (layer != COMMIT and size not in (0, tile_bytes)):
+            break
+        if layer == COMMIT:
+            meta = json.loads(bytes(data[offset:offset + size]))
+            records.update(pending)
+            pending = {}
+            end = offset + size
+        else:
+            pending[(layer, tx, ty)] = (offset, size)
+        offset += size
+    return tile_size, records, meta, end
+
+
+def read_checkpoint(path):
+    # (tile_size, tiles, meta) of the last complete checkpoint in an autosave file: tiles
+    # maps (layer, tx, ty) to a (tile_size, tile_size, 4) view into the memory-mapped file,
+    # or None for a blank tile; meta is None when nothing was saved yet, also for an empty
+    # file or one shorter than the header (a crash while it was created)
+    if os.path.getsize(path) < FILE_HEADER.size:
+        return None, {}, None
+    data = np.memmap(path, np.uint8, 'r')
+    tile_size, records, meta, _ = _scan(data)
+    shape = (tile_size, tile_size, CHANNELS)
+    tiles = {key: data[offset:offset + size].reshape(shape) if size else None
+             for key, (offset, size) in records.items()}
+    return tile_size, tiles, meta
+
+
+class CanvasAutosave:
+    # Crash-safe autosave of a CanvasCompositor's layers as tile deltas. Draws mark the
+    # tiles they change (mark() is a few set insertions); every interval seconds a checkpoint
+    # of just those tiles starts. maybe_checkpoint() copies at most tiles_per_frame of them
+    # per call into one of two preallocated staging batches and hands it to a writer thread,
+    # which appends them to path; the last batch closes the checkpoint with a commit record
+    # and an fsync. A tile drawn on while its checkpoint is still being copied is marked
+    # again and saved with the next one. A crash mid-write loses at most the open checkpoint. Once the file holds more than
+    # compact_ratio times the live tiles, the writer rewrites it with the newest tile of
+    # each key and atomically replaces it. read_checkpoint() restores from it.
+
+    def __init__(self, path, tile_size, interval=2.0, compact_ratio=4.0, min_compact_bytes=8 * 1024 * 1024,
+                 tiles_per_frame=8):
+        self.path = path
+        self.tile_size = tile_size
+        self.tile_bytes = tile_size * tile_size * CHANNELS
+        self.interval = interval
+        self.tiles_per_frame = tiles_per_frame
+        self.compact_ratio = compact_ratio
+        self.min_compact_bytes = min_compact_bytes
+
+        self.dirty = set()  # (layer, tx, ty) changed since the last checkpoint
+        self.last_checkpoint = time.perf_counter()
+        self.last_meta = None
+        self.pending = None  # keys of the checkpoint being copied, None between checkpoints
+        self.pending_meta = None
+        self.staging = None  # two (tiles_per_frame, tile, tile, 4) batches, allocated on first use
+        self.free = queue.Queue()  # staging batches the writer is done with
+
+        # writer thread state
+        self.index = {}  # (layer, tx, ty) -> (offset, size) of the newest record
+        self.written = {}  # records of the open checkpoint
+        self.meta = None
+        # a file that is not an autosave is never written to
+        header = FILE_HEADER.pack(MAGIC, VERSION, tile_size, CHANNELS)
+        if os.path.exists(path) and os.path.getsize(path) >= FILE_HEADER.size:
+            try:
+                saved_tile_size, self.index, self.meta, end = _scan(np.memmap(path, np.uint8, 'r'))
+            except ValueError:
+                raise ValueError(f'{path} is not an autosave file, pick another path') from None
+            if saved_tile_size != tile_size:
+                raise ValueError(f'autosave tile size {saved_tile_size} does not match {tile_size}')
+            self.file = open(path, 'r+b')
+            self.file.truncate(end)
+            self.file.seek(end)
+        else:
+            # a shorter file is a header torn by a crash, it is started again
+            if os.path.exists(path):
+                with open(path, 'rb') as file:
+                    if not header.startswith(file.read()):
+                        raise ValueError(f'{path} is not an autosave file, pick another path')
+            self.file = open(path, 'w+b')
+            self.file.write(header)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+        self.last_meta = self.meta
+
+        self.checkpoints = 0
+        self.compactions = 0
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name='CanvasAutosave', daemon=True)
+        self.thread.start()
+
+    def mark(self, layer, x0, y0, x1, y1):
+        # world rect of a layer that changed
+        if x0 >= x1 or y0 >= y1:
+            return
+        size = self.tile_size
+        for ty in range(y0 // size, (y1 - 1) // size + 1):
+            for tx in range(x0 // size, (x1 - 1) // size + 1):
+                self.dirty.add((layer, tx, ty))
+
+    @staticmethod
+    def layer_meta(compositor):
+        return {
+            'origin': list(compositor.origin),
+            'active': compositor.active,
+            'layers': [{'name': layer.name, 'visible': layer.visible, 'opacity': layer.opacity}
+                       for layer in compositor.layers]
+        }
+
+    def maybe_checkpoint(self, compositor):
+        # called every frame, copies the next batch of an open checkpoint or opens one once
+        # interval seconds have passed; returns True when a batch went to the writer
+        if self.pending is None:
+            if time.perf_counter() - self.last_checkpoint < self.interval or not self._start(compositor):
+                return False
+        return self._copy_batch(compositor, block=False)
+
+    def checkpoint(self, compositor):
+        # finishes an open checkpoint, then copies everything changed since in one go;
+        # returns False when there was nothing new
+        while self.pending is not None:
+            self._copy_batch(compositor, block=True)
+        if not self._start(compositor):
+            return False
+        while self.pending is not None:
+            self._copy_batch(compositor, block=True)
+        return True
+
+    def _start(self, compositor):
+        self.last_checkpoint = time.perf_counter()
+        meta = self.layer_meta(compositor)
+        if not self.dirty and meta == self.last_meta:
+            return False
+
+        if self.staging is None:
+            self.staging = np.empty((2, self.tiles_per_frame, self.tile_size, self.tile_size, CHANNELS), np.uint8)
+            for batch in range(len(self.staging)):
+                self.free.put(batch)
+        self.pending = sorted(self.dirty, reverse=True)
+        self.pending_meta = meta
+        self.dirty = set()
+        self.last_meta = meta
+        return True
+
+    def _copy_batch(self, compositor, block):
+        # False when both staging batches are still with the writer and block is not set
+        try:
+            batch = self.free.get(block)
+        except queue.Empty:
+            return False
+
+        tiles = self.staging[batch]
+        keys = [self.pending.pop() for _ in range(min(len(self.pending), len(tiles)))]
+        painted = [self._snapshot(compositor, key, tile) for key, tile in zip(keys, tiles)]
+        meta = None
+        if not self.pending:
+            meta, self.pending, self.pending_meta = self.pending_meta, None, None
+        self.queue.put((keys, batch, painted, meta))
+        return True
+
+    def _snapshot(self, compositor, key, out):
+        # copies a tile of a layer into out, returns False for a blank tile
+        index, tx, ty = key
+        layer = compositor.layers[index]
+        if layer.tiles is not None:
+            tile = layer.tiles.tile(tx, ty)
+            if tile is None:
+                return False
+            out[:] = tile
+            return True
+
+        size = self.tile_size
+        x0, y0 = tx * size, ty * size
+        x1, y1 = min(x0 + size, compositor.width), min(y0 + size, compositor.height)
+        coverage = layer.coverage[y0:y1, x0:x1]
+        if not coverage.any():
+            return False
+        out[:] = 0
+        out[:y1 - y0, :x1 - x0, :3] = layer.pixels[y0:y1, x0:x1]
+        out[:y1 - y0, :x1 - x0, 3] = coverage
+        return True
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            committed = self._append(*item)
+            self.queue.task_done()
+            if committed and self._file_bytes() > max(self.min_compact_bytes, self.compact_ratio * self._live_bytes()):
+                self._compact()
+
+        self.file.close()
+
+    def _file_bytes(self):
+        return self.file.tell()
+
+    def _live_bytes(self):
+        return sum(size for _, size in self.index.values())
+
+    def _write_record(self, file, key, payload):
+        file.write(RECORD_HEADER.pack(*key, len(payload)))
+        offset = file.tell()
+        file.write(payload)
+        return offset
+
+    def _commit(self, file, meta):
+        self._write_record(file, (COMMIT, 0, 0), json.dumps(meta).encode())
+        file.flush()
+        os.fsync(file.fileno())
+
+    def _append(self, keys, batch, painted, meta):
+        # meta is set on the last batch of a checkpoint
+        for key, tile, is_painted in zip(keys, self.staging[batch], painted):
+            payload = tile.reshape(-1).data if is_painted else b''
+            self.written[key] = (self._write_record(self.file, key, payload), len(payload))
+        self.free.put(batch)
+        if meta is None:
+            return False
+
+        self._commit(self.file, meta)
+        # only a committed checkpoint moves the index on
+        self.index.update(self.written)
+        self.written = {}
+        self.meta = meta
+        self.checkpoints += 1
+        return True
+
+    def _compact(self):
+        # the newest record of every painted tile, written next to the file and renamed over it
+        self.file.flush()
+        data = np.memmap(self.path, np.uint8, 'r')
+        compact_path = self.path + '.compact'
+        index = {}
+        with open(compact_path, 'w+b') as compact:
+            compact.write(FILE_HEADER.pack(MAGIC, VERSION, self.tile_size, CHANNELS))
+            for key, (offset, size) in self.index.items():
+                if size:
+                    index[key] = (self._write_record(compact, key, data[offset:offset + size].data), size)
+            self._commit(compact, self.meta)
+        del data
+
+        self.file.close()
+        os.replace(compact_path, self.path)
+        self.file = open(self.path, 'r+b')
+        self.file.seek(0, os.SEEK_END)
+        self.index = index
+        self.compactions += 1
+
+    def flush(self):
+        # waits until every queued checkpoint is on disk
+        self.queue.join()
+
+    def close(self, compositor=None):
+        # with a compositor, takes a last checkpoint of it first
+        if compositor is not None:
+            self.checkpoint(compositor)
+        self.queue.put(None)
+        self.thread.join()
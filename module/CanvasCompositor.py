@@ -0,0 +1,380 @@
+import cv2
+import numpy as np
+
+from module.CanvasLayer import CanvasLayer
+from module.FramePool import FramePool
+from module.ScaleTransform import ScaleTransform
+
+
+class CanvasCompositor:
+    # Owns the painted canvas and puts it over the camera frame. Colors are premultiplied
+    # and every draw also writes its coverage (0 unpainted, 255 opaque), so any color,
+    # black included, replaces the camera pixels under it. Every draw call marks its
+    # bounding box dirty and only those boxes are refreshed; compose only touches the
+    # bounding box of everything painted so far, with one masked copy while all coverage is
+    # opaque and a multiply-add once anti-aliased edges or translucent layers show up.
+    # With a TileStore, canvas is the viewport onto an unbounded board whose top left world
+    # pixel is origin: draws are written through to the store and pan() reloads only the
+    # visible tiles, so the frame cost does not depend on the size of the board.
+    # Draw calls and dirty rects are in canvas pixels. With a display_size other than the
+    # canvas size, dirty rects are also resampled into view, a display sized copy of the
+    # canvas; compose() takes display frames and the mask and ink_rect are in display pixels.
+    # Strokes go into the active one of a stack of CanvasLayers, canvas is their flattened
+    # composite: a draw only re-flattens its own rect and compose() reads just the composite,
+    # however many layers there are. Each layer of an infinite canvas has a TileStore of its
+    # own, with 4 channels: color and coverage.
+
+    def __init__(self, size, tiles=None, buffers=None, display_size=None, line_type=cv2.LINE_8):
+        width, height = size
+        self.width = width
+        self.height = height
+        self.line_type = line_type  # cv2.LINE_AA for anti-aliased strokes
+
+        # flattened layers
+        self.canvas = np.zeros((height, width, 3), np.uint8)
+        self.coverage = np.zeros((height, width), np.uint8)
+        self.layers = [CanvasLayer(size, tiles)]
+        self.active = 0
+
+        self.display = ScaleTransform(size, size if display_size is None else display_size)
+        display_width, display_height = self.display.dst_size
+        if self.display.identity:
+            self.view, self.view_coverage = self.canvas, self.coverage
+        else:
+            self.view = np.zeros((display_height, display_width, 3), np.uint8)
+            self.view_coverage = np.zeros((display_height, display_width), np.uint8)
+        self.inverse_mask = np.full((display_height, display_width, 3), 255, np.uint8)  # 255 - coverage
+        self.translucent = False  # some shown coverage is neither 0 nor 255
+
+        self.dirty_rects = []  # canvas pixels
+        self.ink_rect = None  # (x0, y0, x1, y1) of all painted display pixels, None while empty
+
+        self.history = None  # optional CanvasHistory, see attach_history()
+        self.autosave = None  # optional CanvasAutosave, told which tiles each draw changed
+
+        self.tiles = tiles
+        self.origin = (0, 0)
+
+        self.buffers = FramePool() if buffers is None else buffers
+
+    @property
+    def active_layer(self):
+        return self.layers[self.active]
+
+    def attach_history(self, history):
+        # the history saves tiles of every layer's backings before they are drawn over
+        self.history = history
+        for layer in self.layers:
+            layer.history_canvases = [history.add_canvas(backing) for backing in layer.backings]
+
+    def add_layer(self, tiles=None, name=None):
+        # new empty layer on top of the stack, returns its index
+        if (tiles is None) != (self.tiles is None):
+            raise ValueError('every layer of an infinite canvas needs a tile store of its own')
+        layer = CanvasLayer((self.width, self.height), tiles, name)
+        self.layers.append(layer)
+        if self.history is not None:
+            layer.history_canvases = [self.history.add_canvas(backing) for backing in layer.backings]
+        return len(self.layers) - 1
+
+    def set_layer(self, index, visible=None, opacity=None):
+        # re-flattens only the painted bounding box of the layer, and only when it changed
+        layer = self.layers[index]
+        shown, opacity_before = layer.shown, layer.opacity
+        if visible is not None:
+            layer.visible = visible
+        if opacity is not None:
+            layer.opacity = min(max(opacity, 0.0), 1.0)
+        if layer.shown == shown and (not shown or layer.opacity == opacity_before):
+            return
+
+        x, y, w, h = cv2.boundingRect(layer.coverage)
+        if w and h:
+            self.flatten(x, y, x + w, y + h)
+            self.mark_dirty(x, y, x + w, y + h)
+
+    def line(self, pt1, pt2, color, thickness):
+        margin = thickness // 2 + 2
+        rect = (min(pt1[0], pt2[0]) - margin, min(pt1[1], pt2[1]) - margin,
+                max(pt1[0], pt2[0]) + margin, max(pt1[1], pt2[1]) + margin)
+        self.touch(rect)
+
+        layer = self.active_layer
+        cv2.line(layer.pixels, pt1, pt2, color, thickness, self.line_type)
+        cv2.line(layer.coverage, pt1, pt2, 255, thickness, self.line_type)
+        self.changed(rect)
+
+    def circle(self, center, radius, color, thickness=cv2.FILLED):
+        rect = self.circle_rect(center, radius, thickness)
+        self.touch(rect)
+
+        layer = self.active_layer
+        cv2.circle(layer.pixels, center, radius, color, thickness, self.line_type)
+        cv2.circle(layer.coverage, center, radius, 255, thickness, self.line_type)
+        self.changed(rect)
+
+    def erase(self, center, radius):
+        # clears color and coverage of a filled circle on the active layer
+        rect = self.circle_rect(center, radius, cv2.FILLED)
+        self.touch(rect)
+
+        layer = self.active_layer
+        cv2.circle(layer.pixels, center, radius, (0, 0, 0), cv2.FILLED, self.line_type)
+        cv2.circle(layer.coverage, center, radius, 0, cv2.FILLED, self.line_type)
+        self.changed(rect)
+
+    def fill_mask(self, mask, rect, color):
+        # paints color wherever mask is set, mask covers the viewport rect (x0, y0, x1, y1)
+        x0, y0, x1, y1 = rect
+        self.touch(rect)
+
+        layer = self.active_layer
+        painted = mask > 0
+        layer.pixels[y0:y1, x0:x1][painted] = color
+        layer.coverage[y0:y1, x0:x1][painted] = 255
+        self.changed(rect)
+
+    @staticmethod
+    def circle_rect(center, radius, thickness):
+        margin = radius + max(thickness, 0) // 2 + 2
+        return center[0] - margin, center[1] - margin, center[0] + margin, center[1] + margin
+
+    def changed(self, rect):
+        self.store(*rect)
+        self.flatten(*rect)
+        self.mark_dirty(*rect)
+        if self.autosave is not None:
+            self.autosave.mark(self.active, *self.to_world(*self.clip(*rect)))
+
+    def to_world(self, x0, y0, x1, y1):
+        ox, oy = self.origin
+        return x0 + ox, y0 + oy, x1 + ox, y1 + oy
+
+    def to_view(self, x0, y0, x1, y1):
+        ox, oy = self.origin
+        return x0 - ox, y0 - oy, x1 - ox, y1 - oy
+
+    def clip(self, x0, y0, x1, y1):
+        return max(x0, 0), max(y0, 0), min(x1, self.width), min(y1, self.height)
+
+    def touch(self, rect):
+        if self.history is None:
+            return
+        if self.tiles is not None:
+            rect = self.to_world(*self.clip(*rect))
+        for canvas in self.active_layer.history_canvases:
+            self.history.touch(*rect, canvas=canvas)
+
+    def store(self, x0, y0, x1, y1):
+        # writes a viewport rect of the active layer through to its tile store, blank areas
+        # never allocate tiles
+        if self.tiles is None:
+            return
+        x0, y0, x1, y1 = self.clip(x0, y0, x1, y1)
+        if x0 >= x1 or y0 >= y1:
+            return
+
+        layer = self.active_layer
+        ox, oy = self.origin
+        size = self.tiles.tile_size
+        for tx, ty, (wx0, wy0, wx1, wy1) in layer.tiles.overlapping(*self.to_world(x0, y0, x1, y1)):
+            coverage = layer.coverage[wy0 - oy:wy1 - oy, wx0 - ox:wx1 - ox]
+            tile = layer.tiles.tile(tx, ty, create=coverage.any())
+            if tile is not None:
+                tile = tile[wy0 - ty * size:wy1 - ty * size, wx0 - tx * size:wx1 - tx * size]
+                tile[:, :, :3] = layer.pixels[wy0 - oy:wy1 - oy, wx0 - ox:wx1 - ox]
+                tile[:, :, 3] = coverage
+
+    def load(self, x0, y0, x1, y1):
+        # refreshes a viewport rect of every layer from its tile store, marking only the
+        # painted tiles dirty
+        if self.tiles is None:
+            return
+        x0, y0, x1, y1 = self.clip(x0, y0, x1, y1)
+        if x0 >= x1 or y0 >= y1:
+            return
+
+        ox, oy = self.origin
+        size = self.tiles.tile_size
+        for tx, ty, (wx0, wy0, wx1, wy1) in self.tiles.overlapping(*self.to_world(x0, y0, x1, y1)):
+            vx0, vy0, vx1, vy1 = wx0 - ox, wy0 - oy, wx1 - ox, wy1 - oy
+            painted = False
+            for layer in self.layers:
+                tile = layer.tiles.tile(tx, ty)
+                if tile is None:
+                    layer.pixels[vy0:vy1, vx0:vx1] = 0
+                    layer.coverage[vy0:vy1, vx0:vx1] = 0
+                else:
+                    tile = tile[wy0 - ty * size:wy1 - ty * size, wx0 - tx * size:wx1 - tx * size]
+                    layer.pixels[vy0:vy1, vx0:vx1] = tile[:, :, :3]
+                    layer.coverage[vy0:vy1, vx0:vx1] = tile[:, :, 3]
+                    painted = True
+
+            if painted:
+                self.flatten(vx0, vy0, vx1, vy1)
+                self.mark_dirty(vx0, vy0, vx1, vy1)
+            else:
+                self.canvas[vy0:vy1, vx0:vx1] = 0
+                self.coverage[vy0:vy1, vx0:vx1] = 0
+                dx0, dy0, dx1, dy1 = self.display.rect(vx0, vy0, vx1, vy1)
+                self.view[dy0:dy1, dx0:dx1] = 0
+                self.view_coverage[dy0:dy1, dx0:dx1] = 0
+                self.inverse_mask[dy0:dy1, dx0:dx1] = 255
+
+    def pan(self, dx, dy):
+        # moves the board by (dx, dy) viewport pixels, a no-op without a tile store
+        if self.tiles is None or (dx == 0 and dy == 0):
+            return
+        ox, oy = self.origin
+        self.origin = (ox - dx, oy - dy)
+        self.dirty_rects = []
+        self.ink_rect = None
+        self.translucent = False
+        self.load(0, 0, self.width, self.height)
+
+    def undo(self):
+        # returns the meta of the undone history entry, None when there was nothing to undo
+        return self._restore(self.history.undo())
+
+    def redo(self):
+        return self._restore(self.history.redo())
+
+    def _restore(self, restored):
+        if restored is None:
+            return None
+        rects, meta = restored
+        for rect in dict.fromkeys(rects):  # color and coverage tiles share their rects
+            if self.autosave is not None:
+                for index in range(len(self.layers)):
+                    self.autosave.mark(index, *rect)
+            if self.tiles is None:
+                self.flatten(*rect)
+                self.mark_dirty(*rect)
+            else:
+                self.load(*self.to_view(*rect))
+        return meta
+
+    def flatten(self, x0, y0, x1, y1):
+        # recomputes the composite under a viewport rect from the shown layers, bottom first,
+        # as premultiplied "over" scaled by each layer's opacity
+        x0, y0, x1, y1 = self.clip(x0, y0, x1, y1)
+        if x0 >= x1 or y0 >= y1:
+            return
+
+        composite = self.canvas[y0:y1, x0:x1]
+        composite_coverage = self.coverage[y0:y1, x0:x1]
+        shown = [layer for layer in self.layers if layer.shown]
+        if not shown or shown[0].opacity < 1:
+            composite[:] = 0
+            composite_coverage[:] = 0
+        for idx, layer in enumerate(shown):
+            pixels, coverage = layer.pixels[y0:y1, x0:x1], layer.coverage[y0:y1, x0:x1]
+            if idx == 0 and layer.opacity >= 1:
+                composite[:] = pixels
+                composite_coverage[:] = coverage
+                continue
+            if not cv2.countNonZero(coverage):
+                continue  # nothing of this layer under the rect
+
+            opacity = layer.opacity
+            inverse = self.buffers.get('layer_inverse', coverage.shape)
+            inverse3 = self.buffers.get('layer_inverse3', pixels.shape)
+            cv2.addWeighted(coverage, -opacity, coverage, 0, 255, dst=inverse)
+            cv2.cvtColor(inverse, cv2.COLOR_GRAY2BGR, dst=inverse3)
+
+            cv2.multiply(composite, inverse3, dst=composite, scale=1 / 255.0)
+            cv2.addWeighted(pixels, opacity, composite, 1, 0, dst=composite)
+            cv2.multiply(composite_coverage, inverse, dst=composite_coverage, scale=1 / 255.0)
+            cv2.addWeighted(coverage, opacity, composite_coverage, 1, 0, dst=composite_coverage)
+
+    def mark_dirty(self, x0, y0, x1, y1):
+        x0, y0, x1, y1 = self.clip(x0, y0, x1, y1)
+        if x0 >= x1 or y0 >= y1:
+            return
+
+        self.dirty_rects.append((x0, y0, x1, y1))
+
+        x0, y0, x1, y1 = self.display.rect(x0, y0, x1, y1)
+        if self.ink_rect is None:
+            self.ink_rect = (x0, y0, x1, y1)
+        else:
+            ix0, iy0, ix1, iy1 = self.ink_rect
+            self.ink_rect = (min(ix0, x0), min(iy0, y0), max(ix1, x1), max(iy1, y1))
+
+    def mark_all_dirty(self):
+        # for callers that wrote into the layers, or their tile stores, directly
+        self.dirty_rects = []
+        if self.tiles is not None:
+            self.ink_rect = None
+            self.translucent = False
+            self.load(0, 0, self.width, self.height)
+            return
+        self.flatten(0, 0, self.width, self.height)
+        self.mark_dirty(0, 0, self.width, self.height)
+
+    def put_tile(self, index, tx, ty, tile):
+        # writes a square (size, size, 4) color and coverage tile of a layer at world tile
+        # (tx, ty) straight into its backing, None clears it; mark_all_dirty() afterwards
+        layer = self.layers[index]
+        if layer.tiles is not None:
+            if tile is not None and tile.shape[0] != layer.tiles.tile_size:
+                raise ValueError(f'tile size {tile.shape[0]} does not match the store tile size '
+                                 f'{layer.tiles.tile_size}')
+            target = layer.tiles.tile(tx, ty, create=tile is not None)
+            if target is not None:
+                target[:] = 0 if tile is None else tile
+            return
+
+        if tile is None:
+            return  # a bounded layer starts out blank
+        size = tile.shape[0]
+        x0, y0, x1, y1 = self.clip(tx * size, ty * size, (tx + 1) * size, (ty + 1) * size)
+        if x0 < x1 and y0 < y1:
+            tile = tile[y0 - ty * size:y1 - ty * size, x0 - tx * size:x1 - tx * size]
+            layer.pixels[y0:y1, x0:x1] = tile[:, :, :3]
+            layer.coverage[y0:y1, x0:x1] = tile[:, :, 3]
+
+    def update_view(self, rect):
+        # resamples the composite under a dirty rect into view, returns the display rect
+        x0, y0, x1, y1 = self.display.rect(*rect)
+        if self.display.identity:
+            return x0, y0, x1, y1
+
+        cx0, cy0, cx1, cy1 = self.display.inverse.rect(x0, y0, x1, y1)
+        interpolation = cv2.INTER_AREA if self.display.scale < 1 else cv2.INTER_LINEAR
+        # premultiplied colors resample without dark fringes
+        resized = self.buffers.get('view_resized', (y1 - y0, x1 - x0, 3))
+        cv2.resize(self.canvas[cy0:cy1, cx0:cx1], (x1 - x0, y1 - y0), dst=resized, interpolation=interpolation)
+        self.view[y0:y1, x0:x1] = resized
+        resized = self.buffers.get('view_coverage_resized', (y1 - y0, x1 - x0))
+        cv2.resize(self.coverage[cy0:cy1, cx0:cx1], (x1 - x0, y1 - y0), dst=resized, interpolation=interpolation)
+        self.view_coverage[y0:y1, x0:x1] = resized
+        return x0, y0, x1, y1
+
+    def update_mask(self):
+        for rect in self.dirty_rects:
+            x0, y0, x1, y1 = self.update_view(rect)
+            coverage = self.view_coverage[y0:y1, x0:x1]
+            inverse = self.buffers.get('mask_inverse', (y1 - y0, x1 - x0))
+            cv2.bitwise_not(coverage, dst=inverse)
+            cv2.cvtColor(inverse, cv2.COLOR_GRAY2BGR, dst=self.inverse_mask[y0:y1, x0:x1])
+            if not self.translucent:
+                cv2.inRange(coverage, 1, 254, dst=inverse)
+                self.translucent = cv2.countNonZero(inverse) > 0
+        self.dirty_rects.clear()
+
+    def compose(self, img):
+        self.update_mask()
+
+        if self.ink_rect is None:
+            return img
+
+        x0, y0, x1, y1 = self.ink_rect
+        roi = img[y0:y1, x0:x1]
+        if self.translucent:
+            # frame * (1 - coverage) + premultiplied color
+            cv2.multiply(roi, self.inverse_mask[y0:y1, x0:x1], dst=roi, scale=1 / 255.0)
+            cv2.add(roi, self.view[y0:y1, x0:x1], dst=roi)
+        else:
+            cv2.copyTo(self.view[y0:y1, x0:x1], self.view_coverage[y0:y1, x0:x1], dst=roi)
+        return img
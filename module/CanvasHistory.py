@@ -0,0 +1,118 @@
+import collections
+
+import numpy as np
+
+
+class CanvasHistory:
+    # Undo/redo for an image canvas split into tile_size x tile_size tiles. While a stroke
+    # is open, the first write to a tile saves its previous content (copy on write, call
+    # touch() before drawing); commit() closes the stroke and also keeps the new content of
+    # just those tiles for redo. Entries are evicted oldest first once the history holds
+    # more than max_bytes.
+    # canvas is either an image array or an unbounded TileStore (rects are then in world
+    # pixels and tile_size has to divide the store's tile size); blank store tiles are kept
+    # as None instead of a copy.
+    # Several canvases of the same kind and size (layers, or color and coverage planes) are
+    # registered with add_canvas(); touch() takes the index of the canvas about to change.
+
+    def __init__(self, canvas, tile_size=64, max_bytes=64 * 1024 * 1024):
+        self.canvas = canvas
+        self.canvases = [canvas]
+        self.bounded = isinstance(canvas, np.ndarray)
+        self.tile_size = tile_size
+        if not self.bounded and canvas.tile_size % tile_size:
+            raise ValueError(f'history tile size {tile_size} does not divide the store tile size')
+        self.max_bytes = max_bytes
+
+        self.pending = {}  # (canvas, tx, ty) -> tile before the open stroke
+        self.undo_stack = collections.deque()  # (tiles, meta), tiles: (canvas, tx, ty) -> (before, after)
+        self.redo_stack = []
+        self.nbytes = 0
+
+    def add_canvas(self, canvas):
+        # index of canvas for touch(), registered on first use
+        for idx, known in enumerate(self.canvases):
+            if known is canvas:
+                return idx
+        self.canvases.append(canvas)
+        return len(self.canvases) - 1
+
+    def tile_rect(self, tx, ty):
+        x0, y0 = tx * self.tile_size, ty * self.tile_size
+        if not self.bounded:
+            return x0, y0, x0 + self.tile_size, y0 + self.tile_size
+        height, width = self.canvas.shape[:2]
+        return x0, y0, min(x0 + self.tile_size, width), min(y0 + self.tile_size, height)
+
+    def tile(self, canvas, tx, ty, create=False):
+        x0, y0, x1, y1 = self.tile_rect(tx, ty)
+        if not self.bounded:
+            return self.canvases[canvas].region(x0, y0, x1, y1, create)
+        return self.canvases[canvas][y0:y1, x0:x1]
+
+    def snapshot(self, canvas, tx, ty):
+        tile = self.tile(canvas, tx, ty)
+        return None if tile is None else tile.copy()
+
+    def touch(self, x0, y0, x1, y1, canvas=0):
+        if self.bounded:
+            height, width = self.canvas.shape[:2]
+            x0, y0 = max(x0, 0), max(y0, 0)
+            x1, y1 = min(x1, width), min(y1, height)
+        if x0 >= x1 or y0 >= y1:
+            return
+
+        size = self.tile_size
+        for ty in range(y0 // size, (y1 - 1) // size + 1):
+            for tx in range(x0 // size, (x1 - 1) // size + 1):
+                if (canvas, tx, ty) not in self.pending:
+                    self.pending[(canvas, tx, ty)] = self.snapshot(canvas, tx, ty)
+
+    def commit(self, meta=None):
+        # closes the open stroke, returns False when it did not touch anything
+        if not self.pending:
+            return False
+
+        tiles = {key: (before, self.snapshot(*key)) for key, before in self.pending.items()}
+        self.pending = {}
+
+        self.undo_stack.append((tiles, meta))
+        self.nbytes += self.entry_bytes(tiles)
+
+        for entry in self.redo_stack:
+            self.nbytes -= self.entry_bytes(entry[0])
+        self.redo_stack.clear()
+
+        while self.nbytes > self.max_bytes and len(self.undo_stack) > 1:
+            self.nbytes -= self.entry_bytes(self.undo_stack.popleft()[0])
+        return True
+
+    @staticmethod
+    def entry_bytes(tiles):
+        return sum(tile.nbytes for pair in tiles.values() for tile in pair if tile is not None)
+
+    def _restore(self, tiles, use_before):
+        rects = []
+        for key, (before, after) in tiles.items():
+            content = before if use_before else after
+            tile = self.tile(*key, create=content is not None)
+            if tile is None:
+                continue  # blank before and after
+            tile[:] = 0 if content is None else content
+            rects.append(self.tile_rect(*key[1:]))
+        return rects
+
+    def undo(self):
+        # returns (changed rects, meta) of the undone stroke, or None when there is nothing to undo
+        if not self.undo_stack:
+            return None
+        tiles, meta = self.undo_stack.pop()
+        self.redo_stack.append((tiles, meta))
+        return self._restore(tiles, use_before=True), meta
+
+    def redo(self):
+        if not self.redo_stack:
+            return None
+        tiles, meta = self.redo_stack.pop()
+        self.undo_stack.append((tiles, meta))
+        return self._restore(tiles, use_before=False), meta
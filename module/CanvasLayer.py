@@ -0,0 +1,27 @@
+import numpy as np
+
+
+class CanvasLayer:
+    # One paint layer of a CanvasCompositor: viewport pixels (premultiplied color) with their
+    # coverage (0 unpainted, 255 opaque) and, on an infinite canvas, the 4 channel TileStore
+    # they are written through to. Hidden layers and the opacity only change how the layer
+    # is flattened into the composite, never its pixels.
+
+    def __init__(self, size, tiles=None, name=None, visible=True, opacity=1.0):
+        width, height = size
+        self.pixels = np.zeros((height, width, 3), np.uint8)
+        self.coverage = np.zeros((height, width), np.uint8)
+        self.tiles = tiles
+        self.name = name
+        self.visible = visible
+        self.opacity = opacity
+        self.history_canvases = []  # CanvasHistory canvas indices of the backings
+
+    @property
+    def backings(self):
+        # what the undo history saves tiles of
+        return (self.pixels, self.coverage) if self.tiles is None else (self.tiles,)
+
+    @property
+    def shown(self):
+        return self.visible and self.opacity > 0
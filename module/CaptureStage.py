@@ -0,0 +1,108 @@
+import threading
+import time
+
+import cv2
+import numpy as np
+
+
+class ThreadedCapture:
+    # Reads the camera on its own thread into a small preallocated ring of (flipped)
+    # frames. read() always hands out the newest frame, frames that were never read are
+    # dropped instead of queueing up. The frame returned by read() is owned by the caller
+    # until the next read(), the capture thread never writes into it.
+
+    def __init__(self, source=0, size=None, ring_size=3, flip=True):
+        if ring_size < 3:
+            # one slot being written, one holding the newest frame, one owned by the reader
+            raise ValueError('ring_size must be at least 3')
+
+        self.cap = cv2.VideoCapture(source)
+        if size is not None:
+            self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, size[0])
+            self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, size[1])
+
+        self.flip = flip
+        self.ring_size = ring_size
+        self.ring = None  # allocated once the first frame tells us the shape
+        self.raw = None
+        self.timestamps = [0.0] * ring_size
+
+        self.latest_index = -1
+        self.reading_index = -1
+        self.latest_seq = 0
+        self.read_seq = 0
+
+        # counters
+        self.captured_frames = 0
+        self.dropped_frames = 0
+        self.frame_age = 0.0  # seconds from capture to being handed out by read()
+
+        self.lock = threading.Lock()
+        self.new_frame = threading.Condition(self.lock)
+        self.running = True
+
+        self.thread = threading.Thread(target=self._run, name='ThreadedCapture', daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while self.running:
+            success, self.raw = self.cap.read(self.raw)
+            if not success:
+                break
+
+            with self.lock:
+                if self.ring is None:
+                    self.ring = np.empty((self.ring_size,) + self.raw.shape, self.raw.dtype)
+                write_index = next(idx for idx in range(self.ring_size)
+                                   if idx != self.latest_index and idx != self.reading_index)
+
+            # the slot is neither the newest nor the reader's, so it is written outside the lock
+            if self.flip:
+                cv2.flip(self.raw, 1, dst=self.ring[write_index])
+            else:
+                np.copyto(self.ring[write_index], self.raw)
+
+            with self.new_frame:
+                self.timestamps[write_index] = time.perf_counter()
+                self.latest_index = write_index
+                self.latest_seq += 1
+                self.captured_frames += 1
+                self.new_frame.notify_all()
+
+        with self.new_frame:
+            self.running = False
+            self.new_frame.notify_all()
+
+    def read(self, timeout=None):
+        # blocks until a frame newer than the last one read is available
+        with self.new_frame:
+            while self.latest_seq == self.read_seq and self.running:
+                if not self.new_frame.wait(timeout):
+                    return False, None
+
+            if self.latest_seq == self.read_seq:
+                return False, None
+
+            self.dropped_frames += self.latest_seq - self.read_seq - 1
+            self.read_seq = self.latest_seq
+            self.reading_index = self.latest_index
+            self.frame_age = time.perf_counter() - self.timestamps[self.reading_index]
+
+            return True, self.ring[self.reading_index]
+
+    def age(self):
+        # age of the frame currently held by the reader, call right before display
+        if self.reading_index < 0:
+            return 0.0
+        return time.perf_counter() - self.timestamps[self.reading_index]
+
+    def get(self, prop_id):
+        return self.cap.get(prop_id)
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def release(self):
+        self.running = False
+        self.thread.join(timeout=1.0)
+        self.cap.release()
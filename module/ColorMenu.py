@@ -2,6 +2,8 @@ import cv2 as cv
 import numpy as np
 import enum
 
+from module.AlphaBlit import OverlayLayer
+
 
 class ColorItem:
     def __init__(self, color_id, title, color_code, hit_box, size):
@@ -17,14 +19,17 @@ class ColorItem:
 
         return (x1 < pos[0] < x2) and (y1 < pos[1] < y2)
 
-    def rounded_rectangle(self, cv2, src, radius=1, thickness=1, line_type=cv.LINE_AA):
+    def rounded_rectangle(self, cv2, src, radius=1, thickness=1, line_type=cv.LINE_AA, color=None, offset=(0, 0)):
         #  corners:
         #  p1 - p2
         #  |     |
         #  p4 - p3
 
-        top_left = self.hit_box[0]
-        bottom_right = self.hit_box[1]
+        # offset shifts the hit box into the coordinates of src, color overrides color_code
+        color = self.color_code if color is None else color
+
+        top_left = (self.hit_box[0][0] - offset[0], self.hit_box[0][1] - offset[1])
+        bottom_right = (self.hit_box[1][0] - offset[0], self.hit_box[1][1] - offset[1])
 
         # print(f'{self.title} topl {top_left} bl {bottom_right}')
 
@@ -56,44 +61,58 @@ class ColorItem:
                 [top_left_rect_left, bottom_right_rect_left],
                 [top_left_rect_right, bottom_right_rect_right]]
 
-            [cv2.rectangle(src, rect[0], rect[1], self.color_code, thickness) for rect in all_rects]
+            [cv2.rectangle(src, rect[0], rect[1], color, thickness) for rect in all_rects]
 
         # draw straight lines
-        cv2.line(src, (p1[0] + corner_radius, p1[1]), (p2[0] - corner_radius, p2[1]), self.color_code, abs(thickness),
+        cv2.line(src, (p1[0] + corner_radius, p1[1]), (p2[0] - corner_radius, p2[1]), color, abs(thickness),
                  line_type)
-        cv2.line(src, (p2[0], p2[1] + corner_radius), (p3[0], p3[1] - corner_radius), self.color_code, abs(thickness),
+        cv2.line(src, (p2[0], p2[1] + corner_radius), (p3[0], p3[1] - corner_radius), color, abs(thickness),
                  line_type)
-        cv2.line(src, (p3[0] - corner_radius, p4[1]), (p4[0] + corner_radius, p3[1]), self.color_code, abs(thickness),
+        cv2.line(src, (p3[0] - corner_radius, p4[1]), (p4[0] + corner_radius, p3[1]), color, abs(thickness),
                  line_type)
-        cv2.line(src, (p4[0], p4[1] - corner_radius), (p1[0], p1[1] + corner_radius), self.color_code, abs(thickness),
+        cv2.line(src, (p4[0], p4[1] - corner_radius), (p1[0], p1[1] + corner_radius), color, abs(thickness),
                  line_type)
 
         # draw arcs
         cv2.ellipse(src, (p1[0] + corner_radius, p1[1] + corner_radius), (corner_radius, corner_radius), 180.0, 0, 90,
-                    self.color_code, thickness, line_type)
+                    color, thickness, line_type)
         cv2.ellipse(src, (p2[0] - corner_radius, p2[1] + corner_radius), (corner_radius, corner_radius), 270.0, 0, 90,
-                    self.color_code, thickness, line_type)
+                    color, thickness, line_type)
         cv2.ellipse(src, (p3[0] - corner_radius, p3[1] - corner_radius), (corner_radius, corner_radius), 0.0, 0, 90,
-                    self.color_code, thickness, line_type)
+                    color, thickness, line_type)
         cv2.ellipse(src, (p4[0] + corner_radius, p4[1] - corner_radius), (corner_radius, corner_radius), 90.0, 0, 90,
-                    self.color_code, thickness, line_type)
+                    color, thickness, line_type)
 
         return src
 
 
 class ColorMenu:
-    def __init__(self, frame_size, items=[], start_point=(0, 0)):
+    def __init__(self, frame_size, items=[], start_point=(0, 0), max_items=16):
+        self.frame_size = frame_size
+        self.start_point = start_point
+        self.items = list(items)
+        self.base_count = len(self.items)  # swatches past these were added by add_color
+        self.max_items = max(max_items, self.base_count)
+
+        self.layout()
+
+        self.selected_color_item_index = 0
+        self.select_color(self.selected_color_item_index)
+
+    def layout(self):
+        # positions every swatch and sizes the layer, only on construction and add_color
         horizontal_padding = 40
         vertical_padding = 10
         vertical_spacing = 100
 
-        frame_width = frame_size[0]
-        frame_height = frame_size[1]
+        frame_width = self.frame_size[0]
+        frame_height = self.frame_size[1]
 
+        start_point = self.start_point
         left_x = start_point[0]
 
         self.item_size = int(
-            (frame_height - vertical_padding - vertical_spacing) // len(items) - vertical_padding)
+            (frame_height - vertical_padding - vertical_spacing) // len(self.items) - vertical_padding)
 
         item_width = self.item_size
         item_height = self.item_size
@@ -104,7 +123,7 @@ class ColorMenu:
         self.color_items = []
         current_point = (left_x + horizontal_padding, start_point[1] + vertical_padding)
 
-        for i, item in enumerate(items):
+        for i, item in enumerate(self.items):
             item_top_left = current_point
             item_bottom_right = (item_top_left[0] + item_width, item_top_left[1] + item_height)
             current_point = (current_point[0], item_bottom_right[1] + vertical_padding)
@@ -120,26 +139,58 @@ class ColorMenu:
 
         self.hit_box = ((left_x, start_point[1]), menu_bottom_right)
 
-        self.selected_color_item_index = 0
-        self.select_color(self.selected_color_item_index)
+        # swatches are pre-rendered into one layer, margin leaves room for the anti-aliased edges
+        margin = 2
+        layer_left = min(item.hit_box[0][0] for item in self.color_items) - margin
+        layer_top = min(item.hit_box[0][1] for item in self.color_items) - margin
+        layer_right = max(item.hit_box[1][0] for item in self.color_items) + margin
+        layer_bottom = max(item.hit_box[1][1] for item in self.color_items) + margin
+        self.layer = OverlayLayer((layer_left, layer_top), (layer_right - layer_left, layer_bottom - layer_top))
+        self.layer_dirty = True
+
+    def add_color(self, color, title=None):
+        # selects the swatch of color, adding it first if needed; beyond max_items the
+        # oldest added swatch is dropped
+        color = tuple(int(c) for c in color)
+        for idx, item in enumerate(self.items):
+            if tuple(item[1]) == color:
+                self.select_color(idx)
+                return
+
+        if len(self.items) >= self.max_items:
+            if self.base_count == len(self.items):
+                return
+            del self.items[self.base_count]
+        self.items.append((title or f'Custom {color}', color))
+
+        self.layout()
+        self.select_color(len(self.items) - 1)
 
     def select_color(self, index):
         self.selected_color_item_index = index
         self.selected_color = self.color_items[index].color_code
+        self.layer_dirty = True
 
-    def draw(self, cv2, img):
+    def render_layer(self, cv2):
+        self.layer.clear()
         for idx, item in enumerate(self.color_items):
-            img = item.rounded_rectangle(
-                cv2, img,
-                radius=1 if idx == self.selected_color_item_index else 0.5,
-                thickness=-1
-            )
+            radius = 1 if idx == self.selected_color_item_index else 0.5
+            item.rounded_rectangle(cv2, self.layer.color, radius=radius, thickness=-1, offset=self.layer.top_left)
+            item.rounded_rectangle(cv2, self.layer.alpha, radius=radius, thickness=-1, offset=self.layer.top_left,
+                                   color=255)
+        self.layer.invalidate()
+        self.layer_dirty = False
+
+    def draw(self, cv2, img):
+        if self.layer_dirty:
+            self.render_layer(cv2)
+        return self.layer.apply(img)
 
     def select_color_item_if_possible(self, current_position):
         for idx, item in enumerate(self.color_items):
             if item.is_inside(current_position):
-                self.selected_color_item_index = idx
-                self.select_color(self.selected_color_item_index)
+                if idx != self.selected_color_item_index:
+                    self.select_color(idx)
                 return self.color_items[self.selected_color_item_index]
         return self.color_items[self.selected_color_item_index]
 
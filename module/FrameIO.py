@@ -0,0 +1,270 @@
+import glob
+import json
+import os
+
+import cv2
+import numpy as np
+
+from module.CaptureStage import ThreadedCapture
+from module.HandTrackingModule import HandDetector
+
+VIDEO_EXTENSIONS = {'.avi': 'MJPG', '.mp4': 'mp4v', '.mkv': 'MJPG'}
+
+
+# Frame sources: read() -> (success, img) with img already mirrored like the live view,
+# frame_size is (width, height). Sources other than the camera return every frame in
+# order as fast as they are asked for, so replays are deterministic.
+
+class CameraSource:
+    def __init__(self, index=0, size=None):
+        self.capture = ThreadedCapture(index, size=size)
+        self.frame_size = (int(self.capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                           int(self.capture.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+
+    def read(self):
+        return self.capture.read()
+
+    @property
+    def dropped_frames(self):
+        return self.capture.dropped_frames
+
+    @property
+    def frame_age(self):
+        return self.capture.age()
+
+    def release(self):
+        self.capture.release()
+
+
+class VideoFileSource:
+    def __init__(self, path, flip=True):
+        self.cap = cv2.VideoCapture(path)
+        if not self.cap.isOpened():
+            raise IOError(f'cannot open video {path}')
+
+        self.flip = flip
+        self.frame = None
+        self.flipped = None
+        self.frame_size = (int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                           int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+
+    def read(self):
+        # decodes into and flips into the same two buffers every frame
+        success, self.frame = self.cap.read(self.frame)
+        if not success:
+            return False, None
+        if not self.flip:
+            return True, self.frame
+        if self.flipped is None or self.flipped.shape != self.frame.shape:
+            self.flipped = np.empty_like(self.frame)
+        return True, cv2.flip(self.frame, 1, dst=self.flipped)
+
+    def release(self):
+        self.cap.release()
+
+
+class ImageSequenceSource:
+    def __init__(self, pattern, flip=True):
+        self.paths = sorted(glob.glob(pattern))
+        if not self.paths:
+            raise IOError(f'no images match {pattern}')
+
+        self.flip = flip
+        self.position = 0
+        self.flipped = None
+        height, width = cv2.imread(self.paths[0]).shape[:2]
+        self.frame_size = (width, height)
+
+    def read(self):
+        if self.position >= len(self.paths):
+            return False, None
+
+        img = cv2.imread(self.paths[self.position])
+        self.position += 1
+        if img is None:
+            return False, None
+        if not self.flip:
+            return True, img
+        if self.flipped is None or self.flipped.shape != img.shape:
+            self.flipped = np.empty_like(img)
+        return True, cv2.flip(img, 1, dst=self.flipped)
+
+    def release(self):
+        pass
+
+
+class LandmarkLogSource:
+    # one frame per recorded landmark record, either blank or taken from a background source
+    def __init__(self, log, background=None):
+        self.records = log['records']
+        self.frame_size = tuple(log['frame_size'])
+        self.background = background
+        self.position = 0
+
+        width, height = self.frame_size
+        self.frame = np.zeros((height, width, 3), np.uint8)
+
+    def read(self):
+        if self.position >= len(self.records):
+            return False, None
+        self.position += 1
+
+        if self.background is not None:
+            return self.background.read()
+
+        self.frame[:] = 0
+        return True, self.frame
+
+    def release(self):
+        if self.background is not None:
+            self.background.release()
+
+
+# Landmark logs: JSON lines, a header {"frame_size": [w, h]} followed by one
+# {"hands": [[[x, y] * 21] ...], "handedness": [[label, score] ...]} per frame, in pixels
+# and in the order HandDetector stores them.
+
+def load_landmark_log(path):
+    with open(path) as log_file:
+        header = json.loads(log_file.readline())
+        records = [json.loads(line) for line in log_file if line.strip()]
+    return {'frame_size': header['frame_size'], 'records': records}
+
+
+class LandmarkRecorder:
+    # wraps a detector and logs every frame's landmarks, everything else is forwarded
+    def __init__(self, detector, path):
+        self.detector = detector
+        self.log_file = open(path, 'w')
+        self.header_written = False
+
+    def __getattr__(self, name):
+        return getattr(self.detector, name)
+
+    def find_hand_array(self, img, draw=True, rgb=None):
+        img, hands = self.detector.find_hand_array(img, draw, rgb)
+
+        if not self.header_written:
+            self.log_file.write(json.dumps({'frame_size': [img.shape[1], img.shape[0]]}) + '\n')
+            self.header_written = True
+
+        record = {
+            'hands': hands[:, :, 1:].tolist(),
+            'handedness': [[self.detector.handedness[idx], float(self.detector.scores[idx])]
+                           for idx in range(len(hands))]
+        }
+        self.log_file.write(json.dumps(record) + '\n')
+        return img, hands
+
+    def find_hand(self, img, draw=True, rgb=None):
+        img, _ = self.find_hand_array(img, draw, rgb)
+        return img, self.detector.hand_list
+
+    def close(self):
+        self.log_file.close()
+        self.detector.close()
+
+
+class ReplayDetector(HandDetector):
+    # HandDetector that plays back a landmark log instead of running MediaPipe,
+    # one record per find_hand_array call
+    def __init__(self, log, max_num_hands=2):
+        self.records = log['records']
+        self.position = 0
+        super().__init__(max_num_hands=max_num_hands)
+
+    def create_hands(self, hands_args):
+        return None
+
+    def find_hand_array(self, img, draw=True, rgb=None):
+        record = self.records[self.position] if self.position < len(self.records) else {'hands': []}
+        self.position += 1
+
+        hands = record['hands'][:self.max_num_hands]
+        handedness = record.get('handedness', [])
+
+        self.num_hands = len(hands)
+        for slot, hand in enumerate(hands):
+            self.landmarks[slot, :, 1:] = hand
+            if slot < len(handedness):
+                self.handedness[slot], self.scores[slot] = handedness[slot]
+
+        if draw:
+            for hand in self.landmarks[:self.num_hands]:
+                self.draw_hand(img, hand)
+
+        self.landmark_age = 0.0
+        return img, self.landmarks[:self.num_hands]
+
+
+# Frame sinks: show(img) returns False when the run should stop.
+
+class WindowSink:
+    def __init__(self, title):
+        self.title = title
+        self.key = -1  # last key pressed, for shortcuts handled by the caller
+
+    def show(self, img):
+        cv2.imshow(self.title, img)
+        self.key = cv2.waitKey(1)
+        return self.key != ord('q')
+
+    def release(self):
+        cv2.destroyAllWindows()
+
+
+class NullSink:
+    def __init__(self):
+        self.frames = 0
+
+    def show(self, img):
+        self.frames += 1
+        return True
+
+    def release(self):
+        pass
+
+
+class ImageFileSink:
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.frames = 0
+
+    def show(self, img):
+        cv2.imwrite(os.path.join(self.directory, f'frame_{self.frames:06d}.png'), img)
+        self.frames += 1
+        return True
+
+    def release(self):
+        pass
+
+
+class VideoFileSink:
+    def __init__(self, path, fps=30):
+        self.path = path
+        self.fps = fps
+        self.writer = None
+
+    def show(self, img):
+        if self.writer is None:
+            fourcc = VIDEO_EXTENSIONS[os.path.splitext(self.path)[1].lower()]
+            self.writer = cv2.VideoWriter(self.path, cv2.VideoWriter_fourcc(*fourcc), self.fps,
+                                          (img.shape[1], img.shape[0]))
+        self.writer.write(img)
+        return True
+
+    def release(self):
+        if self.writer is not None:
+            self.writer.release()
+
+
+def create_sink(spec, title):
+    # "window", "null", a video file path or a directory for PNG frames
+    if spec == 'window':
+        return WindowSink(title)
+    if spec == 'null':
+        return NullSink()
+    if os.path.splitext(spec)[1].lower() in VIDEO_EXTENSIONS:
+        return VideoFileSink(spec)
+    return ImageFileSink(spec)
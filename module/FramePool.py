@@ -0,0 +1,24 @@
+import numpy as np
+
+
+class FramePool:
+    # Named scratch buffers reused across frames, e.g. as dst= of OpenCV calls. get() hands
+    # out a contiguous view of the first prod(shape) elements of the buffer registered under
+    # name, which only grows when a larger shape is asked for, so changing ROI sizes do not
+    # reallocate. A view stays valid until the next get() of the same name.
+
+    def __init__(self):
+        self.buffers = {}
+        self.allocations = 0
+
+    def get(self, name, shape, dtype=np.uint8):
+        size = int(np.prod(shape))
+        buffer = self.buffers.get(name)
+        if buffer is None or buffer.size < size or buffer.dtype != dtype:
+            buffer = self.buffers[name] = np.empty(size, dtype)
+            self.allocations += 1
+        return buffer[:size].reshape(shape)
+
+    @property
+    def nbytes(self):
+        return sum(buffer.nbytes for buffer in self.buffers.values())
@@ -1,87 +1,252 @@
 import cv2
-import mediapipe as mp
+import numpy as np
 import time
 
+from module.FramePool import FramePool
+from module.InferenceWorker import NUM_LANDMARKS, InferencePool, prepare_input
+from module.Metrics import NULL_METRICS
+
+# mediapipe's hand topology, kept here so drawing does not need mediapipe loaded
+HAND_CONNECTIONS = [
+    (0, 1), (1, 2), (2, 3), (3, 4),
+    (0, 5), (5, 6), (6, 7), (7, 8),
+    (5, 9), (9, 10), (10, 11), (11, 12),
+    (9, 13), (13, 14), (14, 15), (15, 16),
+    (13, 17), (0, 17), (17, 18), (18, 19), (19, 20)
+]
+
 
 class HandDetector:
     def __init__(self,
                  mode=False,
                  max_num_hands=2,
                  min_detection_confidence=0.5,
-                 min_tracking_confidence=0.5):
+                 min_tracking_confidence=0.5,
+                 workers=0,
+                 max_inference_size=None,
+                 track_roi=False,
+                 roi_padding=0.3,
+                 roi_refresh=30):
         self.mode = mode
         self.max_num_hands = max_num_hands
         self.min_detection_confidence = min_detection_confidence
         self.min_tracking_confidence = min_tracking_confidence
 
         self.tipIds = [4, 8, 12, 16, 20]
+        self.lowerJointIds = [tip - 2 for tip in self.tipIds[1:]]
+        self.mpHands = None
+        self.mpDraw = None
+
+        # preallocated landmark arrays, only the first num_hands rows are valid
+        self.num_hands = 0
+        self.landmarks = np.zeros((self.max_num_hands, NUM_LANDMARKS, 3), np.int32)
+        self.landmarks[:, :, 0] = np.arange(NUM_LANDMARKS)
+        self.handedness = [''] * self.max_num_hands
+        self.scores = np.zeros(self.max_num_hands, np.float32)
+        self.fingers = np.zeros((self.max_num_hands, 5), bool)
+        self.landmark_age = 0.0  # seconds since the frame the current landmarks come from
+        self.metrics = NULL_METRICS
+        self.latest_seq = 0
+
+        # inference runs on a copy whose longer side is at most max_inference_size pixels.
+        # With track_roi it is cropped to the last hands padded by roi_padding, a full
+        # frame search still runs when tracking is lost and every roi_refresh frames.
+        # The crop only moves once the hands come closer than a quarter of the padding to its
+        # edge: mediapipe tracks the hand in coordinates of its input image, every other
+        # crop would throw that away and pay for a palm detection (as slow on a crop as on
+        # the whole frame).
+        self.max_inference_size = max_inference_size
+        self.track_roi = track_roi
+        self.roi_padding = roi_padding
+        self.roi_refresh = roi_refresh
+        self.frames_since_search = 0
+        self.roi = None
+
+        # scratch buffers of the inference input, reused every frame
+        self.buffers = FramePool()
+
+        # workers > 0 runs inference asynchronously in that many worker processes
+        self.pool = None
+        self.hands = None
+        hands_args = (self.mode, self.max_num_hands, self.min_detection_confidence, self.min_tracking_confidence)
+        if workers > 0:
+            self.pool = InferencePool(workers, hands_args, max_inference_size)
+        else:
+            self.hands = self.create_hands(hands_args)
+
+    def create_hands(self, hands_args):
+        # mediapipe is only imported by detectors that run inference in this process
+        import mediapipe as mp
+
         self.mpHands = mp.solutions.hands
-        self.hands = self.mpHands.Hands(self.mode, self.max_num_hands,
-                                        self.min_detection_confidence,
-                                        self.min_tracking_confidence)
         self.mpDraw = mp.solutions.drawing_utils
+        return self.mpHands.Hands(*hands_args)
+
+    def warm_up(self, frame_size):
+        # the first inference is far slower than the rest, this one runs on a blank frame of
+        # frame_size; with workers it starts the pool, whose workers warm up on their own
+        width, height = frame_size
+        if self.pool is not None:
+            self.pool.start((height, width, 3))
+        elif self.hands is not None:
+            self.process(np.zeros((height, width, 3), np.uint8), (0, 0, width, height))
 
     def find_hand_with_points(self, img, draw=True, draw_point=True, points=[]):
-        img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        self.results = self.hands.process(img_rgb)
+        # per hand {idx: {"id", "center_x", "center_y"}} of the landmarks in points
+        img, hands = self.find_hand_array(img, draw)
 
         hand_list = []
+        for hand_landmarks in hands.tolist():
+            hand = {}
+            for idx, center_x, center_y in hand_landmarks:
+                if idx in points:
+                    hand[idx] = {"id": idx, "center_x": center_x, "center_y": center_y}
 
-        if self.results.multi_hand_landmarks:
-            for handLMS in self.results.multi_hand_landmarks:
-                hand = {}
-                for idx, lm in enumerate(handLMS.landmark):
-                    if idx in points:
-                        height, width, channel = img.shape
-                        center_x, center_y = int(lm.x * width), int(lm.y * height)
-                        hand[idx] = {"id": idx, "center_x": center_x, "center_y": center_y}
-
-                        if draw_point:
-                            cv2.circle(img, (center_x, center_y), 5, (255, 0, 0), cv2.FILLED)
-
-                if len(hand) > 0:
-                    hand_list.append(hand)
-
-                if draw:
-                    self.mpDraw.draw_landmarks(img, handLMS, self.mpHands.HAND_CONNECTIONS)
+                    if draw_point:
+                        cv2.circle(img, (center_x, center_y), 5, (255, 0, 0), cv2.FILLED)
+
+            if len(hand) > 0:
+                hand_list.append(hand)
         return img, hand_list
 
-    def find_hand(self, img, draw=True):
-        img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        self.results = self.hands.process(img_rgb)
+    def find_hand_array(self, img, draw=True, rgb=None):
+        # fills self.landmarks[:num_hands] with (idx, x, y) pixel rows, returns that view.
+        # rgb optionally receives the inference input, see prepare_input
+        if self.pool is not None:
+            return self.find_hand_array_async(img, draw)
+
+        roi = self.inference_roi(img.shape)
+        with self.metrics.stage('inference'):
+            self.process(img, roi, rgb)
 
-        self.hand_list = []
+            full_frame = (0, 0, img.shape[1], img.shape[0])
+            if not self.results.multi_hand_landmarks and roi != full_frame:
+                # tracking lost, search the whole frame again
+                roi = self.inference_roi(img.shape, search=True)
+                self.process(img, roi)
+        self.metrics.event('inference')
 
+        self.num_hands = 0
         if self.results.multi_hand_landmarks:
-            for handLMS in self.results.multi_hand_landmarks:
-                hand = []
-                for idx, lm in enumerate(handLMS.landmark):
-                    height, width, channel = img.shape
-                    center_x, center_y = int(lm.x * width), int(lm.y * height)
-                    hand.append((idx, center_x, center_y))
+            normalized = [[(lm.x, lm.y) for lm in hand_lms.landmark] for hand_lms in self.results.multi_hand_landmarks]
+            handedness = [(h.classification[0].label, h.classification[0].score)
+                          for h in self.results.multi_handedness]
+            self.store_landmarks(normalized, handedness, roi)
+
+            if draw:
+                for hand in self.landmarks[:self.num_hands]:
+                    self.draw_hand(img, hand)
+
+        self.landmark_age = 0.0
+        return img, self.landmarks[:self.num_hands]
+
+    def process(self, img, roi, rgb=None):
+        self.results = self.hands.process(prepare_input(img, roi, self.max_inference_size, self.buffers, rgb))
+        return self.results
+
+    def inference_roi(self, shape, search=False):
+        # (x0, y0, x1, y1) to run inference on, the full frame unless a hand is being tracked
+        height, width = shape[:2]
 
-                    # if draw:
-                    #     cv2.circle(img, (center_x, center_y), 5, (255, 0, 0), cv2.FILLED)
+        if search or not self.track_roi or self.num_hands == 0 or self.frames_since_search >= self.roi_refresh:
+            self.frames_since_search = 0
+            self.roi = (0, 0, width, height)
+            return self.roi
 
-                self.hand_list.append(hand)
+        points = self.landmarks[:self.num_hands, :, 1:]
+        x0, y0 = points.min(axis=(0, 1)).tolist()
+        x1, y1 = points.max(axis=(0, 1)).tolist()
+        pad = int(self.roi_padding * max(x1 - x0, y1 - y0)) + 1
 
-                if draw:
-                    self.mpDraw.draw_landmarks(img, handLMS, self.mpHands.HAND_CONNECTIONS)
-        self.hand_list.reverse()
+        self.frames_since_search += 1
+        if self.roi is not None and self.roi != (0, 0, width, height):
+            # edges of the frame need no margin, hands cannot move past them
+            rx0, ry0, rx1, ry1 = self.roi
+            margin = pad // 4
+            if ((rx0 == 0 or x0 >= rx0 + margin) and (ry0 == 0 or y0 >= ry0 + margin) and
+                    (rx1 == width or x1 <= rx1 - margin) and (ry1 == height or y1 <= ry1 - margin)):
+                return self.roi
+
+        self.roi = (max(x0 - pad, 0), max(y0 - pad, 0), min(x1 + pad, width), min(y1 + pad, height))
+        if self.roi[0] >= self.roi[2] or self.roi[1] >= self.roi[3]:
+            return self.inference_roi(shape, search=True)
+        self.metrics.count('roi_moves')
+        return self.roi
+
+    def find_hand_array_async(self, img, draw=True):
+        # submits img when a worker is free and uses the newest landmarks that came back,
+        # which may belong to an earlier frame (see landmark_age)
+        self.pool.submit(img, roi=self.inference_roi(img.shape))
+        latest = self.pool.poll()
+
+        self.num_hands = 0
+        if latest is None:
+            return img, self.landmarks[:0]
+
+        seq, timestamp, roi, normalized, handedness = latest
+        if seq != self.latest_seq:
+            self.latest_seq = seq
+            self.metrics.event('inference')
+        self.landmark_age = time.perf_counter() - timestamp
+        self.store_landmarks(normalized, handedness, roi)
+
+        if draw:
+            for hand in self.landmarks[:self.num_hands]:
+                self.draw_hand(img, hand)
+
+        return img, self.landmarks[:self.num_hands]
+
+    def store_landmarks(self, normalized, handedness, roi):
+        # normalized: per hand 21 (x, y) in [0, 1] of roi, stored in full frame pixels and
+        # newest-detected-first like before
+        x0, y0, x1, y1 = roi
+        num_hands = min(len(normalized), self.max_num_hands)
+
+        for slot in range(num_hands):
+            src = num_hands - 1 - slot
+            self.landmarks[slot, :, 1:] = np.asarray(normalized[src]) * (x1 - x0, y1 - y0) + (x0, y0)
+            self.handedness[slot] = handedness[src][0]
+            self.scores[slot] = handedness[src][1]
+
+        self.num_hands = num_hands
+
+    def find_hand(self, img, draw=True, rgb=None):
+        img, _ = self.find_hand_array(img, draw, rgb)
         return img, self.hand_list
 
-    def fingers_state(self, hand_id=0):
-        fingers = []
-        if len(self.hand_list) > 0:
-            hand = self.hand_list[hand_id]
-            # thumb
-            fingers.append(hand[self.tipIds[0]][1] < hand[self.tipIds[0] - 1][1])
-            # rest fingers
-            for idx in range(1, 5):
-                fingers.append(hand[self.tipIds[idx]][2] < hand[self.tipIds[idx] - 2][2])
+    @property
+    def hand_list(self):
+        # list-of-(idx, x, y) compatibility view of the landmark array
+        return [[tuple(row) for row in hand] for hand in self.landmarks[:self.num_hands].tolist()]
+
+    def draw_hand(self, img, hand):
+        # same look as mp drawing_utils, for landmarks that are already in pixels
+        points = hand[:, 1:].tolist()
+        for start, end in HAND_CONNECTIONS:
+            cv2.line(img, points[start], points[end], (224, 224, 224), 2)
+        for point in points:
+            cv2.circle(img, point, 2, (0, 0, 255), 2)
 
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+        if self.hands is not None:
+            self.hands.close()
+
+    def fingers_states(self):
+        # (num_hands, 5) bool, thumb first, evaluated for all hands at once
+        hands = self.landmarks[:self.num_hands]
+        fingers = self.fingers[:self.num_hands]
+        # thumb compares x against the joint below it, the other fingers compare y two joints down
+        np.less(hands[:, self.tipIds[0], 1], hands[:, self.tipIds[0] - 1, 1], out=fingers[:, 0])
+        np.less(hands[:, self.tipIds[1:], 2], hands[:, self.lowerJointIds, 2], out=fingers[:, 1:])
         return fingers
 
+    def fingers_state(self, hand_id=0):
+        if self.num_hands == 0:
+            return []
+        return self.fingers_states()[hand_id].tolist()
+
 
 def main():
     p_time = 0
@@ -0,0 +1,71 @@
+import os
+import zipfile
+
+import cv2
+import numpy as np
+
+
+def load_icon(path, size):
+    # the asset decoded with its alpha channel and shrunk to size (width, height)
+    img = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+    if img is None:
+        raise IOError(f'cannot read icon {path}')
+    return cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+
+
+class IconCache:
+    # Decoded and resized menu icons, and variants built from them (e.g. the selected look),
+    # kept in one uncompressed .npz so a start does not decode and resize every asset again.
+    # Entries are keyed by variant, size and the asset's path, mtime and file size, so an
+    # edited asset or a new menu layout only rebuilds what changed. save() rewrites the file
+    # with the entries used since it was loaded, and only when one of them was rebuilt.
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.used = set()
+        self.changed = False
+        self.hits = 0
+        self.misses = 0
+
+        if path is not None and os.path.exists(path):
+            try:
+                with np.load(path) as data:
+                    self.entries = {key: data[key] for key in data.files}
+            except (OSError, ValueError, zipfile.BadZipFile):
+                self.entries = {}  # unreadable, everything is rebuilt and saved again
+
+    @staticmethod
+    def key(asset, size, variant):
+        stat = os.stat(asset)
+        return f'{variant}-{size[0]}x{size[1]}-{stat.st_mtime_ns}-{stat.st_size}-{asset}'.replace('/', '|')
+
+    def icon(self, asset, size, variant='icon', build=None):
+        # build(icon) makes the variant from the plain icon of that size
+        size = tuple(size)
+        key = self.key(asset, size, variant)
+        self.used.add(key)
+
+        img = self.entries.get(key)
+        if img is not None:
+            self.hits += 1
+            return img
+
+        self.misses += 1
+        img = load_icon(asset, size) if build is None else build(self.icon(asset, size))
+        self.entries[key] = img
+        self.changed = True
+        return img
+
+    def save(self):
+        if self.path is None or not self.changed:
+            return False
+        entries = {key: self.entries[key] for key in self.used}
+        temp_path = self.path + '.tmp.npz'
+        try:
+            np.savez(temp_path, **entries)
+            os.replace(temp_path, self.path)
+        except OSError:
+            return False  # e.g. a read-only install, the icons are just built again next time
+        self.changed = False
+        return True
@@ -0,0 +1,140 @@
+import math
+import time
+
+import cv2
+import numpy as np
+
+
+class InferenceScheduler:
+    # Sits in front of a HandDetector and runs inference only when it is worth it: no hand
+    # is known, the area around the last hand box changed (mean absolute difference of a
+    # tiny gray probe above motion_threshold), or the landmarks are older than
+    # max_staleness seconds. max_rate caps inferences per second on top of that. Skipped
+    # frames reuse the last landmarks, moved along the velocity of the last two inferences.
+    # Everything else (fingers_states, close, ...) is forwarded to the detector.
+
+    def __init__(self, detector, max_rate=None, max_staleness=0.25, motion_threshold=4.0,
+                 probe_size=32, box_padding=0.3, extrapolate=True, clock=time.perf_counter):
+        self.detector = detector
+        self.min_interval = 0.0 if max_rate is None else 1.0 / max_rate
+        self.max_staleness = max_staleness
+        self.motion_threshold = motion_threshold
+        self.probe_size = probe_size
+        self.box_padding = box_padding
+        self.extrapolate = extrapolate
+        self.clock = clock
+
+        max_num_hands = detector.max_num_hands
+        self.current_landmarks = np.zeros((max_num_hands, 21, 2), np.float32)
+        self.previous_landmarks = np.zeros((max_num_hands, 21, 2), np.float32)
+        self.velocity = np.zeros((max_num_hands, 21, 2), np.float32)
+        self.current_time = -math.inf
+        self.previous_time = -math.inf
+        self.current_hands = 0
+        self.previous_hands = 0
+
+        self.probe = None
+        self.probe_box = None
+
+        # counters
+        self.inferences = 0
+        self.skipped = 0
+        self.last_motion = 0.0
+
+    def __getattr__(self, name):
+        return getattr(self.detector, name)
+
+    def hand_box(self, shape):
+        height, width = shape[:2]
+        if self.current_hands == 0:
+            return 0, 0, width, height
+
+        points = self.current_landmarks[:self.current_hands]
+        x0, y0 = points.min(axis=(0, 1)).tolist()
+        x1, y1 = points.max(axis=(0, 1)).tolist()
+        pad = self.box_padding * max(x1 - x0, y1 - y0) + 1
+        x0, y0 = max(int(x0 - pad), 0), max(int(y0 - pad), 0)
+        x1, y1 = min(int(x1 + pad), width), min(int(y1 + pad), height)
+
+        if x0 >= x1 or y0 >= y1:
+            return 0, 0, width, height
+        return x0, y0, x1, y1
+
+    def take_probe(self, img, box):
+        x0, y0, x1, y1 = box
+        small = cv2.resize(img[y0:y1, x0:x1], (self.probe_size, self.probe_size), interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+    def motion(self, img):
+        if self.probe is None:
+            return math.inf
+        probe = self.take_probe(img, self.probe_box)
+        return cv2.norm(probe, self.probe, cv2.NORM_L1) / probe.size
+
+    def should_infer(self, img, now):
+        elapsed = now - self.current_time
+        if elapsed < self.min_interval:
+            return False
+        if self.current_hands == 0 or elapsed > self.max_staleness:
+            return True
+
+        self.last_motion = self.motion(img)
+        return self.last_motion > self.motion_threshold
+
+    def find_hand_array(self, img, draw=True, rgb=None):
+        now = self.clock()
+
+        if self.should_infer(img, now):
+            # drawn afterwards so the landmark overlay does not end up in the motion probe
+            img, hands = self.detector.find_hand_array(img, draw=False, rgb=rgb)
+            self.record(img, hands, now)
+            self.inferences += 1
+
+            if draw:
+                for hand in hands:
+                    self.detector.draw_hand(img, hand)
+            return img, hands
+
+        self.skipped += 1
+        detector = self.detector
+        n = self.current_hands
+        detector.num_hands = n
+        detector.landmark_age = now - self.current_time
+
+        points = self.current_landmarks[:n]
+        if self.extrapolate and self.previous_hands == n:
+            # velocity is capped to the staleness budget so a skipped stretch cannot fling the hand
+            dt = min(now - self.current_time, self.max_staleness)
+            points = points + self.velocity[:n] * dt
+            height, width = img.shape[:2]
+            np.clip(points[:, :, 0], 0, width - 1, out=points[:, :, 0])
+            np.clip(points[:, :, 1], 0, height - 1, out=points[:, :, 1])
+        detector.landmarks[:n, :, 1:] = points
+
+        if draw:
+            for hand in detector.landmarks[:n]:
+                detector.draw_hand(img, hand)
+
+        return img, detector.landmarks[:n]
+
+    def record(self, img, hands, now):
+        self.previous_landmarks, self.current_landmarks = self.current_landmarks, self.previous_landmarks
+        self.previous_time, self.current_time = self.current_time, now
+        self.previous_hands, self.current_hands = self.current_hands, len(hands)
+
+        n = self.current_hands
+        self.current_landmarks[:n] = hands[:, :, 1:]
+
+        dt = self.current_time - self.previous_time
+        if self.previous_hands == n and 0 < dt < math.inf:
+            np.subtract(self.current_landmarks[:n], self.previous_landmarks[:n], out=self.velocity[:n])
+            self.velocity[:n] /= dt
+        else:
+            self.velocity[:n] = 0
+
+        self.probe_box = self.hand_box(img.shape)
+        self.probe = self.take_probe(img, self.probe_box)
+
+    def find_hand(self, img, draw=True, rgb=None):
+        img, _ = self.find_hand_array(img, draw, rgb)
+        return img, self.detector.hand_list
@@ -0,0 +1,223 @@
+import multiprocessing
+import queue
+import time
+
+import cv2
+import numpy as np
+
+from module.FramePool import FramePool
+
+NUM_LANDMARKS = 21
+
+
+def prepare_input(frame, roi, max_size=None, buffers=None, rgb=None):
+    # crops roi (x0, y0, x1, y1) out of the BGR frame, shrinks it so the longer side is at
+    # most max_size and converts it to the RGB image mediapipe expects. The result is
+    # written into rgb when given (it must have the prepared shape), else into a FramePool
+    # buffer when buffers is given.
+    x0, y0, x1, y1 = roi
+    crop = frame[y0:y1, x0:x1]
+
+    longer_side = max(x1 - x0, y1 - y0)
+    if max_size is not None and longer_side > max_size:
+        scale = max_size / longer_side
+        size = (max(int((x1 - x0) * scale), 1), max(int((y1 - y0) * scale), 1))
+        resized = None if buffers is None else buffers.get('inference_resized', (size[1], size[0], 3))
+        crop = cv2.resize(crop, size, dst=resized, interpolation=cv2.INTER_AREA)
+
+    if rgb is None and buffers is not None:
+        rgb = buffers.get('inference_rgb', crop.shape)
+    elif rgb is not None and rgb.shape != crop.shape:
+        raise ValueError(f'rgb buffer has shape {rgb.shape}, inference input is {crop.shape}')
+    return cv2.cvtColor(crop, cv2.COLOR_BGR2RGB, dst=rgb)
+
+
+def _worker_main(worker_id, shm_name, frame_shape, hands_args, max_size, tasks, results):
+    # runs in the worker process, owns its own mediapipe Hands instance
+    import mediapipe as mp
+    from multiprocessing import shared_memory
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    frame = np.ndarray(frame_shape, np.uint8, buffer=shm.buf)
+    hands = mp.solutions.hands.Hands(*hands_args)
+    buffers = FramePool()
+    # the slot is still blank, the slow first inference happens before any real frame comes in
+    hands.process(prepare_input(frame, (0, 0, frame_shape[1], frame_shape[0]), max_size, buffers))
+
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+
+            seq, timestamp, roi = task
+            output = hands.process(prepare_input(frame, roi, max_size, buffers))
+
+            landmarks = np.empty((0, NUM_LANDMARKS, 2), np.float32)
+            handedness = []
+            if output.multi_hand_landmarks:
+                landmarks = np.array([[(lm.x, lm.y) for lm in hand.landmark]
+                                      for hand in output.multi_hand_landmarks], np.float32)
+                handedness = [(hand.classification[0].label, hand.classification[0].score)
+                              for hand in output.multi_handedness]
+
+            results.put((worker_id, seq, timestamp, roi, landmarks, handedness))
+    finally:
+        hands.close()
+        del frame
+        shm.close()
+
+
+class InferencePool:
+    # MediaPipe hand inference in worker processes. Each worker has its own shared memory
+    # frame slot: submit() copies the frame into an idle worker's slot, the one copy on its
+    # way to the worker (nothing is pickled), and poll() returns the newest normalized
+    # landmarks without blocking. Capture cannot write into a slot directly, which one is
+    # free is only known at submit time and the caller keeps drawing on its frame.
+    # Landmarks are normalized to the roi the frame was submitted with. A frame smaller than
+    # the slots goes into their top left corner, only a larger one restarts the workers.
+    # A worker that dies is restarted and its frame comes back without hands; one that dies
+    # before its first result (e.g. mediapipe fails to load) raises RuntimeError.
+
+    def __init__(self, num_workers=1, hands_args=(False, 2, 0.5, 0.5), max_inference_size=None):
+        self.num_workers = num_workers
+        self.hands_args = hands_args
+        self.max_inference_size = max_inference_size
+        self.context = multiprocessing.get_context('spawn')
+
+        self.frame_shape = None
+        self.processes = []
+        self.shms = []
+        self.frames = []
+        self.tasks = []
+        self.results = None
+        self.idle = []
+        self.busy = {}  # worker id -> task it is working on
+        self.served = []  # results per worker since it was started
+
+        self.seq = 0
+        self.latest_seq = 0
+        self.latest = None  # (seq, timestamp, roi, landmarks, handedness)
+
+        self.submitted_frames = 0
+        self.skipped_frames = 0  # frames not submitted because every worker was busy
+        self.restarts = 0  # workers started again after they died
+
+    def start(self, frame_shape):
+        # shared_memory is only imported once workers are used
+        from multiprocessing import shared_memory
+
+        self.close()
+        self.frame_shape = frame_shape
+        self.results = self.context.Queue()
+        size = int(np.prod(frame_shape))
+
+        for worker_id in range(self.num_workers):
+            shm = shared_memory.SharedMemory(create=True, size=size)
+            self.shms.append(shm)
+            self.frames.append(np.ndarray(frame_shape, np.uint8, buffer=shm.buf))
+            self.tasks.append(None)
+            self.processes.append(None)
+            self.served.append(0)
+            self._spawn(worker_id)
+
+    def _spawn(self, worker_id):
+        self.tasks[worker_id] = self.context.Queue()
+        self.processes[worker_id] = self.context.Process(
+            target=_worker_main,
+            args=(worker_id, self.shms[worker_id].name, self.frame_shape, self.hands_args, self.max_inference_size,
+                  self.tasks[worker_id], self.results),
+            daemon=True)
+        self.processes[worker_id].start()
+        self.served[worker_id] = 0
+        self.idle.append(worker_id)
+
+    def fits(self, shape):
+        return (self.frame_shape is not None and len(shape) == len(self.frame_shape) and
+                all(size <= slot for size, slot in zip(shape, self.frame_shape)) and
+                shape[2:] == self.frame_shape[2:])
+
+    def submit(self, frame, roi=None, timestamp=None):
+        # returns the sequence number of the task, False when every worker was busy
+        if not self.fits(frame.shape):
+            self.start(frame.shape)
+
+        if not self.idle:
+            self.skipped_frames += 1
+            return False
+
+        worker_id = self.idle.pop()
+        height, width = frame.shape[:2]
+        np.copyto(self.frames[worker_id][:height, :width], frame)
+        self.seq += 1
+        self.submitted_frames += 1
+        if roi is None:
+            roi = (0, 0, width, height)
+        task = (self.seq, time.perf_counter() if timestamp is None else timestamp, roi)
+        self.busy[worker_id] = task
+        self.tasks[worker_id].put(task)
+        return self.seq
+
+    def collect(self):
+        # drains finished results, returns all of them as (seq, timestamp, roi, landmarks, handedness)
+        finished = []
+        while self.results is not None:
+            try:
+                worker_id, seq, timestamp, roi, landmarks, handedness = self.results.get_nowait()
+            except queue.Empty:
+                break
+
+            self.idle.append(worker_id)
+            self.busy.pop(worker_id, None)
+            self.served[worker_id] += 1
+            finished.append((seq, timestamp, roi, landmarks, handedness))
+
+        finished.extend(self._restart_dead())
+        for result in finished:
+            if result[0] > self.latest_seq:
+                self.latest_seq = result[0]
+                self.latest = result
+
+        return finished
+
+    def _restart_dead(self):
+        # results without hands for the tasks of busy workers that died
+        lost = []
+        for worker_id, (seq, timestamp, roi) in list(self.busy.items()):
+            process = self.processes[worker_id]
+            if process.is_alive():
+                continue
+            if not self.served[worker_id]:
+                raise RuntimeError(f'inference worker {worker_id} exited with code {process.exitcode} '
+                                   'before its first result')
+            del self.busy[worker_id]
+            self.restarts += 1
+            self._spawn(worker_id)
+            lost.append((seq, timestamp, roi, np.empty((0, NUM_LANDMARKS, 2), np.float32), []))
+        return lost
+
+    def poll(self):
+        # drains finished results, returns the newest one seen so far (or None)
+        self.collect()
+        return self.latest
+
+    def close(self):
+        for tasks in self.tasks:
+            tasks.put(None)
+        for process in self.processes:
+            process.join(timeout=1.0)
+            if process.is_alive():
+                process.terminate()
+
+        self.frames = []
+        for shm in self.shms:
+            shm.close()
+            shm.unlink()
+
+        self.processes = []
+        self.shms = []
+        self.tasks = []
+        self.idle = []
+        self.busy = {}
+        self.served = []
+        self.frame_shape = None
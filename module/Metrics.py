@@ -0,0 +1,214 @@
+import collections
+import json
+import threading
+import time
+
+import cv2
+import numpy as np
+
+HUD_COLOR = (220, 153, 232)
+QUANTILES = (50, 95, 99)
+
+
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    __slots__ = ('metrics', 'name', 'start')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = self.metrics.clock()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.record(self.name, (self.metrics.clock() - self.start) * 1000.0)
+        return False
+
+
+class Metrics:
+    # Rolling per-stage latencies (ms), event rates, counters and gauges of the frame loop.
+    # Only every 1 / sample_rate frames is timed; while disabled or between samples
+    # stage() hands back a shared no-op context, so leaving the calls in costs ~nothing.
+
+    def __init__(self, enabled=False, sample_rate=1.0, window=300, clock=time.perf_counter):
+        self.enabled = enabled
+        self.sample_interval = max(int(round(1.0 / sample_rate)), 1) if sample_rate > 0 else 0
+        self.window = window
+        self.clock = clock
+
+        self.frame = 0
+        self.sampling = False
+        self.show_hud = False
+
+        self.stages = collections.OrderedDict()
+        self.events = {}
+        self.counters = collections.OrderedDict()
+        self.gauges = collections.OrderedDict()
+
+    def begin_frame(self):
+        self.frame += 1
+        self.sampling = self.enabled and self.sample_interval > 0 and self.frame % self.sample_interval == 0
+        if self.enabled:
+            self.event('display')
+
+    def stage(self, name):
+        if not self.sampling:
+            return NULL_STAGE
+        return _Stage(self, name)
+
+    def record(self, name, value):
+        samples = self.stages.get(name)
+        if samples is None:
+            samples = self.stages[name] = collections.deque(maxlen=self.window)
+        samples.append(value)
+
+    def event(self, name):
+        if not self.enabled:
+            return
+        stamps = self.events.get(name)
+        if stamps is None:
+            stamps = self.events[name] = collections.deque(maxlen=self.window)
+        stamps.append(self.clock())
+
+    def count(self, name, value=1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_counter(self, name, value):
+        # for totals that are kept elsewhere, e.g. the capture thread's dropped frames
+        if self.enabled:
+            self.counters[name] = value
+
+    def gauge(self, name, value):
+        if self.enabled:
+            self.gauges[name] = value
+
+    def rate(self, name, horizon=1.0):
+        # events per second over the last horizon seconds
+        stamps = self.events.get(name)
+        if not stamps:
+            return 0.0
+        now = self.clock()
+        recent = [stamp for stamp in list(stamps) if now - stamp <= horizon]
+        if len(recent) < 2:
+            return 0.0
+        return (len(recent) - 1) / max(recent[-1] - recent[0], 1e-9)
+
+    def percentiles(self, name):
+        samples = list(self.stages.get(name, ()))
+        if not samples:
+            return None
+        return dict(zip(QUANTILES, np.percentile(samples, QUANTILES).tolist()))
+
+    def snapshot(self):
+        return {
+            'time': time.time(),
+            'frame': self.frame,
+            'stages_ms': {name: self.percentiles(name) for name in list(self.stages)},
+            'rates': {name: self.rate(name) for name in list(self.events)},
+            'counters': dict(self.counters),
+            'gauges': dict(self.gauges)
+        }
+
+    def draw_hud(self, img, extra_lines=(), origin=(10, 90), line_height=18):
+        if not self.enabled or not self.show_hud:
+            return img
+
+        lines = [f'FPS: {self.rate("display"):.1f}  Inference: {self.rate("inference"):.1f}/s']
+        lines += list(extra_lines)
+        lines += [f'{name}: {value}' for name, value in self.counters.items()]
+        lines += [f'{name}: {value:.1f}' for name, value in self.gauges.items()]
+        for name in list(self.stages):
+            quantiles = self.percentiles(name)
+            lines.append(f'{name}: ' + ' / '.join(f'{quantiles[q]:.2f}' for q in QUANTILES) + ' ms')
+
+        x, y = origin
+        for line in lines:
+            cv2.putText(img, line, (x, y), cv2.FONT_HERSHEY_PLAIN, 1, HUD_COLOR, 1)
+            y += line_height
+        return img
+
+    def prometheus_text(self):
+        snapshot = self.snapshot()
+        lines = ['# TYPE painter_stage_latency_ms summary']
+        for name, quantiles in snapshot['stages_ms'].items():
+            for q, value in (quantiles or {}).items():
+                lines.append(f'painter_stage_latency_ms{{stage="{name}",quantile="{q / 100}"}} {value:.4f}')
+        lines.append('# TYPE painter_rate gauge')
+        for name, value in snapshot['rates'].items():
+            lines.append(f'painter_rate{{name="{name}"}} {value:.3f}')
+        lines.append('# TYPE painter_total counter')
+        for name, value in snapshot['counters'].items():
+            lines.append(f'painter_total{{name="{name}"}} {value}')
+        lines.append('# TYPE painter_gauge gauge')
+        for name, value in snapshot['gauges'].items():
+            lines.append(f'painter_gauge{{name="{name}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+NULL_METRICS = Metrics(enabled=False)
+
+
+class JsonLinesExporter:
+    # appends a snapshot every interval seconds, call maybe_export() once per frame
+    def __init__(self, metrics, path, interval=5.0):
+        self.metrics = metrics
+        self.interval = interval
+        self.export_file = open(path, 'a')
+        self.last_export = metrics.clock()
+
+    def maybe_export(self):
+        now = self.metrics.clock()
+        if now - self.last_export < self.interval:
+            return
+        self.last_export = now
+        self.export_file.write(json.dumps(self.metrics.snapshot()) + '\n')
+        self.export_file.flush()
+
+    def close(self):
+        self.export_file.close()
+
+
+class PrometheusEndpoint:
+    # serves metrics.prometheus_text() on http://host:port/metrics from a daemon thread
+    def __init__(self, metrics, port=9108, host='127.0.0.1'):
+        # http.server is only imported when metrics are served
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus_text().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, name='PrometheusEndpoint', daemon=True)
+        self.thread.start()
+
+    def maybe_export(self):
+        pass
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -2,18 +2,22 @@ import cv2 as cv
 import numpy as np
 import enum
 
+from module.AlphaBlit import OverlayLayer, Sprite, blit
+from module.IconCache import load_icon
+
 
 class MenuMode(enum.Enum):
     paint = 0
     thickness = 1
-    # color = 2
     eraser = 2
     hand = 3
+    fill = 4
+    color = 5
 
 
 class Menu:
 
-    def __init__(self, cv2, items=[], width=500, height=100):
+    def __init__(self, cv2, items=[], width=500, height=100, on_select=None, icons=None):
         self.MENU_WIDTH = width
         self.MENU_HEIGHT = height
         self.MENU_ITEM_WIDTH = 48
@@ -27,25 +31,43 @@ class Menu:
 
         item_size = (self.MENU_ITEM_WIDTH, self.MENU_ITEM_WIDTH)
 
+        # both looks of every item are baked once, selecting only swaps sprites; with an
+        # IconCache both come from it instead of being decoded and drawn again
+        selected_variant = f'selected{self.BORDER_WIDTH}-' + '-'.join(map(str, self.SELECTED_COLOR))
         self.menuItems = []
         for idx, val in enumerate(items):
             top_left = ((idx * self.MENU_ITEM_WIDTH + (idx + 1) * self.ITEM_MARGIN_WIDTH), self.ITEM_MARGIN_HEIGHT)
             bottom_right = (top_left[0] + self.MENU_ITEM_WIDTH, top_left[1] + self.MENU_ITEM_WIDTH)
-            self.menuItems.append(MenuItem(val, cv2, (top_left, bottom_right), size=item_size))
+            item = MenuItem(val, cv2, (top_left, bottom_right), size=item_size, icons=icons)
+            if icons is None:
+                selected = self.drawBorder(cv2, item.img)
+            else:
+                selected = icons.icon(val[1], item_size, selected_variant, lambda img: self.drawBorder(cv2, img))
+            item.selected_sprite = Sprite(selected)
+            self.menuItems.append(item)
+
+        # the whole menu is pre-rendered into one layer, re-rendered only when the selection changes
+        layer_width = max(item.hit_box[1][0] for item in self.menuItems) + 2 * self.BORDER_WIDTH
+        layer_height = max(item.hit_box[1][1] for item in self.menuItems) + 2 * self.BORDER_WIDTH
+        self.layer = OverlayLayer((0, 0), (layer_width, layer_height))
+        self.layer_dirty = True
 
         self.selectedMenuItemIndex = 0
         self.current_item = self.menuItems[self.selectedMenuItemIndex]
-        self.selectedImage = self.menuItems[self.selectedMenuItemIndex].img
-        self.select(self.selectedMenuItemIndex, cv2)
 
-    def select(self, index, cv2):
-        self.selectedImage = self.removeBorder(cv2, self.selectedImage)
+        # called with the new item whenever the selection changes
+        self.on_select = on_select
+
+    def select(self, index, cv2=None):
+        # returns False when index already is the selected item, nothing is redrawn then
+        if index == self.selectedMenuItemIndex:
+            return False
         self.selectedMenuItemIndex = index
         self.current_item = self.menuItems[index]
-        self.selectedImage = self.menuItems[self.selectedMenuItemIndex].img
-        self.selectedImage = self.drawBorder(cv2, self.selectedImage)
-        mask = np.all(self.selectedImage == self.UNSELECTED_COLOR, axis=-1)
-        self.selectedImage[mask] = self.SELECTED_COLOR
+        self.layer_dirty = True
+        if self.on_select is not None:
+            self.on_select(self.current_item)
+        return True
 
     def drawBorder(self, cv2, img):
         img = cv2.copyMakeBorder(img, self.BORDER_WIDTH, self.BORDER_WIDTH, self.BORDER_WIDTH,
@@ -54,60 +76,53 @@ class Menu:
         img[mask] = self.SELECTED_COLOR
         return img
 
-    def removeBorder(self, cv2, img):
-        img = cv2.copyMakeBorder(img, 0, 0, 0, 0, cv2.BORDER_CONSTANT, value=self.SELECTED_COLOR)
-        mask = np.all(img == self.SELECTED_COLOR, axis=-1)
-        img[mask] = self.UNSELECTED_COLOR
-        # img[np.all(im == self.SELECTED_COLOR), axi]
-        return img
-
-    def draw(self, cv2, img):
-        # img = np.zeros([self.MENU_HEIGHT, self.MENU_WIDTH, 3])
-        masked_img = img
+    def render_layer(self):
+        self.layer.clear()
         for idx, item in enumerate(self.menuItems):
             if idx == self.selectedMenuItemIndex:
-                masked_img = self.transparent_overlay(masked_img, self.selectedImage, pos=item.hit_box[0])
+                self.layer.paste(item.selected_sprite, pos=item.hit_box[0])
             else:
-                masked_img = self.transparent_overlay(masked_img, item.img, pos=item.hit_box[0])
+                self.layer.paste(item.sprite, pos=item.hit_box[0])
+        self.layer.invalidate()
+        self.layer_dirty = False
 
-        return masked_img
+    def draw(self, cv2, img):
+        if self.layer_dirty:
+            self.render_layer()
+        return self.layer.apply(img)
 
     def select_menu_item_if_possible(self, cv2, current_position):
         for idx, item in enumerate(self.menuItems):
             if item.is_inside(current_position):
                 # print(f'Selected Index {idx}')
-                self.select(self.selectedMenuItemIndex, cv2)
-                return item
+                self.select(idx, cv2)
+                break
         return self.current_item
 
     def select_by_mode(self, mode: MenuMode, cv2):
-        self.select(mode.value, cv2)
+        for idx, item in enumerate(self.menuItems):
+            if item.mode == mode:
+                self.select(idx, cv2)
+                return
 
     @staticmethod
     def transparent_overlay(src, overlay, pos=(0, 0), scale=1):
-        # overlay = cv2.resize(overlay, (0, 0), fx=scale, fy=scale)
-        h, w, _ = overlay.shape  # Size of overlay
-        rows, cols, _ = src.shape  # Size of background Image
-        y, x = pos[0], pos[1]  # Position of foreground/overlay image
-
-        for i in range(h):
-            for j in range(w):
-                if x + i >= rows or y + j >= cols:
-                    continue
-                alpha = float(overlay[i][j][3] / 255.0)  # read the alpha channel
-                src[x + i][y + j] = alpha * overlay[i][j][:3] + (1 - alpha) * src[x + i][y + j]
-        return src
+        # overlay can be a raw RGBA image or a prepared Sprite, prefer the Sprite in hot paths
+        if not isinstance(overlay, Sprite):
+            overlay = Sprite(overlay)
+        return blit(src, overlay, pos)
 
 
 class MenuItem:
 
-    def __init__(self, data, cv2, hit_box, size):
+    def __init__(self, data, cv2, hit_box, size, icons=None):
         self.title = data[0]
         self.mode = data[2]
-        self.img = cv2.imread(data[1], cv2.IMREAD_UNCHANGED)
         self.hit_box = hit_box  # (top_left_position, bottom_right_position)
         self.size = size
-        self.img = cv2.resize(self.img, self.size, interpolation=cv2.INTER_AREA)
+        self.img = load_icon(data[1], self.size) if icons is None else icons.icon(data[1], self.size)
+        self.sprite = Sprite(self.img)
+        self.selected_sprite = self.sprite  # replaced by the menu with the bordered variant
         # print(f'Image shape {self.img.shape}')
 
     def is_inside(self, pos):
@@ -0,0 +1,533 @@
+import collections
+import ipaddress
+import itertools
+import json
+import os
+import queue
+import socket
+import threading
+import time
+from multiprocessing import BufferTooShort
+from multiprocessing.connection import Client, Listener, wait
+
+import numpy as np
+
+from module.HandTrackingModule import HandDetector
+from module.InferenceWorker import InferencePool
+from module.Metrics import Metrics
+
+# Connection.recv() unpickles what clients send, so whoever passes the authkey handshake can run
+# code in the server. This key is public, it only keeps other programs' connections out and is
+# accepted for addresses reachable from this machine alone; anything else needs a secret key.
+AUTHKEY = b'virtual-painter'
+
+# Wire protocol, one pickled header per message via Connection.send, pixels follow as raw bytes:
+#   client: ('hello', (width, height))      server: ('welcome', session_id, (width, height)) or ('error', text)
+#   client: ('frame', frame_id) + pixels    server: ('frame', frame_id, (h, w, c)) + pixels or ('dropped', frame_id)
+#   client: ('key', key)                    forwarded to the session's painter
+#   client: ('bye',)                        the server answers every frame still queued, then ('bye',)
+# A malformed message (e.g. pixels that do not match the announced frame size) is answered with
+# ('error', text) and closes that session, so does any error while painting for it.
+
+# argument types of every client message, after its kind
+MESSAGES = {'hello': (tuple,), 'frame': (int,), 'key': (int,), 'bye': ()}
+
+
+def parse_address(text):
+    # "host:port" for TCP, anything else is a unix socket path
+    host, _, port = text.rpartition(':')
+    if host and port.isdigit():
+        return host, int(port)
+    return text
+
+
+def valid_message(message):
+    # a tuple of a known kind followed by arguments of the kind's types
+    if not isinstance(message, tuple) or not message or message[0] not in MESSAGES:
+        return False
+    types = MESSAGES[message[0]]
+    return len(message) == len(types) + 1 and all(isinstance(arg, kind) for arg, kind in zip(message[1:], types))
+
+
+def is_local(address):
+    # unix sockets and TCP addresses that only resolve to loopback are not reachable from outside
+    if isinstance(address, str):
+        return True
+    try:
+        infos = socket.getaddrinfo(address[0], address[1], type=socket.SOCK_STREAM)
+        return all(ipaddress.ip_address(info[4][0]).is_loopback for info in infos)
+    except (OSError, ValueError):
+        return False
+
+
+class SessionDetector(HandDetector):
+    # HandDetector of one session whose landmarks come from the server's shared InferencePool,
+    # find_hand_array() hands back those of the frame being processed
+    def create_hands(self, hands_args):
+        return None
+
+    def find_hand_array(self, img, draw=True, rgb=None):
+        if draw:
+            for hand in self.landmarks[:self.num_hands]:
+                self.draw_hand(img, hand)
+        return img, self.landmarks[:self.num_hands]
+
+
+class PaintingSession:
+    # server side state of one connected client: its Painter (canvas, menus, brush), a detector
+    # holding its landmarks and its frames waiting for or in inference, in arrival order.
+    # Answers are written by a sender thread, so a client that is slow to read (or busy
+    # sending its next frame) never holds up the serving loop and the other sessions.
+
+    def __init__(self, session_id, conn, frame_size, painter, detector, queue_size):
+        self.session_id = session_id
+        self.conn = conn
+        self.frame_size = frame_size
+        self.painter = painter
+        self.detector = detector
+        self.queue_size = queue_size
+
+        self.waiting = collections.deque()  # frames not submitted yet
+        self.submitted = collections.deque()  # frames in inference or done, processed head first
+        self.free_frames = []  # receive buffers of frames that were answered
+        self.in_flight = 0
+        self.last_turn = -1  # scheduler turn of the last submission, older goes first
+        self.closing = False
+
+        self.outbox = queue.Queue()  # (header, pixels or None), None stops the sender
+        self.free_replies = []  # pixel buffers the sender is done with
+        self.broken = False  # the connection failed while sending
+        self.sender = threading.Thread(target=self._send_loop, name=f'PaintingSession-{session_id}', daemon=True)
+        self.sender.start()
+
+        self.metrics = Metrics(enabled=True)
+        self.started = time.perf_counter()
+
+    def frame_buffer(self):
+        if self.free_frames:
+            return self.free_frames.pop()
+        width, height = self.frame_size
+        return np.empty((height, width, 3), np.uint8)
+
+    def send(self, header, img=None):
+        # img is copied, the caller may reuse it right away
+        reply = None
+        if img is not None:
+            reply = self.free_replies.pop() if self.free_replies else None
+            if reply is None or reply.shape != img.shape:
+                reply = np.empty_like(img)
+            np.copyto(reply, img)
+        self.outbox.put((header, reply))
+
+    def _send_loop(self):
+        while True:
+            item = self.outbox.get()
+            if item is None:
+                break
+            header, reply = item
+            if self.broken:
+                continue
+            try:
+                self.conn.send(header)
+                if reply is not None:
+                    self.conn.send_bytes(reply.reshape(-1).data)
+                    self.free_replies.append(reply)
+            except OSError:
+                self.broken = True
+
+    def close(self):
+        # waits until everything queued is sent
+        self.outbox.put(None)
+        self.sender.join()
+        self.conn.close()
+        self.painter.close()
+
+    def stats(self):
+        snapshot = self.metrics.snapshot()
+        counters = snapshot['counters']
+        elapsed = time.perf_counter() - self.started
+        return {
+            'session': self.session_id,
+            'frame_size': list(self.frame_size),
+            'fps': snapshot['rates'].get('display', 0.0),
+            'average_fps': counters.get('returned_frames', 0) / max(elapsed, 1e-9),
+            'latency_ms': snapshot['stages_ms'],
+            'counters': counters
+        }
+
+
+class _Frame:
+    __slots__ = ('frame_id', 'img', 'received', 'submitted', 'result')
+
+    def __init__(self, frame_id, img, received):
+        self.frame_id = frame_id
+        self.img = img
+        self.received = received
+        self.submitted = None
+        self.result = None  # (timestamp, roi, landmarks, handedness) once inference is back
+
+
+class PaintingServer:
+    # Paints for several local clients at once, on a unix socket or a loopback TCP address unless
+    # a secret authkey is given. Each connection is a session with its own
+    # Painter made by painter_factory(frame_size); hand inference for all of them runs on one
+    # InferencePool of num_workers processes. A session queues at most queue_size frames
+    # (the oldest is dropped and answered with 'dropped'), and idle workers always take the
+    # next frame of the waiting session with the fewest frames in flight, the one served
+    # longest ago first, so a fast client cannot starve the others. Results go back through
+    # the session's Painter in frame order and the composited frame is sent back. Frames of
+    # up to max_frame_size (width, height) share the pool's slots, larger ones are refused, so
+    # are ones smaller than min_frame_size. A client that breaks the protocol, or whose painter
+    # raises, only loses its own session.
+
+    def __init__(self, address, painter_factory, num_workers=2, max_frame_size=(1920, 1080), min_frame_size=(1, 1),
+                 hands_args=(True, 2, 0.7, 0.5), max_inference_size=None, track_roi=False,
+                 queue_size=2, key_handler=None, authkey=None, report_file=None, report_interval=5.0):
+        if authkey is None:
+            if not is_local(address):
+                raise ValueError(f'{address} is reachable from other machines, serving it needs a secret authkey')
+            authkey = AUTHKEY
+        self.painter_factory = painter_factory
+        self.key_handler = key_handler
+        self.max_frame_size = tuple(max_frame_size)
+        self.min_frame_size = tuple(min_frame_size)
+        self.max_num_hands = hands_args[1]
+        self.track_roi = track_roi
+        self.queue_size = queue_size
+
+        # frames of all sessions go through every worker, a hand tracked in one session's frame
+        # says nothing about the next frame, which is likely another session's: each one is
+        # detected on its own (static_image_mode)
+        hands_args = (True,) + tuple(hands_args[1:])
+        self.pool = InferencePool(num_workers, hands_args, max_inference_size)
+
+        # bound before the workers start, a taken address leaves no processes behind
+        self.listener = Listener(address, authkey=authkey)
+        self.address = self.listener.address
+        if isinstance(self.address, str):
+            os.chmod(self.address, 0o600)  # other users of the machine cannot connect either
+        try:
+            width, height = self.max_frame_size
+            self.pool.start((height, width, 3))
+        except BaseException:
+            self.listener.close()
+            self.pool.close()
+            raise
+
+        self.sessions = {}
+        self.session_ids = itertools.count(1)
+        self.turns = itertools.count()
+        self.in_flight = {}  # pool seq -> (session, frame)
+        self.finished_stats = []  # stats of sessions that disconnected
+
+        self.report_file = None if report_file is None else open(report_file, 'a')
+        self.report_interval = report_interval
+        self.last_report = time.perf_counter()
+
+        # accept() blocks, new connections are handed to the serving loop through a queue
+        self.accepted = queue.Queue()
+        self.running = True
+        self.accept_thread = threading.Thread(target=self._accept, name='PaintingServer', daemon=True)
+        self.accept_thread.start()
+
+    def _accept(self, hello_timeout=5.0):
+        while True:
+            try:
+                conn = self.listener.accept()
+                hello = conn.recv() if conn.poll(hello_timeout) else None
+            except OSError:
+                if not self.running:
+                    break  # listener closed
+                continue
+            except Exception:
+                continue  # failed handshake, e.g. wrong authkey
+            self.accepted.put((conn, hello))
+
+    def serve(self, duration=None, max_sessions=None):
+        # runs until stop(), after duration seconds, or once max_sessions sessions have come and gone
+        end = None if duration is None else time.perf_counter() + duration
+        while self.running and (end is None or time.perf_counter() < end):
+            self.step(timeout=0.001 if self.in_flight else 0.02)
+            if max_sessions is not None and len(self.finished_stats) >= max_sessions and not self.sessions:
+                break
+
+    def stop(self):
+        self.running = False
+
+    def step(self, timeout=0.0):
+        while not self.accepted.empty():
+            self._open(*self.accepted.get())
+
+        conns = [session.conn for session in self.sessions.values() if not session.closing]
+        if conns:
+            for conn in wait(conns, timeout):
+                self._receive(self._session_of(conn))
+        else:
+            time.sleep(timeout)
+
+        for seq, timestamp, roi, landmarks, handedness in self.pool.collect():
+            session, frame = self.in_flight.pop(seq, (None, None))
+            if session is None:
+                continue
+            session.in_flight -= 1
+            frame.result = (timestamp, roi, landmarks, handedness)
+            self._process(session)
+
+        self._schedule()
+        for session in list(self.sessions.values()):
+            if session.broken:
+                session.waiting.clear()
+                session.closing = True
+            if session.closing and not session.waiting and not session.submitted:
+                self._close(session)
+        self.maybe_report()
+
+    def _session_of(self, conn):
+        for session in self.sessions.values():
+            if session.conn is conn:
+                return session
+
+    def _open(self, conn, hello):
+        if not valid_message(hello) or hello[0] != 'hello':
+            conn.close()
+            return
+        frame_size = hello[1]
+        if len(frame_size) != 2 or not all(isinstance(size, int) for size in frame_size):
+            self._reject(conn, 'hello needs the frame size as (width, height)')
+            return
+        if any(size > limit for size, limit in zip(frame_size, self.max_frame_size)):
+            self._reject(conn, f'frames must be at most {self.max_frame_size[0]}x{self.max_frame_size[1]}')
+            return
+        if any(size < limit for size, limit in zip(frame_size, self.min_frame_size)):
+            self._reject(conn, f'frames must be at least {self.min_frame_size[0]}x{self.min_frame_size[1]}')
+            return
+
+        try:
+            painter = self.painter_factory(frame_size)
+        except Exception as error:
+            self._reject(conn, f'cannot paint {frame_size[0]}x{frame_size[1]} frames: {error!r}')
+            return
+        session_id = next(self.session_ids)
+        detector = SessionDetector(max_num_hands=self.max_num_hands, track_roi=self.track_roi)
+        self.sessions[session_id] = PaintingSession(session_id, conn, frame_size, painter, detector, self.queue_size)
+        self.sessions[session_id].send(('welcome', session_id, painter.display_size))
+
+    @staticmethod
+    def _reject(conn, reason):
+        # answers a hello that does not become a session
+        try:
+            conn.send(('error', reason))
+        except OSError:
+            pass
+        conn.close()
+
+    def _receive(self, session):
+        conn = session.conn
+        received = None
+        try:
+            message = conn.recv()
+            if valid_message(message) and message[0] == 'frame':
+                img = session.frame_buffer()
+                received = conn.recv_bytes_into(img.reshape(-1))
+        except (EOFError, OSError):
+            # the client is gone, nothing is answered any more
+            session.waiting.clear()
+            session.closing = True
+            return
+        except BufferTooShort:
+            received = -1  # more pixels than the frame size, the message was read whole
+        except Exception:
+            message = None  # a header that does not unpickle
+
+        if not valid_message(message) or message[0] == 'hello':
+            self._refuse(session, f'malformed message {message!r:.80}')
+            return
+        if received is not None and received != img.nbytes:
+            width, height = session.frame_size
+            self._refuse(session, f'frames must be {width}x{height} BGR, as announced')
+            return
+
+        kind = message[0]
+        try:
+            if kind == 'frame':
+                self._queue(session, _Frame(message[1], img, time.perf_counter()))
+            elif kind == 'key':
+                if self.key_handler is not None:
+                    self.key_handler(session.painter, message[1])
+            elif kind == 'bye':
+                session.closing = True
+        except Exception as error:
+            self._refuse(session, f'{kind} failed: {error!r}')
+
+    def _refuse(self, session, reason):
+        # a broken client only ends its own session, its frames are not answered any more
+        session.send(('error', reason))
+        session.waiting.clear()
+        session.submitted.clear()
+        session.closing = True
+
+    def _queue(self, session, frame):
+        session.metrics.count('received_frames')
+        if len(session.waiting) >= session.queue_size:
+            # newest frame wins, like the camera capture thread
+            dropped = session.waiting.popleft()
+            session.free_frames.append(dropped.img)
+            session.metrics.count('dropped_frames')
+            session.send(('dropped', dropped.frame_id))
+        session.waiting.append(frame)
+
+    def _schedule(self):
+        # hands idle workers the next frame of the session with the fewest in flight, least recently served first
+        while self.pool.idle:
+            waiting = [session for session in self.sessions.values() if session.waiting]
+            if not waiting:
+                return
+            session = min(waiting, key=lambda s: (s.in_flight, s.last_turn))
+            frame = session.waiting.popleft()
+
+            roi = session.detector.inference_roi(frame.img.shape)
+            frame.submitted = time.perf_counter()
+            seq = self.pool.submit(frame.img, roi, frame.submitted)
+            self.in_flight[seq] = (session, frame)
+            session.submitted.append(frame)
+            session.in_flight += 1
+            session.last_turn = next(self.turns)
+
+    def _process(self, session):
+        # paints every frame at the head whose landmarks are back, so strokes keep their order
+        metrics = session.metrics
+        detector = session.detector
+        while session.submitted and session.submitted[0].result is not None:
+            frame = session.submitted.popleft()
+            timestamp, roi, landmarks, handedness = frame.result
+            now = time.perf_counter()
+            metrics.begin_frame()
+            metrics.record('queue', (frame.submitted - frame.received) * 1000.0)
+            metrics.record('inference', (now - frame.submitted) * 1000.0)
+
+            detector.store_landmarks(landmarks, handedness, roi)
+            detector.landmark_age = now - timestamp
+
+            try:
+                with metrics.stage('process'):
+                    img = session.painter.process(frame.img, detector)
+            except Exception as error:
+                self._refuse(session, f'painting failed: {error!r}')
+                return
+            session.send(('frame', frame.frame_id, img.shape), img)
+            session.free_frames.append(frame.img)
+
+            metrics.record('latency', (time.perf_counter() - frame.received) * 1000.0)
+            metrics.count('returned_frames')
+
+    def _close(self, session):
+        # frames still in the pool are answered by nobody, their results are ignored
+        for seq, (owner, _) in list(self.in_flight.items()):
+            if owner is session:
+                del self.in_flight[seq]
+        session.send(('bye',))
+        session.close()
+        del self.sessions[session.session_id]
+
+        stats = session.stats()
+        self.finished_stats.append(stats)
+        self._write_report([stats], final=True)
+
+    def stats(self):
+        return [session.stats() for session in self.sessions.values()]
+
+    def maybe_report(self):
+        now = time.perf_counter()
+        if now - self.last_report < self.report_interval:
+            return
+        self.last_report = now
+        self._write_report(self.stats())
+
+    def _write_report(self, stats, final=False):
+        if self.report_file is None:
+            return
+        for entry in stats:
+            self.report_file.write(json.dumps(dict(entry, time=time.time(), final=final)) + '\n')
+        self.report_file.flush()
+
+    def close(self):
+        self.running = False
+        for session in list(self.sessions.values()):
+            session.waiting.clear()
+            session.submitted.clear()
+            self._close(session)
+        self.listener.close()
+        self.pool.close()
+        if self.report_file is not None:
+            self.report_file.close()
+
+
+class PaintingClient:
+    # A painting station's end of a PaintingServer connection. process(img) sends the frame and
+    # returns the newest composited frame that came back (None until the first one); up to
+    # window frames are in flight before it waits for an answer.
+
+    def __init__(self, address, frame_size, window=2, authkey=None):
+        self.conn = Client(address, authkey=AUTHKEY if authkey is None else authkey)
+        self.conn.send(('hello', tuple(frame_size)))
+        reply = self.conn.recv()
+        if reply[0] != 'welcome':
+            self.conn.close()
+            raise ConnectionError(reply[1])
+        _, self.session_id, display_size = reply
+        width, height = display_size
+
+        self.window = window
+        self.frame = np.zeros((height, width, 3), np.uint8)
+        self.sent = {}  # frame_id -> send time
+        self.frame_ids = itertools.count()
+        self.returned_frames = 0
+        self.metrics = Metrics(enabled=True)
+
+    def send(self, img):
+        frame_id = next(self.frame_ids)
+        self.sent[frame_id] = time.perf_counter()
+        self.conn.send(('frame', frame_id))
+        self.conn.send_bytes(np.ascontiguousarray(img).reshape(-1).data)
+        return frame_id
+
+    def receive(self, timeout=None):
+        # handles one answer, returns False when none came within timeout
+        if not self.conn.poll(timeout):
+            return False
+        message = self.conn.recv()
+        kind = message[0]
+        if kind == 'error':
+            raise ConnectionError(message[1])
+        if kind == 'frame':
+            self.conn.recv_bytes_into(self.frame.reshape(-1))
+        if kind in ('frame', 'dropped'):
+            sent = self.sent.pop(message[1])
+            if kind == 'frame':
+                self.returned_frames += 1
+                self.metrics.begin_frame()
+                self.metrics.record('round_trip', (time.perf_counter() - sent) * 1000.0)
+            else:
+                self.metrics.count('dropped_frames')
+        return kind
+
+    def process(self, img):
+        self.send(img)
+        while self.receive(0):
+            pass
+        while len(self.sent) >= self.window:
+            self.receive()
+        return self.frame if self.returned_frames else None
+
+    def send_key(self, key):
+        self.conn.send(('key', key))
+
+    def close(self):
+        # waits for the frames still in flight
+        try:
+            self.conn.send(('bye',))
+            while self.receive() != 'bye':
+                pass
+        except (EOFError, OSError):
+            pass
+        self.conn.close()
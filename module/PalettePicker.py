@@ -0,0 +1,80 @@
+import cv2
+import numpy as np
+
+from module.AlphaBlit import OverlayLayer
+
+
+class PalettePicker:
+    # Hue/saturation wheel with a value slider next to it. The full-value wheel is computed
+    # once; the wheel shown (and picked from) is that image scaled by the current value and
+    # is only rebuilt when the value changes, together with the overlay layer. pick() is a
+    # single array lookup at the fingertip.
+
+    def __init__(self, frame_size, radius=None, slider_width=24, spacing=20, value=255):
+        frame_width, frame_height = frame_size
+        self.radius = radius or min(frame_width, frame_height) // 4
+        diameter = 2 * self.radius + 1
+
+        layer_width = diameter + spacing + slider_width
+        top_left = ((frame_width - layer_width) // 2, (frame_height - diameter) // 2)
+        self.layer = OverlayLayer(top_left, (layer_width, diameter))
+        self.slider_rect = (diameter + spacing, 0, layer_width, diameter)  # layer coordinates
+
+        # hue from the angle, saturation from the distance to the centre, both at full value
+        ys, xs = np.mgrid[-self.radius:self.radius + 1, -self.radius:self.radius + 1].astype(np.float32)
+        hue = (np.degrees(np.arctan2(ys, xs)) % 360) / 2
+        saturation = np.minimum(np.hypot(xs, ys) / self.radius, 1) * 255
+        hsv = np.dstack([hue, saturation, np.full_like(hue, 255)]).astype(np.uint8)
+        self.full_wheel = cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)
+
+        self.wheel_alpha = np.zeros((diameter, diameter), np.uint8)
+        cv2.circle(self.wheel_alpha, (self.radius, self.radius), self.radius, 255, cv2.FILLED, cv2.LINE_AA)
+        self.wheel_alpha3 = cv2.merge([self.wheel_alpha] * 3)
+
+        # slider rows, top is full value
+        self.slider_values = np.linspace(255, 0, diameter).round().astype(np.uint8)
+
+        self.wheel = np.empty_like(self.full_wheel)
+        self.value = None
+        self.set_value(value)
+
+    def set_value(self, value):
+        if value == self.value:
+            return
+        self.value = value
+        cv2.convertScaleAbs(self.full_wheel, dst=self.wheel, alpha=value / 255.0)
+        self.render_layer()
+
+    def render_layer(self):
+        layer = self.layer
+        diameter = 2 * self.radius + 1
+        layer.clear()
+
+        # layer colors are premultiplied
+        cv2.multiply(self.wheel, self.wheel_alpha3, dst=layer.color[:, :diameter], scale=1 / 255.0)
+        layer.alpha[:, :diameter] = self.wheel_alpha
+
+        x0, y0, x1, y1 = self.slider_rect
+        layer.color[y0:y1, x0:x1] = self.slider_values[:, None, None]
+        layer.alpha[y0:y1, x0:x1] = 255
+        marker_y = int(np.argmin(np.abs(self.slider_values.astype(np.int16) - self.value)))
+        cv2.rectangle(layer.color, (x0, marker_y - 2), (x1 - 1, marker_y + 2), (0, 0, 255), cv2.FILLED)
+
+        layer.invalidate()
+
+    def draw(self, img):
+        return self.layer.apply(img)
+
+    def pick(self, pos):
+        # BGR tuple under pos (frame coordinates), None outside the wheel; the slider sets the value
+        x, y = pos[0] - self.layer.top_left[0], pos[1] - self.layer.top_left[1]
+        if not (0 <= x < self.layer.width and 0 <= y < self.layer.height):
+            return None
+
+        x0, y0, x1, y1 = self.slider_rect
+        if x0 <= x < x1:
+            self.set_value(int(self.slider_values[y]))
+            return None
+        if x < self.wheel.shape[1] and self.wheel_alpha[y, x] == 255:
+            return tuple(self.wheel[y, x].tolist())
+        return None
@@ -0,0 +1,53 @@
+import math
+
+import numpy as np
+
+
+class ScaleTransform:
+    # Maps pixel coordinates between two resolutions of the same picture, e.g. capture to
+    # display or display to canvas. Built once per pair of sizes; the identity case hands
+    # coordinates back untouched.
+
+    def __init__(self, src_size, dst_size):
+        self.src_size = tuple(src_size)
+        self.dst_size = tuple(dst_size)
+        self.identity = self.src_size == self.dst_size
+
+        self.sx = self.dst_size[0] / self.src_size[0]
+        self.sy = self.dst_size[1] / self.src_size[1]
+        self.scale = (self.sx + self.sy) / 2
+        self._inverse = None
+
+    @property
+    def inverse(self):
+        if self._inverse is None:
+            self._inverse = ScaleTransform(self.dst_size, self.src_size)
+            self._inverse._inverse = self
+        return self._inverse
+
+    def point(self, x, y):
+        if self.identity:
+            return x, y
+        return int(x * self.sx), int(y * self.sy)
+
+    def length(self, value):
+        # brush widths and radii, never scaled below one pixel
+        if self.identity:
+            return value
+        return max(int(round(value * self.scale)), 1)
+
+    def rect(self, x0, y0, x1, y1):
+        # smallest dst rect covering the src rect, clipped to dst
+        if self.identity:
+            return x0, y0, x1, y1
+        width, height = self.dst_size
+        return (max(int(x0 * self.sx), 0), max(int(y0 * self.sy), 0),
+                min(math.ceil(x1 * self.sx), width), min(math.ceil(y1 * self.sy), height))
+
+    def points(self, src, out):
+        # (..., 2) array of (x, y) into the int32 array out of the same shape
+        if self.identity:
+            out[:] = src
+        else:
+            np.multiply(src, (self.sx, self.sy), out=out, casting='unsafe')
+        return out
@@ -0,0 +1,129 @@
+import os
+import queue
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from module.FrameIO import VIDEO_EXTENSIONS
+
+POLICIES = ('drop', 'block')
+
+
+class SessionRecorder:
+    # Records frames to a video file without encoding on the caller's thread. record()
+    # copies the frame (downscaled by scale, only every n-th call) into one of queue_size
+    # preallocated slots and returns; an encoder thread writes the slots in order. When all
+    # slots are waiting for the encoder, policy 'drop' skips the frame and 'block' waits
+    # for a free slot. Frames are placed by their timestamp on the fixed fps timeline of
+    # the file, repeated or skipped as needed, so the video plays at the speed of the
+    # session and not at the speed frames were recorded or encoded.
+
+    def __init__(self, path, fps=30, queue_size=8, policy='drop', scale=1.0, every=1):
+        if policy not in POLICIES:
+            raise ValueError(f'policy must be one of {POLICIES}, got {policy!r}')
+        if queue_size < 1 or every < 1:
+            raise ValueError('queue_size and every must be at least 1')
+        self.fourcc = VIDEO_EXTENSIONS[os.path.splitext(path)[1].lower()]
+
+        self.path = path
+        self.fps = fps
+        self.policy = policy
+        self.scale = scale
+        self.every = every
+
+        self.slots = None  # allocated once the first frame tells us the shape
+        self.timestamps = [0.0] * queue_size
+        self.free = queue.Queue()
+        for idx in range(queue_size):
+            self.free.put(idx)
+        self.filled = queue.Queue()  # slot indices in recording order, None stops the encoder
+
+        # counters
+        self.offered_frames = 0
+        self.recorded_frames = 0
+        self.dropped_frames = 0
+        self.written_frames = 0  # frames in the file, repeats included
+
+        self.writer = None
+        self.start_time = None
+        self.last_frame = None
+        self.error = None
+        self.thread = threading.Thread(target=self._run, name='SessionRecorder', daemon=True)
+        self.thread.start()
+
+    def frame_size(self, img):
+        height, width = img.shape[:2]
+        if self.scale == 1.0:
+            return width, height
+        return max(int(round(width * self.scale)), 1), max(int(round(height * self.scale)), 1)
+
+    def record(self, img, timestamp=None):
+        # returns True when the frame was queued
+        if timestamp is None:
+            timestamp = time.perf_counter()
+        self.offered_frames += 1
+        if (self.offered_frames - 1) % self.every or self.error is not None:
+            return False
+
+        try:
+            slot = self.free.get(block=self.policy == 'block')
+        except queue.Empty:
+            self.dropped_frames += 1
+            return False
+
+        width, height = self.frame_size(img)
+        if self.slots is None:
+            self.slots = np.empty((len(self.timestamps), height, width) + img.shape[2:], img.dtype)
+        if (width, height) == (img.shape[1], img.shape[0]):
+            np.copyto(self.slots[slot], img)
+        else:
+            cv2.resize(img, (width, height), dst=self.slots[slot], interpolation=cv2.INTER_AREA)
+
+        self.timestamps[slot] = timestamp
+        self.recorded_frames += 1
+        self.filled.put(slot)
+        return True
+
+    def _run(self):
+        while True:
+            slot = self.filled.get()
+            if slot is None:
+                break
+            try:
+                self._write(self.slots[slot], self.timestamps[slot])
+            except cv2.error as error:
+                self.error = error
+            self.free.put(slot)
+
+        if self.writer is not None:
+            self.writer.release()
+
+    def _write(self, frame, timestamp):
+        if self.writer is None:
+            self.writer = cv2.VideoWriter(self.path, cv2.VideoWriter_fourcc(*self.fourcc), self.fps,
+                                          (frame.shape[1], frame.shape[0]))
+            self.start_time = timestamp
+            self.last_frame = np.empty_like(frame)
+
+        index = int(round((timestamp - self.start_time) * self.fps))
+        if index < self.written_frames:
+            return  # more frames than the file's fps, this timeline slot is already taken
+
+        # the previous frame stays on screen until this one shows up
+        while self.written_frames < index:
+            self.writer.write(self.last_frame)
+            self.written_frames += 1
+        self.writer.write(frame)
+        self.written_frames += 1
+        np.copyto(self.last_frame, frame)
+
+    @property
+    def pending_frames(self):
+        return self.filled.qsize()
+
+    def close(self):
+        # waits for the queued frames to be encoded
+        self.filled.put(None)
+        self.thread.join()
@@ -0,0 +1,96 @@
+import threading
+import time
+
+import numpy as np
+
+from module.InferenceWorker import NUM_LANDMARKS
+
+
+class BackgroundDetector:
+    # Builds the hand detector on a thread, so importing mediapipe and loading its graphs
+    # overlaps with opening the camera and building the painter. warm_up(frame_size) hands
+    # it the frame size once that is known; the thread then runs the slow first inference
+    # on a blank frame. Until all of that is done find_hand_array() finds no hands and the
+    # frames are shown without; afterwards everything is forwarded to the detector.
+
+    def __init__(self, factory):
+        self.detector = None
+        self.error = None
+        self.frame_size = None
+        self.size_known = threading.Event()
+        self.ready = threading.Event()
+        self.no_hands = np.zeros((0, NUM_LANDMARKS, 3), np.int32)
+        self.thread = threading.Thread(target=self._load, args=(factory,), name='BackgroundDetector', daemon=True)
+        self.thread.start()
+
+    def _load(self, factory):
+        try:
+            detector = factory()
+            self.size_known.wait()
+            if self.frame_size is not None:
+                detector.warm_up(self.frame_size)
+            self.detector = detector
+        except Exception as error:
+            self.error = error
+        self.ready.set()
+
+    def warm_up(self, frame_size):
+        self.frame_size = tuple(frame_size)
+        self.size_known.set()
+
+    def wait(self):
+        self.size_known.set()
+        self.ready.wait()
+        if self.error is not None:
+            raise self.error
+        return self.detector
+
+    def __getattr__(self, name):
+        # only reached for what the detector has and this class does not, waits for it
+        return getattr(self.wait(), name)
+
+    @property
+    def landmark_age(self):
+        return 0.0 if self.detector is None else self.detector.landmark_age
+
+    def find_hand_array(self, img, draw=True, rgb=None):
+        if self.detector is None:
+            if self.error is not None:
+                raise self.error
+            return img, self.no_hands
+        return self.detector.find_hand_array(img, draw, rgb)
+
+    def find_hand(self, img, draw=True, rgb=None):
+        img, _ = self.find_hand_array(img, draw, rgb)
+        return img, [] if self.detector is None else self.detector.hand_list
+
+    def close(self):
+        self.size_known.set()
+        self.ready.wait()
+        if self.detector is not None:
+            self.detector.close()
+
+
+class StartupTimer:
+    # milliseconds from start (perf_counter) to the first shown frame and to the first frame
+    # a hand was found in, each noted once
+    def __init__(self, start):
+        self.start = start
+        self.first_frame_ms = None
+        self.first_landmark_ms = None
+
+    @property
+    def done(self):
+        return self.first_landmark_ms is not None
+
+    def frame_shown(self, num_hands):
+        # returns a line to report when a milestone was reached with this frame, else None
+        elapsed = (time.perf_counter() - self.start) * 1000.0
+        lines = []
+        if self.first_frame_ms is None:
+            self.first_frame_ms = elapsed
+            lines.append(f'first frame after {elapsed:.0f} ms')
+        if num_hands and self.first_landmark_ms is None:
+            self.first_landmark_ms = elapsed
+            lines.append(f'first hand after {elapsed:.0f} ms')
+        return ', '.join(lines) or None
@@ -0,0 +1,194 @@
+import cv2
+import numpy as np
+
+TOOL_BRUSH = 0  # polyline of cv2.line segments, thickness is the line width
+TOOL_ERASER = 1  # filled cv2.circle at every point, thickness is the radius
+TOOL_FILL = 2  # flood fill from the first point, limited to the rect of the other two
+
+# columns of StrokeStore.strokes
+TOOL, COLOR, THICKNESS, START, COUNT, LAYER = range(6)
+
+
+class StrokeStore:
+    # Append-only vector record of everything drawn on the canvas. Points live in one
+    # (N, 2) int32 buffer, strokes in one (M, 6) int32 table of
+    # (tool, color index, thickness, first point, point count, layer); both grow by whole chunks.
+    # Consecutive draw calls that continue the open stroke extend it instead of adding one.
+    # undo_to()/redo_to() only move the visible stroke count, starting a new stroke drops
+    # the undone tail.
+
+    def __init__(self, canvas_size, chunk=4096):
+        self.canvas_size = tuple(canvas_size)
+        self.chunk = chunk
+
+        self.points = np.empty((chunk, 2), np.int32)
+        self.strokes = np.empty((chunk // 8, 6), np.int32)
+        self.point_count = 0
+        self.stroke_count = 0
+        self.redo_limit = 0
+        self.open = False
+
+        self.palette = []
+        self.palette_index = {}
+
+    @property
+    def nbytes(self):
+        return self.point_count * self.points.itemsize * 2 + self.stroke_count * self.strokes.itemsize * 6
+
+    def color_index(self, color):
+        color = tuple(int(c) for c in color)
+        idx = self.palette_index.get(color)
+        if idx is None:
+            idx = self.palette_index[color] = len(self.palette)
+            self.palette.append(color)
+        return idx
+
+    def _grow(self, buffer, rows):
+        grown = np.empty((len(buffer) + max(rows, self.chunk),) + buffer.shape[1:], buffer.dtype)
+        grown[:len(buffer)] = buffer
+        return grown
+
+    def _append_points(self, *points):
+        if self.point_count + len(points) > len(self.points):
+            self.points = self._grow(self.points, len(points))
+        self.points[self.point_count:self.point_count + len(points)] = points
+        self.point_count += len(points)
+        self.strokes[self.stroke_count - 1, COUNT] += len(points)
+
+    def _begin(self, tool, color, thickness, layer):
+        if self.stroke_count == len(self.strokes):
+            self.strokes = self._grow(self.strokes, 1)
+        self.strokes[self.stroke_count] = (tool, self.color_index(color), thickness, self.point_count, 0, layer)
+        self.stroke_count += 1
+        self.redo_limit = self.stroke_count
+        self.open = True
+
+    def _continues(self, tool, color, thickness, layer):
+        if not self.open:
+            return False
+        stroke = self.strokes[self.stroke_count - 1]
+        return (stroke[TOOL] == tool and stroke[THICKNESS] == thickness and stroke[LAYER] == layer and
+                self.palette[stroke[COLOR]] == tuple(int(c) for c in color))
+
+    def line(self, pt1, pt2, color, thickness, layer=0):
+        if (self._continues(TOOL_BRUSH, color, thickness, layer) and
+                tuple(self.points[self.point_count - 1]) == tuple(pt1)):
+            self._append_points(pt2)
+        else:
+            self._begin(TOOL_BRUSH, color, thickness, layer)
+            self._append_points(pt1, pt2)
+
+    def circle(self, center, radius, color, layer=0):
+        if not self._continues(TOOL_ERASER, color, radius, layer):
+            self._begin(TOOL_ERASER, color, radius, layer)
+        self._append_points(center)
+
+    def fill(self, seed, color, bounds, layer=0):
+        # bounds is the (x0, y0, x1, y1) area the fill was computed in
+        self._begin(TOOL_FILL, color, 0, layer)
+        self._append_points(seed, bounds[:2], bounds[2:])
+        self.end_stroke()
+
+    def end_stroke(self):
+        self.open = False
+
+    def undo_to(self, stroke_count):
+        self.end_stroke()
+        self.stroke_count = stroke_count
+        if stroke_count == 0:
+            self.point_count = 0
+        else:
+            last = self.strokes[stroke_count - 1]
+            self.point_count = int(last[START] + last[COUNT])
+
+    def redo_to(self, stroke_count):
+        self.undo_to(min(stroke_count, self.redo_limit))
+
+    def render(self, size=None, canvas=None, origin=(0, 0), layer=None, line_type=cv2.LINE_8):
+        # redraws the strokes at any size (coordinates and widths are scaled), with the stroke
+        # coordinate origin at the top left. Like CanvasCompositor, every layer gets its own
+        # colors and coverage: eraser dabs clear both and a fill floods the region of its own
+        # layer. The layers are then put over canvas (black by default) bottom first, fully
+        # opaque, or only the given one.
+        width, height = self.canvas_size if size is None else size
+        if canvas is None:
+            canvas = np.zeros((height, width, 3), np.uint8)
+
+        scale_x, scale_y = width / self.canvas_size[0], height / self.canvas_size[1]
+        scale = (scale_x + scale_y) / 2
+        points = self.points[:self.point_count]
+        if origin != (0, 0):
+            points = points - np.array(origin, np.int32)
+        if (width, height) != self.canvas_size:
+            points = np.rint(points * (scale_x, scale_y)).astype(np.int32)
+        points = points.tolist()
+
+        strokes = self.strokes[:self.stroke_count]
+        layers = sorted(set(strokes[:, LAYER].tolist())) if layer is None else [layer]
+        strokes = strokes.tolist()
+        pixels = np.empty((height, width, 3), np.uint8)
+        coverage = np.empty((height, width), np.uint8)
+
+        for index in layers:
+            pixels[:] = 0
+            coverage[:] = 0
+            for tool, color_idx, thickness, start, count, stroke_layer in strokes:
+                if stroke_layer != index:
+                    continue
+                color = self.palette[color_idx]
+                thickness = max(int(round(thickness * scale)), 1) if scale != 1 else thickness
+                stroke = points[start:start + count]
+
+                if tool == TOOL_BRUSH:
+                    for pt1, pt2 in zip(stroke, stroke[1:]):
+                        cv2.line(pixels, pt1, pt2, color, thickness, line_type)
+                        cv2.line(coverage, pt1, pt2, 255, thickness, line_type)
+                elif tool == TOOL_ERASER:
+                    for center in stroke:
+                        cv2.circle(pixels, center, thickness, (0, 0, 0), cv2.FILLED, line_type)
+                        cv2.circle(coverage, center, thickness, 0, cv2.FILLED, line_type)
+                elif tool == TOOL_FILL:
+                    self._fill(pixels, coverage, stroke, color)
+
+            # premultiplied "over", as CanvasCompositor.flatten does at full opacity
+            inverse = cv2.cvtColor(cv2.subtract(255, coverage), cv2.COLOR_GRAY2BGR)
+            cv2.multiply(canvas, inverse, dst=canvas, scale=1 / 255.0)
+            cv2.add(canvas, pixels, dst=canvas)
+
+        return canvas
+
+    @staticmethod
+    def _fill(pixels, coverage, stroke, color):
+        # the region of exactly the seed's color within the fill's bounds, like BucketFill
+        height, width = coverage.shape
+        (sx, sy), (x0, y0), (x1, y1) = stroke
+        x0, y0, x1, y1 = max(x0, 0), max(y0, 0), min(x1, width), min(y1, height)
+        if not (x0 <= sx < x1 and y0 <= sy < y1):
+            return
+        mask = np.zeros((y1 - y0 + 2, x1 - x0 + 2), np.uint8)
+        cv2.floodFill(pixels[y0:y1, x0:x1], mask, (sx - x0, sy - y0), 0, 0, 0, 4 | cv2.FLOODFILL_MASK_ONLY | (255 << 8))
+        painted = mask[1:-1, 1:-1] > 0
+        pixels[y0:y1, x0:x1][painted] = color
+        coverage[y0:y1, x0:x1][painted] = 255
+
+    def save(self, path):
+        np.savez_compressed(path, canvas_size=np.array(self.canvas_size, np.int32),
+                            points=self.points[:self.point_count], strokes=self.strokes[:self.stroke_count],
+                            palette=np.array(self.palette, np.int32).reshape(-1, 3))
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        store = cls(tuple(data['canvas_size'].tolist()))
+        points, strokes = data['points'], data['strokes']
+
+        store.points = store._grow(store.points[:0], len(points))
+        store.points[:len(points)] = points
+        store.point_count = len(points)
+        store.strokes = store._grow(store.strokes[:0], len(strokes))
+        store.strokes[:len(strokes)] = strokes
+        store.stroke_count = store.redo_limit = len(strokes)
+
+        for color in data['palette'].tolist():
+            store.color_index(color)
+        return store
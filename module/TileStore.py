@@ -0,0 +1,78 @@
+import tempfile
+
+import numpy as np
+
+
+class TileStore:
+    # Sparse, unbounded canvas made of tile_size x tile_size tiles of channels bytes per pixel
+    # (BGR, or BGR and coverage). A tile is allocated the first time something is painted
+    # on it; tiles live in slabs of slab_tiles tiles
+    # memory-mapped from one backing file (an anonymous temporary file when path is None),
+    # so boards larger than RAM only keep the recently used pages resident.
+    # Tile (tx, ty) covers world pixels [tx * tile_size, (tx + 1) * tile_size) and so on,
+    # coordinates may be negative.
+
+    def __init__(self, tile_size=256, path=None, slab_tiles=64, channels=3):
+        self.tile_size = tile_size
+        self.slab_tiles = slab_tiles
+        self.channels = channels
+        self.tile_bytes = tile_size * tile_size * channels
+
+        self.backing_file = tempfile.TemporaryFile() if path is None else open(path, 'w+b')
+        self.slabs = []
+        self.slots = {}  # (tx, ty) -> slot index, slot // slab_tiles picks the slab
+
+    def __len__(self):
+        return len(self.slots)
+
+    @property
+    def nbytes(self):
+        return len(self.slots) * self.tile_bytes
+
+    def keys(self):
+        return self.slots.keys()
+
+    def _add_slab(self):
+        offset = len(self.slabs) * self.slab_tiles * self.tile_bytes
+        self.backing_file.truncate(offset + self.slab_tiles * self.tile_bytes)  # new pages read as zeros
+        self.slabs.append(np.memmap(self.backing_file, np.uint8, 'r+', offset,
+                                    (self.slab_tiles, self.tile_size, self.tile_size, self.channels)))
+
+    def tile(self, tx, ty, create=False):
+        # the tile's pixels as a writable view, None for a blank tile unless create is set
+        slot = self.slots.get((tx, ty))
+        if slot is None:
+            if not create:
+                return None
+            slot = self.slots[(tx, ty)] = len(self.slots)
+            if slot // self.slab_tiles == len(self.slabs):
+                self._add_slab()
+        return self.slabs[slot // self.slab_tiles][slot % self.slab_tiles]
+
+    def region(self, x0, y0, x1, y1, create=False):
+        # view of a world rect that lies inside a single tile
+        size = self.tile_size
+        tx, ty = x0 // size, y0 // size
+        if (x1 - 1) // size != tx or (y1 - 1) // size != ty:
+            raise ValueError(f'region ({x0}, {y0}, {x1}, {y1}) spans more than one tile')
+
+        tile = self.tile(tx, ty, create)
+        if tile is None:
+            return None
+        return tile[y0 - ty * size:y1 - ty * size, x0 - tx * size:x1 - tx * size]
+
+    def overlapping(self, x0, y0, x1, y1):
+        # yields (tx, ty, (ix0, iy0, ix1, iy1)) for every tile position intersecting the world rect
+        size = self.tile_size
+        for ty in range(y0 // size, (y1 - 1) // size + 1):
+            for tx in range(x0 // size, (x1 - 1) // size + 1):
+                yield tx, ty, (max(x0, tx * size), max(y0, ty * size),
+                               min(x1, (tx + 1) * size), min(y1, (ty + 1) * size))
+
+    def flush(self):
+        for slab in self.slabs:
+            slab.flush()
+
+    def close(self):
+        self.slabs = []
+        self.backing_file.close()
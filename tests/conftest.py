@@ -0,0 +1,16 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FRAME_SIZE = (640, 480)
+
+# the tests import the painter's modules the way PainterModule.py does, from the repo root
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture(autouse=True)
+def repo_cwd(monkeypatch):
+    # the menus load their assets by relative path
+    monkeypatch.chdir(ROOT)
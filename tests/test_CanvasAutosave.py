@@ -0,0 +1,55 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+import PainterModule as pm
+from module.CanvasAutosave import FILE_HEADER, read_checkpoint
+from conftest import FRAME_SIZE, ROOT
+
+
+def start_painter(path):
+    painter = pm.Painter(FRAME_SIZE, infinite=True, autosave_file=str(path), icon_cache=None)
+    painter.compositor.line((10, 10), (300, 300), (0, 0, 255), 8)
+    canvas = painter.compositor.canvas.copy()
+    painter.close()
+    return canvas
+
+
+def check_restores(path, canvas):
+    painter = pm.Painter(FRAME_SIZE, infinite=True, autosave_file=str(path), icon_cache=None)
+    try:
+        assert (painter.compositor.canvas == canvas).all()
+    finally:
+        painter.close()
+
+
+@pytest.mark.parametrize('contents', [b'', b'VPAUTOSV\x01\x00'], ids=['empty', 'torn header'])
+def test_start_with_unfinished_file(tmp_path, contents):
+    path = tmp_path / 'session.autosave'
+    path.write_bytes(contents)
+    assert read_checkpoint(str(path))[2] is None
+
+    check_restores(path, start_painter(path))
+
+
+def test_crash_before_first_checkpoint(tmp_path):
+    path = tmp_path / 'session.autosave'
+    crash = ('from module.CanvasAutosave import CanvasAutosave\n'
+             'import os, sys\n'
+             'CanvasAutosave(sys.argv[1], 256)\n'
+             'os._exit(1)\n')
+    subprocess.run([sys.executable, '-c', crash, str(path)], cwd=ROOT, check=False)
+    assert os.path.getsize(path) == FILE_HEADER.size
+
+    check_restores(path, start_painter(path))
+
+
+@pytest.mark.parametrize('contents', [b'not a canvas, just some longer text', b'notes'], ids=['long', 'short'])
+def test_foreign_file_is_refused_and_left_alone(tmp_path, contents):
+    path = tmp_path / 'notes.txt'
+    path.write_bytes(contents)
+    with pytest.raises(ValueError, match='not an autosave file'):
+        pm.Painter(FRAME_SIZE, infinite=True, autosave_file=str(path), icon_cache=None)
+    assert path.read_bytes() == contents
@@ -0,0 +1,105 @@
+import cv2
+import numpy as np
+import pytest
+
+import PainterModule as pm
+import module.FrameIO as FrameIO
+import module.PainterMenu as PM
+from PainterBenchmark import synthetic_hand
+from conftest import FRAME_SIZE
+
+
+def replay(painter, hands):
+    # one frame per entry of hands, each a list of synthetic hands
+    log = {'frame_size': list(FRAME_SIZE), 'records': [{'hands': frame_hands} for frame_hands in hands]}
+    detector = FrameIO.ReplayDetector(log)
+    img = np.zeros((FRAME_SIZE[1], FRAME_SIZE[0], 3), np.uint8)
+    for _ in hands:
+        painter.process(img.copy(), detector)
+
+
+def test_sync_fill_lands_on_its_frame():
+    painter = pm.Painter(FRAME_SIZE, infinite=False, icon_cache=None, sync_fill=True)
+    try:
+        painter.menu.select_by_mode(PM.MenuMode.fill, cv2)
+        replay(painter, [[synthetic_hand(320, 300)]])
+        assert painter.compositor.active_layer.coverage.all()
+    finally:
+        painter.close()
+
+
+def test_busy_bucket_fills_on_a_later_frame(monkeypatch):
+    painter = pm.Painter(FRAME_SIZE, infinite=False, icon_cache=None, sync_fill=True)
+    try:
+        painter.menu.select_by_mode(PM.MenuMode.fill, cv2)
+        start = painter.bucket.start
+        calls = []
+
+        def busy_once(*args):
+            # the first frame finds the bucket busy
+            calls.append(args)
+            return len(calls) > 1 and start(*args)
+
+        monkeypatch.setattr(painter.bucket, 'start', busy_once)
+        replay(painter, [[synthetic_hand(320, 300)], [synthetic_hand(320, 300)]])
+        assert len(calls) == 2 and painter.compositor.active_layer.coverage.all()
+    finally:
+        painter.close()
+
+
+@pytest.mark.parametrize('pause', [[synthetic_hand(320, 300, index_up=False)], []], ids=['finger down', 'hand lost'])
+def test_each_stroke_is_one_undo_step(pause):
+    painter = pm.Painter(FRAME_SIZE, infinite=False, icon_cache=None)
+    try:
+        painter.menu.select_by_mode(PM.MenuMode.paint, cv2)
+        replay(painter, [[synthetic_hand(200, 250)], [synthetic_hand(260, 250)], pause,
+                         [synthetic_hand(400, 300)], [synthetic_hand(460, 300)]])
+        coverage = painter.compositor.active_layer.coverage
+        # the index finger tip is 20 px above the hand's position
+        assert coverage[230, 230] and coverage[280, 430]
+        assert not coverage[255, 330]  # no line from where the first stroke ended
+
+        painter.undo()
+        assert coverage[230, 230] and not coverage[280, 430]
+    finally:
+        painter.close()
+
+
+def test_palette_shows_over_the_paint():
+    painter = pm.Painter(FRAME_SIZE, infinite=False, icon_cache=None)
+    try:
+        painter.compositor.line((0, 240), (640, 240), (0, 0, 255), 60)
+        painter.menu.select_by_mode(PM.MenuMode.color, cv2)
+        log = {'frame_size': list(FRAME_SIZE), 'records': [{'hands': []}]}
+        img = painter.process(np.zeros((FRAME_SIZE[1], FRAME_SIZE[0], 3), np.uint8), FrameIO.ReplayDetector(log))
+
+        # the red line runs through the wheel, which shows the color pick() reads there
+        color = painter.palette.pick((320, 240))
+        assert color is not None and color != (0, 0, 255)
+        assert tuple(img[240, 320].tolist()) == color
+    finally:
+        painter.close()
+
+
+class KeySink:
+    # takes three frames, 'h' pressed on the first
+    def __init__(self):
+        self.shown = 0
+        self.key = -1
+
+    def show(self, img):
+        self.shown += 1
+        self.key = ord('h') if self.shown == 1 else -1
+        return self.shown < 3
+
+    def release(self):
+        pass
+
+
+def test_hud_toggle_leaves_null_metrics_alone():
+    log = {'frame_size': list(FRAME_SIZE), 'records': [{'hands': []}] * 3}
+    painter = pm.run(FrameIO.LandmarkLogSource(log), FrameIO.ReplayDetector(log), KeySink())
+    try:
+        assert not pm.NULL_METRICS.enabled and not pm.NULL_METRICS.show_hud
+    finally:
+        painter.close()
@@ -0,0 +1,120 @@
+import threading
+from multiprocessing.connection import Client, Listener
+
+import numpy as np
+import pytest
+
+import PainterModule as pm
+import module.PaintingServer as PS
+from module.InferenceWorker import NUM_LANDMARKS
+
+FAILING_SIZE = (300, 240)  # sessions of this frame size get a painter that raises
+TIMEOUT = 5.0  # a server that went down does not answer at all
+
+
+class InstantPool:
+    # stands in for the MediaPipe workers: every frame comes back at once, without hands
+    started = 0
+
+    def __init__(self, num_workers, hands_args, max_inference_size):
+        self.idle = [0]
+        self.finished = []
+        self.seq = 0
+
+    def start(self, frame_shape):
+        InstantPool.started += 1
+
+    def submit(self, frame, roi=None, timestamp=None):
+        self.seq += 1
+        self.finished.append((self.seq, timestamp, roi, np.empty((0, NUM_LANDMARKS, 2), np.float32), []))
+        return self.seq
+
+    def collect(self):
+        finished, self.finished = self.finished, []
+        return finished
+
+    def close(self):
+        pass
+
+
+class FailingPainter(pm.Painter):
+    def process(self, img, hand_detector):
+        raise RuntimeError('painter broke')
+
+
+def create_painter(frame_size):
+    painter_class = FailingPainter if tuple(frame_size) == FAILING_SIZE else pm.Painter
+    return painter_class(frame_size, icon_cache=None)
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    monkeypatch.setattr(PS, 'InferencePool', InstantPool)
+    server = PS.PaintingServer(str(tmp_path / 'painter.sock'), create_painter, max_frame_size=(640, 480),
+                               min_frame_size=pm.SERVER_MIN_FRAME_SIZE, key_handler=pm.handle_key)
+    thread = threading.Thread(target=server.serve, kwargs=dict(duration=60))
+    thread.start()
+    yield server
+    server.stop()
+    thread.join()
+    server.close()
+
+
+def send_raw(address, messages, hello=None, pixels=None):
+    # the first answer to messages after a hello (whose welcome must come first when given)
+    conn = Client(address, authkey=PS.AUTHKEY)
+    try:
+        if hello is not None:
+            conn.send(hello)
+            assert conn.poll(TIMEOUT) and conn.recv()[0] == 'welcome'
+        for message in messages:
+            conn.send(message)
+        if pixels is not None:
+            conn.send_bytes(pixels)
+        assert conn.poll(TIMEOUT)
+        return conn.recv()
+    finally:
+        conn.close()
+
+
+def round_trip(client, img):
+    client.send(img)
+    assert client.receive(TIMEOUT) == 'frame'
+
+
+@pytest.mark.parametrize('messages, hello, pixels', [
+    ([('key',)], ('hello', (320, 240)), None),
+    ([('frame',)], ('hello', (320, 240)), None),
+    ([('key', 'z')], ('hello', (320, 240)), None),
+    ([('paint', 1)], ('hello', (320, 240)), None),
+    (['frame'], ('hello', (320, 240)), None),
+    ([('frame', 0)], ('hello', FAILING_SIZE), bytes(FAILING_SIZE[0] * FAILING_SIZE[1] * 3)),
+    ([('hello', (64, 48))], None, None),
+    ([('hello', (0, 0))], None, None),
+    ([('hello', ('wide', 'high'))], None, None),
+    ([('hello', (320,))], None, None),
+], ids=['key without key', 'frame without id', 'key not a number', 'unknown kind', 'not a tuple',
+        'painter raises', 'hello too small', 'hello empty', 'hello size not numbers', 'hello size one number'])
+def test_bad_client_only_ends_its_own_session(server, messages, hello, pixels):
+    good = PS.PaintingClient(server.address, (320, 240))
+    img = np.zeros((240, 320, 3), np.uint8)
+    try:
+        round_trip(good, img)
+        assert send_raw(server.address, messages, hello, pixels)[0] == 'error'
+        for _ in range(3):
+            round_trip(good, img)
+    finally:
+        good.conn.close()  # close() would wait for answers a dead server never sends
+
+
+def test_taken_address_starts_no_workers(tmp_path, monkeypatch):
+    monkeypatch.setattr(PS, 'InferencePool', InstantPool)
+    monkeypatch.setattr(InstantPool, 'started', 0)
+    address = str(tmp_path / 'painter.sock')
+    taken = Listener(address)
+    try:
+        with pytest.raises(OSError):
+            PS.PaintingServer(address, create_painter)
+        assert InstantPool.started == 0
+    finally:
+        taken.close()
@@ -0,0 +1,55 @@
+from module.BucketFill import BucketFill
+from module.CanvasCompositor import CanvasCompositor
+from module.StrokeStore import StrokeStore
+
+SIZE = (320, 240)
+RED, GREEN, BLUE, ERASE = (0, 0, 255), (0, 255, 0), (255, 0, 0), (0, 0, 0)
+
+
+class Recorder:
+    # draws like Painter does: into the compositor's active layer and into the stroke store
+    def __init__(self):
+        self.compositor = CanvasCompositor(SIZE)
+        self.strokes = StrokeStore(SIZE)
+        self.bucket = BucketFill()
+
+    def line(self, pt1, pt2, color, thickness):
+        self.compositor.line(pt1, pt2, color, thickness)
+        self.strokes.line(pt1, pt2, color, thickness, self.compositor.active)
+
+    def erase(self, center, radius):
+        self.compositor.erase(center, radius)
+        self.strokes.circle(center, radius, ERASE, self.compositor.active)
+        self.strokes.end_stroke()
+
+    def fill(self, seed, color):
+        mask, rect = self.bucket.fill(self.compositor.active_layer.pixels, seed)
+        self.compositor.fill_mask(mask, rect, color)
+        self.strokes.fill(seed, color, (0, 0) + SIZE, self.compositor.active)
+
+    def layer(self):
+        self.strokes.end_stroke()
+        self.compositor.active = self.compositor.add_layer()
+
+
+def test_render_matches_layers(tmp_path):
+    recorder = Recorder()
+    recorder.line((20, 120), (300, 120), RED, 10)
+    recorder.fill((10, 10), BLUE)
+    recorder.layer()
+    recorder.line((160, 20), (160, 220), GREEN, 12)
+    recorder.erase((160, 120), 30)  # the red line below shows through again
+    for pt1, pt2 in [((200, 160), (300, 160)), ((300, 160), (300, 220)), ((300, 220), (200, 220)),
+                     ((200, 220), (200, 160))]:
+        recorder.line(pt1, pt2, GREEN, 4)
+    recorder.fill((250, 190), RED)  # the empty inside of the box on this layer, blue is below
+
+    canvas = recorder.compositor.canvas
+    assert (canvas[120, 160] == RED).all()
+    assert (canvas[190, 250] == RED).all() and (canvas[10, 10] == BLUE).all()
+    assert (recorder.strokes.render() == canvas).all()
+
+    path = tmp_path / 'strokes.npz'
+    recorder.strokes.save(path)
+    assert (StrokeStore.load(path).render() == canvas).all()
+    recorder.bucket.close()